@@ -0,0 +1,262 @@
+"""
+Offline batch submission of prompts
+
+Bulk work that is not latency sensitive, like generating the contents of
+all files in a honeypot, can be sent as one batch job instead of thousands
+of interactive requests. Every prompt is written as a line in a JSONL job
+file, the job is submitted through a batch backend, and the results are
+read back once the backend reports that the job is completed.
+"""
+
+import os
+import json
+import time
+import shutil
+import logging
+import threading
+from pathlib import Path
+from abc import ABC, abstractmethod
+
+from BlueLLMTeam.LLMEndpoint import LLMEndpointBase, EchoEndpoint, client, chatgpt_request, MAX_CHATGPT_TOKENS
+from BlueLLMTeam.utils.text import generate_random_id
+from BlueLLMTeam.utils.model_policy import ModelPolicy
+
+
+logger = logging.getLogger(__name__)
+
+BATCH_POLL_INTERVAL = float(os.getenv("BATCH_POLL_INTERVAL", 30.0))
+BATCH_TIMEOUT = float(os.getenv("BATCH_TIMEOUT", 24 * 60 * 60))
+BATCH_ENDPOINT = "/v1/chat/completions"
+
+COMPLETED = "completed"
+IN_PROGRESS = "in_progress"
+FAILED = "failed"
+
+
+class BatchBackendBase(ABC):
+    """
+    Base class for services that run batch jobs of chat completion requests
+    """
+
+    # Seconds between status checks
+    poll_interval = BATCH_POLL_INTERVAL
+    # Policy applied to the prompts before they are written to the job file
+    model_policy: ModelPolicy | None = None
+
+    @abstractmethod
+    def submit(self, job_file: Path) -> str:
+        """
+        Submit a JSONL job file
+
+        Returns:
+            batch_id: id used to follow the batch
+        """
+
+    @abstractmethod
+    def status(self, batch_id: str) -> str:
+        """
+        Get the status of a batch. One of 'in_progress', 'completed' or 'failed'
+        """
+
+    @abstractmethod
+    def results(self, batch_id: str) -> str:
+        """
+        Get the output of a completed batch as JSONL text
+        """
+
+
+class OpenAIBatchBackend(BatchBackendBase):
+    """
+    Run batches with the OpenAI Batch API
+    """
+
+    def __init__(self, completion_window: str = "24h") -> None:
+        super().__init__()
+        self.completion_window = completion_window
+
+    def submit(self, job_file: Path) -> str:
+        with open(job_file, "rb") as f:
+            input_file = client.files.create(file=f, purpose="batch")
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=self.completion_window,
+        )
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        status = client.batches.retrieve(batch_id).status
+        if status == "completed":
+            return COMPLETED
+        if status in ("failed", "expired", "cancelled", "cancelling"):
+            return FAILED
+        return IN_PROGRESS
+
+    def results(self, batch_id: str) -> str:
+        batch = client.batches.retrieve(batch_id)
+        if batch.output_file_id is None:
+            return ""
+        return client.files.content(batch.output_file_id).text
+
+
+class LocalBatchBackend(BatchBackendBase):
+    """
+    File based stand-in for a batch service
+
+    Jobs are copied to a local directory and answered in a background thread
+    by an LLM endpoint. The output is written in the same format as the
+    OpenAI Batch API, so the whole batch flow can be run without a network.
+    """
+
+    poll_interval = 0.1
+
+    def __init__(self, directory: Path, llm_endpoint: LLMEndpointBase = None) -> None:
+        super().__init__()
+        self.directory = Path(directory)
+        self.llm = llm_endpoint or EchoEndpoint()
+
+    def submit(self, job_file: Path) -> str:
+        batch_id = f"batch_{generate_random_id(16)}"
+        batch_dir = self.directory / batch_id
+        batch_dir.mkdir(parents=True, exist_ok=True)
+        shutil.copy(job_file, batch_dir / "input.jsonl")
+        threading.Thread(target=self._run, args=(batch_dir,), daemon=True).start()
+        return batch_id
+
+    def _run(self, batch_dir: Path) -> None:
+        lines = []
+        for line in (batch_dir / "input.jsonl").read_text().splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            messages = request["body"]["messages"]
+            prompt_dict = {
+                "systemRole": messages[0]["content"],
+                "user": "",
+                "context": "",
+                "message": messages[1]["content"],
+                "model": request["body"].get("model"),
+                "max_tokens": request["body"].get("max_tokens"),
+                "json_format": request["body"].get("response_format", {}).get("type") == "json_object",
+            }
+            try:
+                content = self.llm.ask(prompt_dict)
+                result = {
+                    "custom_id": request["custom_id"],
+                    "response": {
+                        "status_code": 200,
+                        "body": {"choices": [{"message": {"role": "assistant", "content": content}}]},
+                    },
+                    "error": None,
+                }
+            except Exception as e:
+                result = {
+                    "custom_id": request["custom_id"],
+                    "response": None,
+                    "error": {"message": str(e)},
+                }
+            lines.append(json.dumps(result))
+        # Write to a temporary file so the status only changes when the output is complete
+        tmp_path = batch_dir / "output.jsonl.tmp"
+        tmp_path.write_text("\n".join(lines) + "\n")
+        os.replace(tmp_path, batch_dir / "output.jsonl")
+
+    def status(self, batch_id: str) -> str:
+        batch_dir = self.directory / batch_id
+        if not batch_dir.exists():
+            return FAILED
+        if (batch_dir / "output.jsonl").exists():
+            return COMPLETED
+        return IN_PROGRESS
+
+    def results(self, batch_id: str) -> str:
+        return (self.directory / batch_id / "output.jsonl").read_text()
+
+
+def write_job_file(job_file: Path, prompts: dict[str, dict], token_limit: int = MAX_CHATGPT_TOKENS) -> None:
+    """
+    Write prompts to a JSONL job file. The keys of prompts are used as custom ids
+    """
+    job_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(job_file, "w") as f:
+        for custom_id, prompt_dict in prompts.items():
+            request = {
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": chatgpt_request(prompt_dict, token_limit),
+            }
+            f.write(json.dumps(request) + "\n")
+
+
+def parse_results(output: str) -> dict[str, str]:
+    """
+    Parse the JSONL output of a batch into a dictionary from custom id to response.
+    Failed requests are left out
+    """
+    responses = {}
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        try:
+            result = json.loads(line)
+            if result.get("error"):
+                logger.warning(f"Batch request {result['custom_id']} failed: {result['error']}")
+                continue
+            response = result["response"]
+            if response["status_code"] != 200:
+                logger.warning(f"Batch request {result['custom_id']} failed with status {response['status_code']}")
+                continue
+            responses[result["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            logger.warning(f"Could not parse batch result: {e}")
+    return responses
+
+
+def run_batch(
+        prompts: dict[str, dict],
+        backend: BatchBackendBase,
+        work_dir: Path,
+        poll_interval: float = None,
+        timeout: float = BATCH_TIMEOUT,
+    ) -> dict[str, str]:
+    """
+    Run a batch of prompts and wait for the results
+
+    Arguments:
+        prompts: prompts to send, keyed by a unique id
+        backend: batch backend to run the job with
+        work_dir: directory to write the job file to
+        poll_interval: seconds between status checks. Defaults to the interval of the backend
+        timeout: give up waiting after this many seconds
+
+    Returns:
+        responses: the responses keyed by the prompt ids. Failed prompts are missing
+    """
+    if not prompts:
+        return {}
+    if poll_interval is None:
+        poll_interval = backend.poll_interval
+
+    if backend.model_policy is not None:
+        prompts = {custom_id: backend.model_policy.apply(prompt_dict) for custom_id, prompt_dict in prompts.items()}
+
+    job_file = Path(work_dir) / f"job_{generate_random_id(8)}.jsonl"
+    write_job_file(job_file, prompts)
+    batch_id = backend.submit(job_file)
+    logger.info(f"Submitted batch {batch_id} with {len(prompts)} prompts")
+
+    start = time.monotonic()
+    while True:
+        status = backend.status(batch_id)
+        if status == COMPLETED:
+            break
+        if status == FAILED:
+            logger.error(f"Batch {batch_id} failed")
+            return {}
+        if time.monotonic() - start > timeout:
+            logger.error(f"Batch {batch_id} did not complete within {timeout} seconds")
+            return {}
+        time.sleep(poll_interval)
+
+    return parse_results(backend.results(batch_id))
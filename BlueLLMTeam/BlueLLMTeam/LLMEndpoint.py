@@ -1,32 +1,260 @@
 #DECLARE ALL IMPORTS HERE.
 #BEFORE RUNNING CHECK REQUIREMENTES ARE INSTALLED THANKS!
 from abc import ABC, abstractmethod
-from openai import OpenAI, RateLimitError
+from openai import OpenAI, AsyncOpenAI, RateLimitError, APIConnectionError, InternalServerError
 import os
+import time
+import asyncio
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor, Future, CancelledError, wait, FIRST_COMPLETED
+from contextvars import ContextVar, copy_context
 from abc import ABC, abstractmethod
 from dotenv import load_dotenv
 import ollama
+import httpx
 import logging
-import time
-import random
+from pathlib import Path
 
 from BlueLLMTeam.database.db_interaction import add_prompt
-import threading
-from random import choice
+from BlueLLMTeam.utils.cache import ResponseCache, prompt_key
+from BlueLLMTeam.utils.ratelimit import RateLimiter, estimate_tokens, prompt_priority, CHARS_PER_TOKEN
+from BlueLLMTeam.utils.singleflight import SingleFlight, AsyncSingleFlight
+from BlueLLMTeam.utils.cassette import Cassette, CassetteMissError
+from BlueLLMTeam.utils.usage import UsageTracker
+from BlueLLMTeam.utils.retry import RetryPolicy, CircuitBreaker, CircuitOpenError
+from BlueLLMTeam.utils.stats import RollingStats
+from BlueLLMTeam.utils.model_policy import ModelPolicy
+from BlueLLMTeam.utils.token_budget import TokenBudget
+from BlueLLMTeam.utils.similarity import SimilarityIndex, scope_key, subject_name, substitute_subject, SEMANTIC_CACHE_THRESHOLD
 # YOU WILL HAVE TO LOAD FROM YOUR ENVINVORNMENT FILE
 # Load environment variables from the .env file
 load_dotenv()
 # Get the OpenAI API key from the environment variables
+# GPT_BASE_URL can point the client at another server, e.g. BlueLLMTeam.mock_server
+GPT_BASE_URL = os.getenv("GPT_BASE_URL")
+GPT_TIMEOUT = float(os.getenv("GPT_TIMEOUT", 120.0))
 client = OpenAI(
     # This is the default and can be omitted
-    api_key=os.getenv('GPT_KEY')
+    api_key=os.getenv('GPT_KEY'),
+    base_url=GPT_BASE_URL,
+    timeout=GPT_TIMEOUT,
+    # Retries are handled by the endpoints
+    max_retries=0,
 )
 
 logger = logging.getLogger(__name__)
 
 MAX_TIME_BETWEEN_RETRIES = float(os.getenv("MAX_TIME_BETWEEN_RETRIES", 2.0))
+MAX_RETRIES = int(os.getenv("MAX_RETRIES", 3))
+MAX_RETRY_DELAY = float(os.getenv("MAX_RETRY_DELAY", 30.0))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", 30.0))
 MAX_CHATGPT_REQUESTS = int(os.getenv("MAX_CHATGPT_REQUESTS", 16))
 MAX_CHATGPT_TOKENS = int(os.getenv("MAX_CHATGPT_TOKENS", 2048))
+OLLAMA_HOST = os.getenv("OLLAMA_HOST")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama2-uncensored")
+CHATGPT_REQUESTS_PER_MINUTE = int(os.getenv("CHATGPT_REQUESTS_PER_MINUTE", 500))
+CHATGPT_TOKENS_PER_MINUTE = int(os.getenv("CHATGPT_TOKENS_PER_MINUTE", 200000))
+
+chatgpt_rate_limiter = RateLimiter(
+    requests_per_minute=CHATGPT_REQUESTS_PER_MINUTE,
+    tokens_per_minute=CHATGPT_TOKENS_PER_MINUTE,
+    max_concurrency=MAX_CHATGPT_REQUESTS,
+    default_cooldown=MAX_TIME_BETWEEN_RETRIES,
+)
+default_retry_policy = RetryPolicy(
+    max_retries=MAX_RETRIES,
+    base_delay=MAX_TIME_BETWEEN_RETRIES / 4,
+    max_delay=MAX_RETRY_DELAY,
+)
+chatgpt_circuit_breaker = CircuitBreaker(
+    "ChatGPT",
+    failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+    reset_timeout=CIRCUIT_RESET_TIMEOUT,
+)
+
+
+# Token usage of the last request made by the current thread or asyncio task
+_last_usage: ContextVar[dict | None] = ContextVar("last_usage", default=None)
+
+
+def last_usage() -> dict | None:
+    """
+    Get the usage of the last request made in the current thread or asyncio task
+
+    Returns:
+        usage: dictionary with prompt_tokens, completion_tokens, finish_reason and retries,
+               or None if the endpoint does not report usage
+    """
+    return _last_usage.get()
+
+
+def set_last_usage(prompt_tokens: int = None, completion_tokens: int = None, finish_reason: str = None, retries: int = 0) -> None:
+    """
+    Set the usage of the request that was just made
+    """
+    _last_usage.set({
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "finish_reason": finish_reason,
+        "retries": retries,
+    })
+
+
+def is_quota_exhausted(error: Exception) -> bool:
+    """
+    Check if an error means that the API quota is used up, rather than a temporary rate limit
+    """
+    return isinstance(error, RateLimitError) and getattr(error, "code", None) == "insufficient_quota"
+
+
+def is_backend_failure(error: Exception) -> bool:
+    """
+    Check if an error means that the backend is failing, rather than a problem with the request or its rate
+
+    Only these errors count towards opening a circuit breaker.
+    """
+    if isinstance(error, (APIConnectionError, InternalServerError, httpx.TransportError)):
+        # Includes timeouts
+        return True
+    if isinstance(error, ollama.ResponseError):
+        return error.status_code >= 500
+    return False
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Check if a request that failed with this error is worth retrying
+    """
+    if isinstance(error, RateLimitError):
+        return not is_quota_exhausted(error)
+    if isinstance(error, ollama.ResponseError) and error.status_code == 429:
+        return True
+    return is_backend_failure(error)
+
+
+def settle_circuit(circuit_breaker: CircuitBreaker, error: Exception, probe: bool) -> None:
+    """
+    Update a circuit breaker after a request failed with this error
+
+    Quota errors open the circuit and backend failures count towards opening
+    it. Other errors leave it as it is, but free the probe of a half open circuit.
+    """
+    if is_quota_exhausted(error):
+        circuit_breaker.trip()
+    elif is_backend_failure(error):
+        circuit_breaker.on_failure()
+    elif probe:
+        circuit_breaker.release_probe()
+
+
+def retry_after(error: Exception) -> float | None:
+    """
+    Get the time in seconds the server asks us to wait before retrying, if any
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+def chat_messages(prompt_dict: dict[str, str]) -> list[dict[str, str]]:
+    """
+    Create the chat messages for a prompt_dict
+    """
+    return [
+        {"role": "system", "content": prompt_dict['systemRole']},
+        {"role": "user", "content": f"{prompt_dict['user']} {prompt_dict['context']} {prompt_dict['message']}"}
+    ]
+
+
+def chatgpt_response_format(prompt_dict: dict[str, str]) -> dict[str, str]:
+    """
+    Get the response format for a ChatGPT request
+    """
+    if prompt_dict.get("json_format", False):
+        return { "type": "json_object" }
+    return {"type":"text"}
+
+
+def chatgpt_request(prompt_dict: dict[str, str], token_limit: int) -> dict:
+    """
+    Create the body of a ChatGPT chat completion request
+    """
+    return {
+        "model": prompt_dict.get("model", "gpt-3.5-turbo"),  # Specify the model you want to use
+        "messages": chat_messages(prompt_dict),
+        "max_tokens": min(token_limit, prompt_dict.get("max_tokens", token_limit)),
+        "response_format": chatgpt_response_format(prompt_dict),
+    }
+
+
+def ollama_request(prompt_dict: dict[str, str], model: str = None) -> dict:
+    """
+    Create the arguments of an Ollama chat request
+
+    The model argument overrides the model of the prompt. Prompts are written
+    for ChatGPT models, which Ollama does not know.
+    """
+    request = {
+        "model": model or prompt_dict.get("model", OLLAMA_MODEL),
+        "messages": chat_messages(prompt_dict),
+    }
+    if prompt_dict.get("json_format", False):
+        request["format"] = "json"
+    if prompt_dict.get("max_tokens") is not None:
+        request["options"] = {"num_predict": prompt_dict["max_tokens"]}
+    return request
+
+
+def log_prompt(prompt_dict: dict[str, str], output_message: str) -> None:
+    """
+    Store the prompt and the response in the prompt log
+    """
+    add_prompt(
+        system_role=prompt_dict["systemRole"],
+        user=prompt_dict["user"],
+        context=prompt_dict["context"],
+        message=prompt_dict["message"],
+        output=output_message,
+        wait=False,
+    )
+
+
+def semantic_scope(prompt_dict: dict[str, str]) -> str:
+    """
+    Scope of a prompt in the semantic cache. Only prompts in the same scope are compared
+    """
+    return scope_key(
+        prompt_dict.get("kind"),
+        prompt_dict.get("model"),
+        prompt_dict.get("systemRole"),
+        prompt_dict.get("json_format", False),
+        # Never reuse the response for id_rsa for id_rsa.pub, or for a.sh for b.sh
+        subject_name(prompt_dict.get("subject") or ""),
+    )
+
+
+def semantic_cache_stats(threshold: float, hits: int, misses: int, entries: int) -> dict:
+    """
+    Summary of a semantic cache for the usage report
+    """
+    lookups = hits + misses
+    return {
+        "threshold": threshold,
+        "lookups": lookups,
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / lookups if lookups else 0.0,
+        "entries": entries,
+    }
 
 
 class LLMEndpointBase(ABC):
@@ -44,6 +272,13 @@ class LLMEndpointBase(ABC):
                 message: The message to the LLM agent.
                 model: The designated model to be used.
                 max_tokens: the largest amount of tokens allowed.
+                json_format: ask for a JSON object as response.
+                kind: (optional) name of the PromptDict function that built the prompt.
+                agent: (optional) role of the agent that sent the prompt.
+                target: (optional) path of the file the prompt creates contents for.
+                subject: (optional) the short input the prompt is built from, e.g. a command or a file path.
+                tier: (optional) model tier chosen by the model policy.
+                priority: (optional) utils.ratelimit.Priority of the request. Derived from agent and kind if missing.
 
         
         Returns:
@@ -51,6 +286,19 @@ class LLMEndpointBase(ABC):
         """
         pass
 
+class LLMEndpointWrapper(LLMEndpointBase):
+    """
+    Base class for endpoints that add behavior around another endpoint
+    """
+
+    def __init__(self, llm_endpoint: LLMEndpointBase) -> None:
+        super().__init__()
+        self.llm = llm_endpoint
+
+    def ask(self, prompt_dict: dict[str, str], **kwargs) -> str:
+        return self.llm.ask(prompt_dict, **kwargs)
+
+
 class EchoEndpoint(LLMEndpointBase):
     """
     Endpoint that can be used for testing. It echos the message back to the sender
@@ -61,79 +309,1053 @@ class EchoEndpoint(LLMEndpointBase):
 
 class ChatGPTEndpoint(LLMEndpointBase):
 
-    def __init__(self, request_limit: int = MAX_CHATGPT_REQUESTS, token_limit: int = MAX_CHATGPT_TOKENS) -> None:
+    def __init__(
+            self,
+            token_limit: int = MAX_CHATGPT_TOKENS,
+            rate_limiter: RateLimiter = None,
+            base_url: str = None,
+            retry_policy: RetryPolicy = None,
+            circuit_breaker: CircuitBreaker = None,
+        ) -> None:
         super().__init__()
-        self.request_limit = request_limit
         self.token_limit = token_limit
-        self.locks = [threading.Lock() for _ in range(self.request_limit)]
+        # All endpoints share the same API key, and therefore the same limits
+        self.rate_limiter = rate_limiter or chatgpt_rate_limiter
+        self.retry_policy = retry_policy or default_retry_policy
+        self.circuit_breaker = circuit_breaker or chatgpt_circuit_breaker
+        self.client = client if base_url is None else OpenAI(api_key=os.getenv('GPT_KEY'), base_url=base_url, timeout=GPT_TIMEOUT, max_retries=0)
 
-    def get_random_lock(self):
-        return choice(self.locks)
+    def ask(self, prompt_dict: dict[str, str], max_retries: int = None):
+        if max_retries is None:
+            max_retries = self.retry_policy.max_retries
+        # Create a prompt from the prompt_dict
+        request = chatgpt_request(prompt_dict, self.token_limit)
+        estimated_tokens = estimate_tokens(prompt_dict, request["max_tokens"])
 
-    def ask(self, prompt_dict: dict[str, str], max_retries: int = 3, retry: int = 0):
-        try:
-            # Create a prompt from the prompt_dict
-            inputmessages = [
-                {"role": "system", "content": prompt_dict['systemRole']},
-                {"role": "user", "content": f"{prompt_dict['user']} {prompt_dict['context']} {prompt_dict['message']}"}
-            ]
-
-            if prompt_dict.get("json_format", False):
-                response_format = { "type": "json_object" }
-            else:
-                response_format = {"type":"text"}
-
-            # Make a request to the OpenAI API
-            token_limit = min(self.token_limit, prompt_dict.get("max_tokens", self.token_limit))
-            with self.get_random_lock():
-                response = client.chat.completions.create(
-                    model=prompt_dict.get("model", "gpt-3.5-turbo"),  # Specify the model you want to use
-                    messages=inputmessages,
-                    max_tokens=token_limit,
-                    response_format=response_format,
-                )
-            output_message = response.choices[0].message.content
-            add_prompt(
-                system_role=prompt_dict["systemRole"],
-                user=prompt_dict["user"],
-                context=prompt_dict["context"],
-                message=prompt_dict["message"],
-                output=output_message,
-                wait=False,
-            )
-            return output_message
-        except RateLimitError as e:
-            logger.warning(f"Rate limit exceeded. Will try {max_retries - retry} more times: {e.message}")
-            if retry >= max_retries:
+        retry = 0
+        while True:
+            # Fail fast if ChatGPT is down
+            probe = self.circuit_breaker.before_call()
+            try:
+                # Make a request to the OpenAI API once the rate limiter allows it.
+                # Interactive requests are served before queued bulk requests
+                with self.rate_limiter.limit(estimated_tokens, prompt_priority(prompt_dict)) as slot:
+                    raw_response = self.client.chat.completions.with_raw_response.create(**request)
+                    self.rate_limiter.update_from_headers(raw_response.headers)
+                    response = raw_response.parse()
+                    if response.usage is not None:
+                        slot.tokens = response.usage.total_tokens
+                self.rate_limiter.on_success()
+                self.circuit_breaker.on_success()
+                break
+            except Exception as e:
+                if isinstance(e, RateLimitError):
+                    self.rate_limiter.on_rate_limited(retry_after(e))
+                settle_circuit(self.circuit_breaker, e, probe)
+                if not is_retryable(e) or retry >= max_retries:
+                    logger.error(f"An error occurred when querying ChatGPT: {e}")
+                    raise
+                delay = self.retry_policy.delay(retry, retry_after(e))
+                logger.warning(f"ChatGPT request failed. Retrying in {delay:.2f}s, {max_retries - retry} more times: {e}")
+                time.sleep(delay)
+                retry += 1
+            except BaseException:
+                # E.g. a cancelled task. Let the next call probe the backend
+                if probe:
+                    self.circuit_breaker.release_probe()
                 raise
-            time.sleep(random.random() * MAX_TIME_BETWEEN_RETRIES)
-            return self.ask(prompt_dict=prompt_dict, max_retries=max_retries, retry=retry + 1)
-        except Exception as e:
-            logger.error(f"An error occurred when querying ChatGPT: {e}")
-            raise
+
+        output_message = response.choices[0].message.content
+        set_last_usage(
+            prompt_tokens=getattr(response.usage, "prompt_tokens", None),
+            completion_tokens=getattr(response.usage, "completion_tokens", None),
+            finish_reason=response.choices[0].finish_reason,
+            retries=retry,
+        )
+        log_prompt(prompt_dict, output_message)
+        return output_message
 
 
 class Llama2Endpoint(LLMEndpointBase):
 
-    def __init__(self, host: str = None) -> None:
+    def __init__(
+            self,
+            host: str = OLLAMA_HOST,
+            model: str = None,
+            retry_policy: RetryPolicy = None,
+            circuit_breaker: CircuitBreaker = None,
+        ) -> None:
         super().__init__()
         self.host = host
+        self.model = model
         self.client = ollama.Client(self.host)
+        self.retry_policy = retry_policy or default_retry_policy
+        self.circuit_breaker = circuit_breaker or CircuitBreaker(
+            f"Ollama {self.host or 'localhost'}",
+            failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+            reset_timeout=CIRCUIT_RESET_TIMEOUT,
+        )
     
     def ask(self, prompt_dict: dict[str, str]) -> str:
+        # Create a prompt from the prompt_dict
+        request = ollama_request(prompt_dict, self.model)
+
+        retry = 0
+        while True:
+            # Fail fast if Ollama is down
+            probe = self.circuit_breaker.before_call()
+            try:
+                # Make a request to the Ollama API
+                response = self.client.chat(**request)
+                self.circuit_breaker.on_success()
+                break
+            except Exception as e:
+                settle_circuit(self.circuit_breaker, e, probe)
+                if not is_retryable(e) or retry >= self.retry_policy.max_retries:
+                    logger.error(f"An error occurred: {e}")
+                    raise
+                delay = self.retry_policy.delay(retry)
+                logger.warning(f"Ollama request failed. Retrying in {delay:.2f}s: {e}")
+                time.sleep(delay)
+                retry += 1
+            except BaseException:
+                # E.g. a cancelled task. Let the next call probe the backend
+                if probe:
+                    self.circuit_breaker.release_probe()
+                raise
+
+        set_last_usage(
+            prompt_tokens=response.get("prompt_eval_count"),
+            completion_tokens=response.get("eval_count"),
+            finish_reason=response.get("done_reason"),
+            retries=retry,
+        )
+        return response["message"]["content"]
+
+
+class CachedEndpoint(LLMEndpointWrapper):
+    """
+    Endpoint that stores responses on the local disk and reuses them for identical prompts
+
+    Prompts with refresh set are sent again and replace the cached response,
+    e.g. when the caller could not use the cached one.
+    """
+
+    def __init__(self, llm_endpoint: LLMEndpointBase, cache: ResponseCache = None, refresh: bool = False) -> None:
+        super().__init__(llm_endpoint)
+        self.cache = cache or ResponseCache()
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+
+    def ask(self, prompt_dict: dict[str, str], use_cache: bool = True, refresh: bool = None, **kwargs) -> str:
+        """
+        Ask the LLM endpoint something, using the cache if possible
+
+        Arguments:
+            prompt_dict: The prompt to send
+            use_cache: Bypass the cache completely if False
+            refresh: Ignore any cached response but store the new one. Defaults to the endpoint and prompt setting
+        """
+        if not use_cache:
+            return self.llm.ask(prompt_dict, **kwargs)
+        if refresh is None:
+            refresh = self.refresh or prompt_dict.get("refresh", False)
+
+        key = prompt_key(prompt_dict)
+        if not refresh:
+            response = self.cache.get(key)
+            if response is not None:
+                self.hits += 1
+                return response
+
+        self.misses += 1
+        response = self.llm.ask(prompt_dict, **kwargs)
+        self.cache.set(key, response)
+        return response
+
+
+class SemanticCacheEndpoint(LLMEndpointWrapper):
+    """
+    Endpoint that reuses the response to a similar earlier prompt
+
+    Only prompts with a subject are looked up. Two prompts are compared if
+    they have the same kind, model, system role and subject name, i.e. the
+    subjects may only differ in their folders. If the character n-gram
+    similarity of their subjects is at least the threshold, the earlier
+    response is used with the old subject replaced by the new one.
+    Prompts with refresh set are not looked up. Responses are kept in memory for the run.
+    """
+
+    def __init__(self, llm_endpoint: LLMEndpointBase, threshold: float = SEMANTIC_CACHE_THRESHOLD, index: SimilarityIndex = None) -> None:
+        super().__init__(llm_endpoint)
+        self.threshold = threshold
+        self.index = index or SimilarityIndex()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def ask(self, prompt_dict: dict[str, str], **kwargs) -> str:
+        subject = prompt_dict.get("subject")
+        if not subject:
+            return self.llm.ask(prompt_dict, **kwargs)
+
+        scope = semantic_scope(prompt_dict)
+        match = None if prompt_dict.get("refresh") else self.index.search(scope, subject)
+        if match is not None and match.similarity >= self.threshold:
+            with self.lock:
+                self.hits += 1
+            logger.debug(f"Reusing the response for {match.subject!r} for {subject!r} ({match.similarity:.2f})")
+            return substitute_subject(match.value, match.subject, subject)
+
+        with self.lock:
+            self.misses += 1
+        response = self.llm.ask(prompt_dict, **kwargs)
+        self.index.add(scope, subject, response)
+        return response
+
+    def stats(self) -> dict:
+        return semantic_cache_stats(self.threshold, self.hits, self.misses, len(self.index))
+
+
+class TaggedEndpoint(LLMEndpointWrapper):
+    """
+    Endpoint that tags every prompt with the role of the agent using it
+
+    Tags that are already set on the prompt are kept.
+    """
+
+    def __init__(self, llm_endpoint: LLMEndpointBase, agent: str) -> None:
+        super().__init__(llm_endpoint)
+        self.agent = agent
+
+    def ask(self, prompt_dict: dict[str, str], **kwargs) -> str:
+        return self.llm.ask({"agent": self.agent, **prompt_dict}, **kwargs)
+
+
+class RefreshEndpoint(LLMEndpointWrapper):
+    """
+    Endpoint that asks for new responses to every prompt instead of cached ones
+
+    Used to generate something again after the user rejected it.
+    """
+
+    def ask(self, prompt_dict: dict[str, str], **kwargs) -> str:
+        return self.llm.ask({**prompt_dict, "refresh": True}, **kwargs)
+
+
+class ModelPolicyEndpoint(LLMEndpointWrapper):
+    """
+    Endpoint that picks the model and max_tokens of each prompt from a ModelPolicy
+
+    Place it outside the cache, so that cached responses are keyed by the chosen model.
+    """
+
+    def __init__(self, llm_endpoint: LLMEndpointBase, policy: ModelPolicy = None) -> None:
+        super().__init__(llm_endpoint)
+        self.policy = policy or ModelPolicy.from_file()
+
+    def ask(self, prompt_dict: dict[str, str], **kwargs) -> str:
+        return self.llm.ask(self.policy.apply(prompt_dict), **kwargs)
+
+
+class AdaptiveTokensEndpoint(LLMEndpointWrapper):
+    """
+    Endpoint that sets max_tokens from the lengths of earlier responses
+
+    A smaller max_tokens lets the rate limiter admit more requests and stops
+    runaway responses early. A response cut off by the smaller limit is asked
+    again with the max_tokens of the prompt, and the usage of both requests is
+    reported. Place it inside the recording, cache and single flight endpoints,
+    so that they are keyed by the max_tokens of the prompt rather than by the
+    learned one, and callers that share a request get the complete response.
+    """
+
+    def __init__(self, llm_endpoint: LLMEndpointBase, budget: TokenBudget = None, token_limit: int = MAX_CHATGPT_TOKENS) -> None:
+        super().__init__(llm_endpoint)
+        self.budget = budget or TokenBudget()
+        self.token_limit = token_limit
+        self.truncated = 0
+
+    @staticmethod
+    def _total(usage: dict, cut_off: dict, field: str) -> int | None:
+        if usage.get(field) is None:
+            return None
+        return usage[field] + (cut_off.get(field) or 0)
+
+    def ask(self, prompt_dict: dict[str, str], **kwargs) -> str:
+        limit = min(self.token_limit, prompt_dict.get("max_tokens", self.token_limit))
+        max_tokens = self.budget.max_tokens(prompt_dict, limit)
+        cut_off = None
+        if max_tokens < limit:
+            _last_usage.set(None)
+            response = self.llm.ask({**prompt_dict, "max_tokens": max_tokens}, **kwargs)
+            usage = last_usage() or {}
+            if usage.get("finish_reason") != "length":
+                self.budget.record(prompt_dict, usage.get("completion_tokens"))
+                return response
+            self.truncated += 1
+            cut_off = usage
+            logger.debug(f"Response to {prompt_dict.get('kind')} was cut off at {max_tokens} tokens. Asking again with {limit}")
+
+        _last_usage.set(None)
+        response = self.llm.ask(prompt_dict, **kwargs)
+        usage = last_usage() or {}
+        self.budget.record(prompt_dict, usage.get("completion_tokens"))
+        if cut_off is not None:
+            # The tokens of the cut off response were spent too
+            set_last_usage(
+                prompt_tokens=self._total(usage, cut_off, "prompt_tokens"),
+                completion_tokens=self._total(usage, cut_off, "completion_tokens"),
+                finish_reason=usage.get("finish_reason"),
+                retries=usage.get("retries", 0) + cut_off.get("retries", 0) + 1,
+            )
+        return response
+
+
+class AccountingEndpoint(LLMEndpointWrapper):
+    """
+    Endpoint that records the tokens, wall time and retries of every request
+
+    Usage is tagged by agent role and prompt kind. Endpoints that do not report
+    token usage are estimated from the length of the prompt and the response.
+    """
+
+    def __init__(self, llm_endpoint: LLMEndpointBase, tracker: UsageTracker = None) -> None:
+        super().__init__(llm_endpoint)
+        self.tracker = tracker or UsageTracker()
+
+    def ask(self, prompt_dict: dict[str, str], **kwargs) -> str:
+        _last_usage.set(None)
+        start = time.monotonic()
         try:
-            # Create a prompt from the prompt_dict
-            inputmessages = [
-                {"role": "system", "content": prompt_dict['systemRole']},
-                {"role": "user", "content": f"{prompt_dict['user']} {prompt_dict['context']} {prompt_dict['message']}"}
-            ]
-
-            # Make a request to the OpenAI API
-            response = self.client.chat(
-                model=prompt_dict.get("model", "llama2-uncensored"),  # Specify the model you want to use
-                messages=inputmessages
+            response = self.llm.ask(prompt_dict, **kwargs)
+        except Exception:
+            self.record_error(self.tracker, prompt_dict, time.monotonic() - start)
+            raise
+        self.record_usage(self.tracker, prompt_dict, response, time.monotonic() - start)
+        return response
+
+    @staticmethod
+    def record_usage(tracker: UsageTracker, prompt_dict: dict[str, str], response: str, seconds: float) -> None:
+        """
+        Record the usage of a request that was just answered
+        """
+        usage = last_usage() or {}
+        prompt_tokens = usage.get("prompt_tokens")
+        if prompt_tokens is None:
+            prompt_tokens = estimate_tokens(prompt_dict)
+        completion_tokens = usage.get("completion_tokens")
+        if completion_tokens is None:
+            completion_tokens = len(response or "") // CHARS_PER_TOKEN
+        tracker.record(
+            prompt_dict.get("agent", "unknown"),
+            prompt_dict.get("kind", "unknown"),
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            seconds=seconds,
+            retries=usage.get("retries", 0),
+        )
+
+    @staticmethod
+    def record_error(tracker: UsageTracker, prompt_dict: dict[str, str], seconds: float) -> None:
+        """
+        Record a request that failed
+        """
+        usage = last_usage() or {}
+        tracker.record(
+            prompt_dict.get("agent", "unknown"),
+            prompt_dict.get("kind", "unknown"),
+            seconds=seconds,
+            retries=usage.get("retries", 0),
+            error=True,
+        )
+
+
+class SingleFlightEndpoint(LLMEndpointWrapper):
+    """
+    Endpoint that sends identical prompts only once while they are in flight
+
+    Callers that ask the same prompt as a running request wait for its response.
+    Prompts asked one after the other are still sent each time.
+    """
+
+    def __init__(self, llm_endpoint: LLMEndpointBase) -> None:
+        super().__init__(llm_endpoint)
+        self.group = SingleFlight()
+        self.coalesced = 0
+
+    def ask(self, prompt_dict: dict[str, str], **kwargs) -> str:
+        response, shared = self.group.do(prompt_key(prompt_dict), self.llm.ask, prompt_dict, **kwargs)
+        if shared:
+            self.coalesced += 1
+        return response
+
+
+class RecordingEndpoint(LLMEndpointWrapper):
+    """
+    Endpoint that records every prompt and response to a cassette file
+
+    The cassette can be played back with ReplayEndpoint to run the pipeline offline.
+    """
+
+    def __init__(self, llm_endpoint: LLMEndpointBase, cassette: Cassette | Path | str) -> None:
+        super().__init__(llm_endpoint)
+        self.cassette = cassette if isinstance(cassette, Cassette) else Cassette(cassette)
+
+    def ask(self, prompt_dict: dict[str, str], **kwargs) -> str:
+        _last_usage.set(None)
+        start = time.monotonic()
+        response = self.llm.ask(prompt_dict, **kwargs)
+        latency = time.monotonic() - start
+        usage = last_usage() or {}
+        self.cassette.record(
+            prompt_dict,
+            response,
+            latency,
+            prompt_tokens=usage.get("prompt_tokens"),
+            completion_tokens=usage.get("completion_tokens"),
+        )
+        return response
+
+
+class ReplayEndpoint(LLMEndpointBase):
+    """
+    Endpoint that answers with responses recorded by RecordingEndpoint
+
+    Arguments:
+        cassette: the cassette to play back
+        latency_scale: sleep for the recorded latency times this factor. 0 disables the simulated latency
+        fallback: endpoint to ask for prompts missing in the cassette. Missing prompts raise CassetteMissError if None
+    """
+
+    def __init__(self, cassette: Cassette | Path | str, latency_scale: float = 0.0, fallback: LLMEndpointBase = None) -> None:
+        super().__init__()
+        self.cassette = cassette if isinstance(cassette, Cassette) else Cassette(cassette)
+        self.latency_scale = latency_scale
+        self.fallback = fallback
+
+    def ask(self, prompt_dict: dict[str, str], **kwargs) -> str:
+        interaction = self.cassette.play(prompt_dict)
+        if interaction is None:
+            if self.fallback is not None:
+                logger.info(f"Prompt {prompt_dict.get('kind')} not found in cassette {self.cassette.path}. Asking the fallback")
+                return self.fallback.ask(prompt_dict, **kwargs)
+            raise CassetteMissError(f"Prompt {prompt_dict.get('kind') or prompt_dict['message'][:50]!r} not found in cassette {self.cassette.path}")
+
+        if self.latency_scale > 0:
+            time.sleep(interaction.get("latency", 0.0) * self.latency_scale)
+        set_last_usage(
+            prompt_tokens=interaction.get("prompt_tokens"),
+            completion_tokens=interaction.get("completion_tokens"),
+        )
+        return interaction["response"]
+
+
+class RouterEndpoint(LLMEndpointBase):
+    """
+    Endpoint that spreads requests over several backends
+
+    Every request goes to the healthy backend with the lowest expected wait,
+    i.e. its rolling mean latency times the number of requests it is already
+    serving. A backend is unhealthy while its circuit breaker is open, e.g.
+    when the OpenAI quota is exhausted, or while too many of its recent
+    requests failed. A failed request is retried on the next backend.
+
+    Arguments:
+        backends: endpoints by name
+        max_error_rate: backends with a higher rolling error rate are only used when all others fail
+    """
+
+    def __init__(self, backends: dict[str, LLMEndpointBase], max_error_rate: float = 0.5) -> None:
+        super().__init__()
+        if not backends:
+            raise ValueError("RouterEndpoint needs at least one backend")
+        self.backends = backends
+        self.max_error_rate = max_error_rate
+        self.stats = {name: RollingStats() for name in backends}
+        self.in_flight = {name: 0 for name in backends}
+        self.lock = threading.Lock()
+
+    def is_healthy(self, name: str) -> bool:
+        breaker = getattr(self.backends[name], "circuit_breaker", None)
+        if breaker is not None and breaker.is_open:
+            return False
+        return self.stats[name].error_rate <= self.max_error_rate
+
+    def expected_wait(self, name: str) -> float:
+        latency = self.stats[name].mean_latency
+        if latency is None:
+            # Prefer idle backends without samples to learn their latency
+            return float(self.in_flight[name])
+        return latency * (self.in_flight[name] + 1)
+
+    def ranking(self) -> list[str]:
+        """
+        Backend names in the order they should be tried
+        """
+        with self.lock:
+            return sorted(self.backends, key=lambda name: (not self.is_healthy(name), self.expected_wait(name)))
+
+    def ask(self, prompt_dict: dict[str, str]) -> str:
+        error = None
+        for name in self.ranking():
+            with self.lock:
+                self.in_flight[name] += 1
+            start = time.monotonic()
+            try:
+                response = self.backends[name].ask(prompt_dict)
+            except CircuitOpenError as e:
+                # Nothing was sent
+                error = e
+                continue
+            except Exception as e:
+                self.stats[name].add(time.monotonic() - start, ok=False)
+                logger.warning(f"Backend {name} failed, trying the next one: {e}")
+                error = e
+                continue
+            finally:
+                with self.lock:
+                    self.in_flight[name] -= 1
+            self.stats[name].add(time.monotonic() - start)
+            return response
+        raise error
+
+    def report(self) -> dict[str, dict]:
+        """
+        Rolling statistics of every backend
+        """
+        return {
+            name: {"healthy": self.is_healthy(name), **stats.to_dict()}
+            for name, stats in self.stats.items()
+        }
+
+
+class HedgedEndpoint(LLMEndpointWrapper):
+    """
+    Endpoint that sends a duplicate of slow requests and uses the first answer
+
+    A request that is still running after the given latency percentile of
+    earlier requests is sent again, to hedge_endpoint if set. The duplicates
+    are capped to a share of all requests by the budget. The losing request
+    is skipped if it has not started when the other one answers, and its
+    answer is ignored otherwise, since a blocking HTTP request cannot be
+    interrupted.
+
+    Arguments:
+        llm_endpoint: endpoint to send requests to
+        hedge_endpoint: endpoint to send duplicates to. Defaults to llm_endpoint
+        percentile: latency percentile, between 0 and 100, after which a duplicate is sent
+        budget: largest share of requests that may be duplicated
+        min_samples: number of requests to observe before hedging
+        max_workers: number of threads that run requests
+    """
+
+    def __init__(
+            self,
+            llm_endpoint: LLMEndpointBase,
+            hedge_endpoint: LLMEndpointBase = None,
+            percentile: float = 95.0,
+            budget: float = 0.1,
+            min_samples: int = 20,
+            max_workers: int = 4 * MAX_CHATGPT_REQUESTS,
+        ) -> None:
+        super().__init__(llm_endpoint)
+        self.hedge_llm = hedge_endpoint or llm_endpoint
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        self.stats = RollingStats(size=500)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    @staticmethod
+    def _call(llm: LLMEndpointBase, prompt_dict: dict[str, str], kwargs: dict, answered: threading.Event) -> tuple[str, dict | None]:
+        # The worker that finished the other request may pick this one up before the caller cancels it
+        if answered.is_set():
+            raise CancelledError()
+        _last_usage.set(None)
+        response = llm.ask(prompt_dict, **kwargs)
+        answered.set()
+        return response, last_usage()
+
+    def _submit(self, llm: LLMEndpointBase, prompt_dict: dict[str, str], kwargs: dict, answered: threading.Event) -> Future:
+        # Run in a copy of the context of the caller to keep the usage of the request separate
+        return self.executor.submit(copy_context().run, self._call, llm, prompt_dict, kwargs, answered)
+
+    def threshold(self) -> float | None:
+        """
+        Seconds after which a duplicate is sent. None until enough requests have been observed
+        """
+        if len(self.stats) < self.min_samples:
+            return None
+        return self.stats.percentile(self.percentile)
+
+    def _take_budget(self) -> bool:
+        with self.lock:
+            if self.hedges >= self.budget * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    def _on_primary_done(self, start: float, future: Future) -> None:
+        if not future.cancelled():
+            self.stats.add(time.monotonic() - start, ok=future.exception() is None)
+
+    def ask(self, prompt_dict: dict[str, str], **kwargs) -> str:
+        with self.lock:
+            self.requests += 1
+        threshold = self.threshold()
+        start = time.monotonic()
+        answered = threading.Event()
+        primary = self._submit(self.llm, prompt_dict, kwargs, answered)
+        primary.add_done_callback(functools.partial(self._on_primary_done, start))
+
+        pending = {primary}
+        if threshold is not None:
+            done, _ = wait(pending, timeout=threshold)
+            if not done and self._take_budget():
+                logger.debug(f"Hedging request after {threshold:.2f}s")
+                pending.add(self._submit(self.hedge_llm, prompt_dict, kwargs, answered))
+
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response, usage = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                for other in pending:
+                    other.cancel()
+                if future is not primary:
+                    with self.lock:
+                        self.hedge_wins += 1
+                _last_usage.set(usage)
+                return response
+        raise error
+
+
+class AsyncLLMEndpointBase(ABC):
+    """
+    Base class for endpoints that are used from asyncio code
+
+    Many requests can be in flight at the same time without a thread for each of them.
+    """
+
+    @abstractmethod
+    async def ask(self, prompt_dict: dict[str, str]) -> str:
+        """
+        Ask the LLM endpoint something. See LLMEndpointBase.ask for the format of prompt_dict
+        """
+
+
+class AsyncEchoEndpoint(AsyncLLMEndpointBase):
+    """
+    Async endpoint that can be used for testing. It echos the message back to the sender
+    """
+    async def ask(self, prompt_dict: dict[str, str]) -> str:
+        return prompt_dict["message"]
+
+
+class AsyncLLMEndpointWrapper(AsyncLLMEndpointBase):
+    """
+    Asyncio version of LLMEndpointWrapper
+    """
+
+    def __init__(self, llm_endpoint: AsyncLLMEndpointBase) -> None:
+        super().__init__()
+        self.llm = llm_endpoint
+
+    async def ask(self, prompt_dict: dict[str, str], **kwargs) -> str:
+        return await self.llm.ask(prompt_dict, **kwargs)
+
+
+class AsyncModelPolicyEndpoint(AsyncLLMEndpointWrapper):
+    """
+    Asyncio version of ModelPolicyEndpoint
+    """
+
+    def __init__(self, llm_endpoint: AsyncLLMEndpointBase, policy: ModelPolicy = None) -> None:
+        super().__init__(llm_endpoint)
+        self.policy = policy or ModelPolicy.from_file()
+
+    async def ask(self, prompt_dict: dict[str, str], **kwargs) -> str:
+        return await self.llm.ask(self.policy.apply(prompt_dict), **kwargs)
+
+
+class AsyncTaggedEndpoint(AsyncLLMEndpointWrapper):
+    """
+    Asyncio version of TaggedEndpoint
+    """
+
+    def __init__(self, llm_endpoint: AsyncLLMEndpointBase, agent: str) -> None:
+        super().__init__(llm_endpoint)
+        self.agent = agent
+
+    async def ask(self, prompt_dict: dict[str, str], **kwargs) -> str:
+        return await self.llm.ask({"agent": self.agent, **prompt_dict}, **kwargs)
+
+
+class AsyncRefreshEndpoint(AsyncLLMEndpointWrapper):
+    """
+    Asyncio version of RefreshEndpoint
+    """
+
+    async def ask(self, prompt_dict: dict[str, str], **kwargs) -> str:
+        return await self.llm.ask({**prompt_dict, "refresh": True}, **kwargs)
+
+
+class AsyncCachedEndpoint(AsyncLLMEndpointWrapper):
+    """
+    Asyncio version of CachedEndpoint. Share the ResponseCache with the blocking endpoint
+
+    The cache files are read and written in a worker thread, not in the event loop.
+    """
+
+    def __init__(self, llm_endpoint: AsyncLLMEndpointBase, cache: ResponseCache = None, refresh: bool = False) -> None:
+        super().__init__(llm_endpoint)
+        self.cache = cache or ResponseCache()
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+
+    async def ask(self, prompt_dict: dict[str, str], use_cache: bool = True, refresh: bool = None, **kwargs) -> str:
+        if not use_cache:
+            return await self.llm.ask(prompt_dict, **kwargs)
+        if refresh is None:
+            refresh = self.refresh or prompt_dict.get("refresh", False)
+
+        key = prompt_key(prompt_dict)
+        if not refresh:
+            response = await asyncio.to_thread(self.cache.get, key)
+            if response is not None:
+                self.hits += 1
+                return response
+
+        self.misses += 1
+        response = await self.llm.ask(prompt_dict, **kwargs)
+        await asyncio.to_thread(self.cache.set, key, response)
+        return response
+
+
+class AsyncSemanticCacheEndpoint(AsyncLLMEndpointWrapper):
+    """
+    Asyncio version of SemanticCacheEndpoint. Share the SimilarityIndex with the blocking endpoint
+    """
+
+    def __init__(self, llm_endpoint: AsyncLLMEndpointBase, threshold: float = SEMANTIC_CACHE_THRESHOLD, index: SimilarityIndex = None) -> None:
+        super().__init__(llm_endpoint)
+        self.threshold = threshold
+        self.index = index or SimilarityIndex()
+        self.hits = 0
+        self.misses = 0
+
+    async def ask(self, prompt_dict: dict[str, str], **kwargs) -> str:
+        subject = prompt_dict.get("subject")
+        if not subject:
+            return await self.llm.ask(prompt_dict, **kwargs)
+
+        scope = semantic_scope(prompt_dict)
+        match = None if prompt_dict.get("refresh") else self.index.search(scope, subject)
+        if match is not None and match.similarity >= self.threshold:
+            self.hits += 1
+            logger.debug(f"Reusing the response for {match.subject!r} for {subject!r} ({match.similarity:.2f})")
+            return substitute_subject(match.value, match.subject, subject)
+
+        self.misses += 1
+        response = await self.llm.ask(prompt_dict, **kwargs)
+        self.index.add(scope, subject, response)
+        return response
+
+    def stats(self) -> dict:
+        return semantic_cache_stats(self.threshold, self.hits, self.misses, len(self.index))
+
+
+class AsyncAdaptiveTokensEndpoint(AsyncLLMEndpointWrapper):
+    """
+    Asyncio version of AdaptiveTokensEndpoint. Share the TokenBudget with the blocking endpoint
+    """
+
+    def __init__(self, llm_endpoint: AsyncLLMEndpointBase, budget: TokenBudget = None, token_limit: int = MAX_CHATGPT_TOKENS) -> None:
+        super().__init__(llm_endpoint)
+        self.budget = budget or TokenBudget()
+        self.token_limit = token_limit
+        self.truncated = 0
+
+    async def ask(self, prompt_dict: dict[str, str], **kwargs) -> str:
+        limit = min(self.token_limit, prompt_dict.get("max_tokens", self.token_limit))
+        max_tokens = self.budget.max_tokens(prompt_dict, limit)
+        cut_off = None
+        if max_tokens < limit:
+            _last_usage.set(None)
+            response = await self.llm.ask({**prompt_dict, "max_tokens": max_tokens}, **kwargs)
+            usage = last_usage() or {}
+            if usage.get("finish_reason") != "length":
+                self.budget.record(prompt_dict, usage.get("completion_tokens"))
+                return response
+            self.truncated += 1
+            cut_off = usage
+            logger.debug(f"Response to {prompt_dict.get('kind')} was cut off at {max_tokens} tokens. Asking again with {limit}")
+
+        _last_usage.set(None)
+        response = await self.llm.ask(prompt_dict, **kwargs)
+        usage = last_usage() or {}
+        self.budget.record(prompt_dict, usage.get("completion_tokens"))
+        if cut_off is not None:
+            # The tokens of the cut off response were spent too
+            set_last_usage(
+                prompt_tokens=AdaptiveTokensEndpoint._total(usage, cut_off, "prompt_tokens"),
+                completion_tokens=AdaptiveTokensEndpoint._total(usage, cut_off, "completion_tokens"),
+                finish_reason=usage.get("finish_reason"),
+                retries=usage.get("retries", 0) + cut_off.get("retries", 0) + 1,
             )
-            return response["message"]["content"]
-        except Exception as e:
-            logger.error(f"An error occurred: {e}")
+        return response
+
+
+class AsyncAccountingEndpoint(AsyncLLMEndpointWrapper):
+    """
+    Asyncio version of AccountingEndpoint. Share the UsageTracker with the blocking endpoint
+    """
+
+    def __init__(self, llm_endpoint: AsyncLLMEndpointBase, tracker: UsageTracker = None) -> None:
+        super().__init__(llm_endpoint)
+        self.tracker = tracker or UsageTracker()
+
+    async def ask(self, prompt_dict: dict[str, str], **kwargs) -> str:
+        _last_usage.set(None)
+        start = time.monotonic()
+        try:
+            response = await self.llm.ask(prompt_dict, **kwargs)
+        except Exception:
+            AccountingEndpoint.record_error(self.tracker, prompt_dict, time.monotonic() - start)
             raise
+        AccountingEndpoint.record_usage(self.tracker, prompt_dict, response, time.monotonic() - start)
+        return response
+
+
+class AsyncSingleFlightEndpoint(AsyncLLMEndpointWrapper):
+    """
+    Asyncio version of SingleFlightEndpoint
+    """
+
+    def __init__(self, llm_endpoint: AsyncLLMEndpointBase) -> None:
+        super().__init__(llm_endpoint)
+        self.group = AsyncSingleFlight()
+        self.coalesced = 0
+
+    async def ask(self, prompt_dict: dict[str, str], **kwargs) -> str:
+        response, shared = await self.group.do(prompt_key(prompt_dict), self.llm.ask, prompt_dict, **kwargs)
+        if shared:
+            self.coalesced += 1
+        return response
+
+
+class AsyncRecordingEndpoint(AsyncLLMEndpointWrapper):
+    """
+    Asyncio version of RecordingEndpoint. Share the Cassette with the blocking endpoint
+
+    Interactions are appended to the cassette in a worker thread, not in the event loop.
+    """
+
+    def __init__(self, llm_endpoint: AsyncLLMEndpointBase, cassette: Cassette | Path | str) -> None:
+        super().__init__(llm_endpoint)
+        self.cassette = cassette if isinstance(cassette, Cassette) else Cassette(cassette)
+
+    async def ask(self, prompt_dict: dict[str, str], **kwargs) -> str:
+        _last_usage.set(None)
+        start = time.monotonic()
+        response = await self.llm.ask(prompt_dict, **kwargs)
+        latency = time.monotonic() - start
+        usage = last_usage() or {}
+        await asyncio.to_thread(
+            self.cassette.record,
+            prompt_dict,
+            response,
+            latency,
+            prompt_tokens=usage.get("prompt_tokens"),
+            completion_tokens=usage.get("completion_tokens"),
+        )
+        return response
+
+
+class AsyncReplayEndpoint(AsyncLLMEndpointBase):
+    """
+    Asyncio version of ReplayEndpoint. Share the Cassette with the blocking endpoint
+    """
+
+    def __init__(self, cassette: Cassette | Path | str, latency_scale: float = 0.0, fallback: AsyncLLMEndpointBase = None) -> None:
+        super().__init__()
+        self.cassette = cassette if isinstance(cassette, Cassette) else Cassette(cassette)
+        self.latency_scale = latency_scale
+        self.fallback = fallback
+
+    async def ask(self, prompt_dict: dict[str, str], **kwargs) -> str:
+        interaction = self.cassette.play(prompt_dict)
+        if interaction is None:
+            if self.fallback is not None:
+                logger.info(f"Prompt {prompt_dict.get('kind')} not found in cassette {self.cassette.path}. Asking the fallback")
+                return await self.fallback.ask(prompt_dict, **kwargs)
+            raise CassetteMissError(f"Prompt {prompt_dict.get('kind') or prompt_dict['message'][:50]!r} not found in cassette {self.cassette.path}")
+
+        if self.latency_scale > 0:
+            await asyncio.sleep(interaction.get("latency", 0.0) * self.latency_scale)
+        set_last_usage(
+            prompt_tokens=interaction.get("prompt_tokens"),
+            completion_tokens=interaction.get("completion_tokens"),
+        )
+        return interaction["response"]
+
+
+class AsyncChatGPTEndpoint(AsyncLLMEndpointBase):
+    """
+    ChatGPT endpoint built on asyncio
+
+    The number of requests in flight is bounded by request_limit. Requests wait
+    for the same rate limiter as ChatGPTEndpoint, in the order of their priority.
+    """
+
+    def __init__(
+            self,
+            request_limit: int = MAX_CHATGPT_REQUESTS,
+            token_limit: int = MAX_CHATGPT_TOKENS,
+            rate_limiter: RateLimiter = None,
+            base_url: str = GPT_BASE_URL,
+            retry_policy: RetryPolicy = None,
+            circuit_breaker: CircuitBreaker = None,
+        ) -> None:
+        super().__init__()
+        self.request_limit = request_limit
+        self.token_limit = token_limit
+        self.rate_limiter = rate_limiter or chatgpt_rate_limiter
+        self.base_url = base_url
+        self.retry_policy = retry_policy or default_retry_policy
+        self.circuit_breaker = circuit_breaker or chatgpt_circuit_breaker
+        self._loop = None
+
+    def _connect(self) -> None:
+        # Clients and semaphores are bound to an event loop. Create new ones for each loop
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self.client = AsyncOpenAI(api_key=os.getenv('GPT_KEY'), base_url=self.base_url, timeout=GPT_TIMEOUT, max_retries=0)
+            self.semaphore = asyncio.Semaphore(self.request_limit)
+
+    async def ask(self, prompt_dict: dict[str, str], max_retries: int = None) -> str:
+        self._connect()
+        if max_retries is None:
+            max_retries = self.retry_policy.max_retries
+        request = chatgpt_request(prompt_dict, self.token_limit)
+        estimated_tokens = estimate_tokens(prompt_dict, request["max_tokens"])
+
+        retry = 0
+        while True:
+            probe = self.circuit_breaker.before_call()
+            try:
+                # Wait for the rate limiter shared with the blocking endpoints
+                async with self.semaphore, self.rate_limiter.limit_async(estimated_tokens, prompt_priority(prompt_dict)) as slot:
+                    raw_response = await self.client.chat.completions.with_raw_response.create(**request)
+                    self.rate_limiter.update_from_headers(raw_response.headers)
+                    response = raw_response.parse()
+                    if response.usage is not None:
+                        slot.tokens = response.usage.total_tokens
+                self.rate_limiter.on_success()
+                self.circuit_breaker.on_success()
+                break
+            except Exception as e:
+                if isinstance(e, RateLimitError):
+                    self.rate_limiter.on_rate_limited(retry_after(e))
+                settle_circuit(self.circuit_breaker, e, probe)
+                if not is_retryable(e) or retry >= max_retries:
+                    logger.error(f"An error occurred when querying ChatGPT: {e}")
+                    raise
+                delay = self.retry_policy.delay(retry, retry_after(e))
+                logger.warning(f"ChatGPT request failed. Retrying in {delay:.2f}s, {max_retries - retry} more times: {e}")
+                await asyncio.sleep(delay)
+                retry += 1
+            except BaseException:
+                # E.g. a cancelled task. Let the next call probe the backend
+                if probe:
+                    self.circuit_breaker.release_probe()
+                raise
+
+        output_message = response.choices[0].message.content
+        set_last_usage(
+            prompt_tokens=getattr(response.usage, "prompt_tokens", None),
+            completion_tokens=getattr(response.usage, "completion_tokens", None),
+            finish_reason=response.choices[0].finish_reason,
+            retries=retry,
+        )
+        log_prompt(prompt_dict, output_message)
+        return output_message
+
+
+class AsyncLlama2Endpoint(AsyncLLMEndpointBase):
+    """
+    Ollama endpoint built on asyncio
+    """
+
+    def __init__(
+            self,
+            host: str = OLLAMA_HOST,
+            request_limit: int = MAX_CHATGPT_REQUESTS,
+            model: str = None,
+            retry_policy: RetryPolicy = None,
+            circuit_breaker: CircuitBreaker = None,
+        ) -> None:
+        super().__init__()
+        self.host = host
+        self.model = model
+        self.request_limit = request_limit
+        self.retry_policy = retry_policy or default_retry_policy
+        self.circuit_breaker = circuit_breaker or CircuitBreaker(
+            f"Ollama {self.host or 'localhost'}",
+            failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+            reset_timeout=CIRCUIT_RESET_TIMEOUT,
+        )
+        self._loop = None
+
+    def _connect(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self.client = ollama.AsyncClient(self.host)
+            self.semaphore = asyncio.Semaphore(self.request_limit)
+
+    async def ask(self, prompt_dict: dict[str, str]) -> str:
+        self._connect()
+
+        retry = 0
+        while True:
+            probe = self.circuit_breaker.before_call()
+            try:
+                async with self.semaphore:
+                    response = await self.client.chat(**ollama_request(prompt_dict, self.model))
+                self.circuit_breaker.on_success()
+                break
+            except Exception as e:
+                settle_circuit(self.circuit_breaker, e, probe)
+                if not is_retryable(e) or retry >= self.retry_policy.max_retries:
+                    logger.error(f"An error occurred: {e}")
+                    raise
+                delay = self.retry_policy.delay(retry)
+                logger.warning(f"Ollama request failed. Retrying in {delay:.2f}s: {e}")
+                await asyncio.sleep(delay)
+                retry += 1
+            except BaseException:
+                # E.g. a cancelled task. Let the next call probe the backend
+                if probe:
+                    self.circuit_breaker.release_probe()
+                raise
+
+        set_last_usage(
+            prompt_tokens=response.get("prompt_eval_count"),
+            completion_tokens=response.get("eval_count"),
+            finish_reason=response.get("done_reason"),
+            retries=retry,
+        )
+        return response["message"]["content"]
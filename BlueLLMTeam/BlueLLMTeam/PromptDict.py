@@ -10,9 +10,13 @@ Python file content generator creating scripts during the file creation process
 """
 
 import json
+import functools
 from pathlib import Path
 
 from BlueLLMTeam.utils.text import replace_tokens
+from BlueLLMTeam.utils.similarity import canonical_command
+from BlueLLMTeam.utils.csv_engine import CSV_COLUMN_TYPES
+from BlueLLMTeam.utils.documents import DOCUMENT_HINTS
 
 data_folder = Path(__file__).parent.parent.parent / 'data'
 
@@ -20,7 +24,21 @@ with open(data_folder / 'companyinfo.json', 'r') as file:
     company_info = json.load(file)
 
 
+def prompt_kind(func):
+    """
+    Tag the prompt dictionary with the name of the function that built it.
+    The kind is used to account for usage and to route prompts
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        prompt_dict = func(*args, **kwargs)
+        prompt_dict["kind"] = func.__name__
+        return prompt_dict
+    return wrapper
+
+
 #Python advisor interprets the data from the file path and the company information to determine the instructions to provide to the python engineering team.
+@prompt_kind
 def python_advisor(file_path):
     prompt_dict = {
         "systemRole": "You're a project leader for python file requirements. You need to review the code then provide feedback to the developer to make improvements. You know that these are company details but is not data to be used in the script." + str(company_info) + ". Make sure they create a real project and not just junk code. This is for a honeypot, but it's not meant to look like a honeypot.",
@@ -32,10 +50,12 @@ def python_advisor(file_path):
         Step3: Think about the design for a python script making and calling functions.\
         Step 4: Provide the instructions to the python developer.",
         "model" : "gpt-4o",
+        "subject": file_path,
     }
     return (prompt_dict)
 
 #Python coder acts on behalf of their manager. They take the instructions for creating the python file asked for by the advisor.
+@prompt_kind
 def python_coder(prompt):
     prompt_dict = {
         "systemRole": "You're a mid level python developer. You need to write a python script file. Based on the instructions given to you from the instructor",
@@ -48,6 +68,7 @@ def python_coder(prompt):
     return (prompt_dict)
 
 #Team advisor for interpreting the information before coming up with a complete solution.
+@prompt_kind
 def python_reviewer(code):
     prompt_dict = {
         "systemRole": "You're a senior python developer. You need to optimize a python script file based on. Ensure the script is highly efficient.",
@@ -63,6 +84,7 @@ def python_reviewer(code):
 
 
 #Text file advisor must understand based on the file path what they need to write the text file about.
+@prompt_kind
 def text_file_advisor(file_path):
     prompt_dict = {
         "systemRole": "You're in a company with the following background. Company info: " + str(company_info),
@@ -71,11 +93,13 @@ def text_file_advisor(file_path):
         "context": "File Path: " + file_path,
         "message": "Task: Provide a list of a minimum of 10 and a max of 20 questions to ask yourself about what information to write about. The questions need to be relevant to the current file path and company infomration.",
         "model" : "gpt-3.5-turbo-0125",
-        "max_tokens": 4096
+        "max_tokens": 4096,
+        "subject": file_path,
     }
     return (prompt_dict)
 
 #Text fie writer takes a response from the text file advisor.
+@prompt_kind
 def text_file_writer(questions):
     prompt_dict = {
         "systemRole": "You're in a company with the following background Your role is going to be based on the questions you're provided you must write a usefule text file. Company info: " + str(company_info),
@@ -89,6 +113,7 @@ def text_file_writer(questions):
     return (prompt_dict)
 
 #TEMPLATE - copy and paste this for easy prompt generation. Data structure used to create prompts.
+@prompt_kind
 def csv_advisor(file_path):
     prompt_dict = {
         "systemRole": "You're in a company with the following background Your role is going to be based on the questions you're provided you must provide instructions for what headers to write. Company info: " + str(company_info),
@@ -98,10 +123,12 @@ def csv_advisor(file_path):
         "message":"Task: Provide a list of a minimum of 10 and a max of 20 questions to ask yourself about what information to write about. The questions need to be relevant to the current file path and company information.",
         "model" : "gpt-3.5-turbo-0125",
         "max_tokens": 4096,
+        "subject": file_path,
     }
     return (prompt_dict)
 
 #Writes the csv file headers
+@prompt_kind
 def csv_header(questions):
     prompt_dict = {
         "systemRole": "You are an essential employee who needs to provide a csv with only headers. Using the information give you should think about company information and text given to you. Company info: " + str(company_info),
@@ -117,7 +144,43 @@ def csv_header(questions):
     }
     return (prompt_dict)
 
+#Designs the columns of a csv file. The rows are generated locally from the schema
+@prompt_kind
+def csv_schema(file_path):
+    schema = """
+{
+    "rows": 200,
+    "columns": [
+        {"name": "Employee ID", "type": "id", "prefix": "EMP-"},
+        {"name": "Full Name", "type": "full_name"},
+        {"name": "SSN", "type": "ssn"},
+        {"name": "Office", "type": "city", "values": ["Lyon", "Osaka", "Porto Alegre"]},
+        {"name": "Start Date", "type": "date", "min": "2015-03-01", "max": "2024-05-31"},
+        {"name": "Salary (USD)", "type": "amount", "min": 41000, "max": 168000},
+        {"name": "Performance", "type": "category", "values": ["Exceeds", "Meets", "Below"]}
+    ],
+    "examples": [
+        ["EMP-00417", "Ingrid Solberg", "231-58-0946", "Lyon", "2019-08-12", "73418.27", "Meets"]
+    ]
+}
+"""
+    prompt_dict = {
+        "systemRole": "You're in a company with the following background. You design the columns of csv files that employees keep on their computers. Company info: " + str(company_info),
+        "user": "Based on the company information and the file path you need to design a realistic csv file. All you have to go off is the file path. \n",
+        "context": "File Path: " + file_path + "\n",
+        "message": "Task: Design the columns of the csv file with 5 to 15 columns. Each column has a name and a type, one of: " + ", ".join(CSV_COLUMN_TYPES) + ". \n \
+            Numeric types take a min and max, date and datetime take min and max dates as YYYY-MM-DD, category, city and text take a list of realistic values, email takes a list with the company's email domain, id takes a prefix. \n \
+            Give 3 to 5 example rows with realistic company specific values, real places, historical names and odd numbers, and the number of rows the file should have between 20 and 1000. \n \
+            Answer with a single JSON object in this format and nothing else: " + schema,
+        "model" : "gpt-3.5-turbo-0125",
+        "max_tokens": 2048,
+        "json_format": True,
+        "subject": file_path,
+    }
+    return (prompt_dict)
+
 #Writes the csv file contents for honeypot file content generation
+@prompt_kind
 def csv_writer(headers):
     prompt_dict = {
         "systemRole": "You are an essential employee who needs to add add records to a csv. Using the information give you should think about company information and text given to you. Company info: " + str(company_info),
@@ -134,6 +197,7 @@ def csv_writer(headers):
     return (prompt_dict)
 
 #Writes the csv file contents for honeypot file content generation
+@prompt_kind
 def csv_appender(headers, previous_content):
     prompt_dict = {
         "systemRole": "You are an essential employee who needs to add add records to an existing csv. Using the information give you should think about company information and text given to you. Company info: " + str(company_info),
@@ -151,6 +215,7 @@ def csv_appender(headers, previous_content):
 
 
 #TEMPLATE - copy and paste this for easy prompt generation. Data structure used to create prompts.
+@prompt_kind
 def generate_prompt():
     prompt_dict = {
         "systemRole": "You're a senior python developer. You need to optimize a python script file based on. Ensure the script is highly efficient.",
@@ -162,6 +227,7 @@ def generate_prompt():
     }
     return (prompt_dict)
 
+@prompt_kind
 def file_system_creator(tokens: dict[str, str]) -> dict[str, str]:
     return {
         "systemRole": f"You are Linux expert at a company with the following information {company_info}. Please advise on the folder contents of the folders of a honeypot that is to be deployed to fool attackers. A folder should be prefixed with an # and all files should have an extension. You should only answer with one folder/file per line and nothing else.\n# Example output\n# private\n# public\nsecrets.txt",
@@ -172,6 +238,7 @@ def file_system_creator(tokens: dict[str, str]) -> dict[str, str]:
     }
 
 #File system lead initiial conversation
+@prompt_kind
 def file_system_lead():
     prompt_dict = {
         "systemRole": "You're a project manager. Your job is to ensure the creation of a robust file system for the following company information. \n \n Copmany Info:" + str(company_info) + "\n\n \
@@ -186,6 +253,7 @@ def file_system_lead():
     return (prompt_dict)
 
 #File system lead initiial conversation
+@prompt_kind
 def file_system_enhancer(file_structure):
     prompt_dict = {
         "systemRole": "You are a file system architect. You need to revise the file and folder structure you've been given. Research the following company:  \n \n Company Info:" + str(company_info) + "\n\n \
@@ -200,7 +268,8 @@ def file_system_enhancer(file_structure):
     return (prompt_dict)
 
 #File system lead conversation and internal dialogue.
-def file_system_employee(file_structure):
+@prompt_kind
+def file_system_employee(file_structure, error: str = None):
     schema = """
 {
     "top_folder": {
@@ -278,24 +347,78 @@ def file_system_employee(file_structure):
         "max_tokens": 4096,
         "json_format":True,
     }
+    if error is not None:
+        # Retry of a response that was not valid JSON
+        prompt_dict["message"] += "\n\nYour previous answer was not valid JSON (" + error + "). Keep the json short enough to be complete and provide nothing else."
+    return (prompt_dict)
+
+#Writes the content of office documents, images and archives. The file itself is rendered locally
+@prompt_kind
+def document_content(file, file_structure=None, overview=None):
+    extension = Path(file).suffix.lower()
+    schema = """
+{
+    "title": "",
+    "author": "",
+    "paragraphs": [""],
+    "tables": [{"name": "", "header": [""], "rows": [[""]]}],
+    "caption": "",
+    "files": {"": ""}
+}
+"""
+    prompt_dict = {
+        "systemRole": "You've just been hired by the following compnay: \n \n Copmany Info:" + str(company_info) + "\n\n " + "The file structure is: " + str(overview or file_structure or Path(file).parent),
+        "user": "You have been given a file to write the content of. File: " + str(file),
+        "context": "Write the content an employee of the company would have in this file. Do not use generic naming. Use historical names and real places. No numbers should be perfect, they should have odd values. Any employee information should contain social security numbers in the format of xxx-xx-xxxx. \n",
+        "message": "Task: The " + extension + " file is created from the content you write. It needs " + DOCUMENT_HINTS.get(extension, "a title and paragraphs") + ". \n Answer with a single JSON object in this format, leave out the parts the file does not need and provide nothing else: " + schema,
+        "model" : "gpt-3.5-turbo-0125",
+        "max_tokens": 2048,
+        "json_format": True,
+        "target": str(file),
+        "subject": str(file),
+    }
+    if overview is not None:
+        prompt_dict["user"] += "\n\n Here's the file structure around it: " + str(file_structure)
     return (prompt_dict)
 
 #File system lead conversation and internal dialogue.
-def file_contents_employee(file_structure, file):
-    
+@prompt_kind
+def file_contents_employee(file_structure, file, overview=None):
+    # With an overview, file_structure is only the part around the file. The system role
+    # then stays the same for all files, so the provider can cache the prompt prefix
     prompt_dict = {
-        "systemRole": "You've just been hired by the following compnay: \n \n Copmany Info:" + str(company_info) + "\n\n " + "The file structure is: " + str(file_structure),
+        "systemRole": "You've just been hired by the following compnay: \n \n Copmany Info:" + str(company_info) + "\n\n " + "The file structure is: " + str(file_structure if overview is None else overview),
         "user": "You have been given a file and a file structure. File: " + str(file) + "\n \n Here's the file structure: " + str(file_structure),
         "context": "Generate useful content for the file. Do not use generic naming. Do not say meeting_1. Use names from different countries. Make the contents unique. Ensuer the file contents are thorough. \n",
         "message": "Provide only the file contents. If the file is a png, jpg or image file type then return an image based on the file name and where it exists in the structure. Otherwise generate appropriate content. Only return file contents no comments or anything else. \n \n Task: Generate file contents following the guidelines given. \n \n Step 1: Evaluate the file name. Step 2: Look at the file extension so .xlsx or .docx whatever the file extension is and use that to determine the file format based off the of the extension. \n Step 3: Look and see where in the file structure it resides. \n Step 4: Think hard about the information you might find in a company's file. Provide client specific information. Do not space general regions state exact cities in those regions. Do not use plenty of jargon. Any files with employee information should contain social security numbers in the format of xxx-xx-xxxx. \n Step 5: Review the content think hard. Use historical names. If mentioning places, mention real places. No finances or revenue should be a perfect number, it should have odd values. If it's expenses provide the name of real companies and places along with the items purchased and the cost. In the websites, make sure to provide robust website programming using cards and more. \n Step 5: Review the files and ensure no 12345 numbers are being used. Make sure to include fake social security numbers for employee documents in the format of ###-##-####.  \n Step 6: Write the contents provide nothing else beyond that.",
         "model" : "gpt-3.5-turbo-0125",
         "max_tokens": 4096,
         "json_format":False,
+        "target": str(file),
+        "subject": str(file),
     }
     return (prompt_dict)
 
 
 
+@prompt_kind
+def multi_file_contents_employee(files, file_structure=None, overview=None):
+    file_list = "\n".join(files)
+    prompt_dict = {
+        "systemRole": "You've just been hired by the following compnay: \n \n Copmany Info:" + str(company_info) + "\n\n " + "The file structure is: " + str(overview or file_structure or Path(files[0]).parent),
+        "user": "You have been given a list of files that are in the same folder. Files: \n" + file_list,
+        "context": "Generate useful content for each file. Do not use generic naming. Use names from different countries. Make the contents of every file unique and realistic for its name and folder. \n",
+        "message": "Task: Generate the file contents for every file in the list. \n Step 1: Evaluate the file names and extensions and use them to determine the format of each file. \n Step 2: Look at where the files reside in the structure. \n Step 3: Write realistic company specific contents, with odd numbers and real places, and no placeholder values like 12345. \n Step 4: Answer with a single JSON object that maps each file path, exactly as given, to the full contents of the file as a string. Provide nothing else.",
+        "model" : "gpt-3.5-turbo-0125",
+        "max_tokens": 4096,
+        "json_format": True,
+    }
+    if overview is not None:
+        prompt_dict["user"] += "\n\n Here's the file structure around them: " + str(file_structure)
+    return (prompt_dict)
+
+
+@prompt_kind
 def linux_command_response(tokens: dict[str, str]) -> dict[str, str]:
     return {
         "systemRole": f"You are Linux expert at a company with the following information {company_info}. You know all linux commands and can give realistic outputs for any command you are presented with. ",
@@ -303,9 +426,11 @@ def linux_command_response(tokens: dict[str, str]) -> dict[str, str]:
         "context": "",
         "message": tokens['command'],
         "model" : "gpt-3.5-turbo-0125",
+        "subject": canonical_command(tokens['command']),
     }
 
 
+@prompt_kind
 def linux_important_files_creator(tokens: dict[str, str]) -> dict[str, str]:
     return {
         "systemRole": f"You are Linux expert at a company with the following information {company_info}. You know everything about how a the linux file system is built. ",
@@ -313,9 +438,12 @@ def linux_important_files_creator(tokens: dict[str, str]) -> dict[str, str]:
         "context": "",
         "message": tokens['file'],
         "model" : "gpt-3.5-turbo-0125",
+        "target": tokens['file'],
+        "subject": tokens['file'],
     }
 
 
+@prompt_kind
 def cowrie_configuration_creator(tokens: dict[str, str]) -> dict[str, str]:
     return {
         "systemRole": f"You are cowrie honeypot expert at a company with the following information {company_info}. You know everything about Cowrie and how to best foul hackers.",
@@ -12,6 +12,7 @@ class CowrieAnalystRole(AnalystRole):
             "user": "What is the hacker trying to do given these logs? Please provide your reasoning and end with a short conclusion.\n\n Here are the logs we have currently captured: \n\n",
             "context": "",
             "message": logs,
+            "kind": "analyse_logs",
         }
         return self.llm.ask(prompt_dict)
 
@@ -4,7 +4,7 @@ import logging
 from pathlib import Path
 from abc import ABC, abstractmethod
 
-from BlueLLMTeam.LLMEndpoint import LLMEndpointBase
+from BlueLLMTeam.LLMEndpoint import LLMEndpointBase, AsyncLLMEndpointBase, TaggedEndpoint, AsyncTaggedEndpoint
 
 
 ROOT_DIR = Path(__file__).parent.parent
@@ -21,14 +21,23 @@ class AgentRoleBase(ABC):
     Defines common behavior for them
     """
 
-    def __init__(self, role: str, llm_endpoint: LLMEndpointBase, prompts: dict[str, str] = None) -> None:
+    def __init__(
+            self,
+            role: str,
+            llm_endpoint: LLMEndpointBase,
+            prompts: dict[str, str] = None,
+            async_llm_endpoint: AsyncLLMEndpointBase = None,
+        ) -> None:
         super().__init__()
         self.role = role
 
         # Load prompts from default configuration if no prompts are given
         self.prompts = prompts or self.load_prompts()
 
-        self.llm = llm_endpoint
+        # Tag all prompts with the role to account for the usage of each agent
+        self.llm = TaggedEndpoint(llm_endpoint, agent=role)
+        # Used instead of llm for requests that are made many at a time, if given
+        self.async_llm = None if async_llm_endpoint is None else AsyncTaggedEndpoint(async_llm_endpoint, agent=role)
 
     def load_prompts(self) -> dict[str, str]:
         """
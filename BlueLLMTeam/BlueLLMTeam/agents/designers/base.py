@@ -2,7 +2,7 @@ import os
 from abc import abstractmethod
 
 from BlueLLMTeam.agents.base import AgentRoleBase
-from BlueLLMTeam.LLMEndpoint import LLMEndpointBase
+from BlueLLMTeam.LLMEndpoint import LLMEndpointBase, AsyncLLMEndpointBase
 
 
 DEFAULT_PORT = os.environ.get("DEFAULT_PORT", 2222)
@@ -12,8 +12,8 @@ class HoneypotDesignerRole(AgentRoleBase):
 
     used_ports = set()
 
-    def __init__(self, llm_endpoint: LLMEndpointBase) -> None:
-        super().__init__(role="Honeypot Designer", llm_endpoint=llm_endpoint)
+    def __init__(self, llm_endpoint: LLMEndpointBase, async_llm_endpoint: AsyncLLMEndpointBase = None) -> None:
+        super().__init__(role="Honeypot Designer", llm_endpoint=llm_endpoint, async_llm_endpoint=async_llm_endpoint)
         self.port = None
     
     @abstractmethod
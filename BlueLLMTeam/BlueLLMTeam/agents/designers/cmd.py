@@ -1,10 +1,11 @@
 import string
+import asyncio
 import logging
 from BlueLLMTeam.utils.tqdm import tqdm, trange_wrapper
 from abc import abstractmethod
 
 import BlueLLMTeam.PromptDict as prompt
-from BlueLLMTeam.LLMEndpoint import LLMEndpointBase
+from BlueLLMTeam.LLMEndpoint import LLMEndpointBase, AsyncLLMEndpointBase
 from BlueLLMTeam.agents.base import AgentRoleBase
 from BlueLLMTeam.utils.threading import ThreadWithReturnValue
 from BlueLLMTeam.utils.path import conf as get_configuration_file
@@ -16,8 +17,8 @@ logger = logging.getLogger(__file__)
 
 class CommandDesigner(AgentRoleBase):
 
-    def __init__(self, llm_endpoint: LLMEndpointBase) -> None:
-        super().__init__(role="Command Designer", llm_endpoint=llm_endpoint)
+    def __init__(self, llm_endpoint: LLMEndpointBase, async_llm_endpoint: AsyncLLMEndpointBase = None) -> None:
+        super().__init__(role="Command Designer", llm_endpoint=llm_endpoint, async_llm_endpoint=async_llm_endpoint)
 
         self.known_commands = self.load_known_commands()
         self.seen_commands: dict[str, int] = {}
@@ -55,6 +56,9 @@ class CommandDesigner(AgentRoleBase):
         """
         Generate command responses for the top-K commands
 
+        The responses are generated as asyncio tasks if the designer has an
+        async LLM endpoint, and with one thread per command otherwise.
+
         Args:
             k: number of commands to generate. None to generate for all unknown commands
         """
@@ -67,6 +71,9 @@ class CommandDesigner(AgentRoleBase):
         sorted_items = sorted(freq_unknown.items(), key=lambda item: item[1], reverse=True)
         top_k = [item[0] for item in sorted_items[:k]]
 
+        if self.async_llm is not None:
+            return asyncio.run(self.generate_command_responses_async(top_k))
+
         # Create a separate thread for each generation
         threads: list[ThreadWithReturnValue] = []
 
@@ -107,6 +114,28 @@ class CommandDesigner(AgentRoleBase):
             pbar.update()
         return cmd, response
 
+    async def generate_command_responses_async(self, commands: list[str]) -> list[tuple[str, str]]:
+        """
+        Generate the responses to the commands with the async LLM endpoint
+        """
+        with trange_wrapper(len(commands), desc="Generating command responses", leave=False) as pbar:
+            results = await asyncio.gather(*(self.generate_command_response_async(cmd, pbar) for cmd in commands))
+        return [(cmd, response) for cmd, response in results if response is not None]
+
+    async def generate_command_response_async(self, cmd: str, pbar: tqdm = None) -> str:
+        """Generate the expected response for a linux command with the async LLM endpoint"""
+        try:
+            tokens = {
+                "command": cmd,
+            }
+            response = await self.async_llm.ask(prompt.linux_command_response(tokens))
+        except Exception as e:
+            logger.warning(f"Failed to generate response for command {cmd}: {e}")
+            response = None
+        if pbar is not None:
+            pbar.update()
+        return cmd, response
+
     def chat(self, conversation_history: list[dict]) -> str:
         raise NotImplementedError
     
@@ -2,22 +2,24 @@ import os
 import json
 import time
 import shutil
+import asyncio
 import docker
 import logging
 from pathlib import Path
-from random import randint
 from BlueLLMTeam.utils.tqdm import trange_wrapper, tqdm
 from dotenv import load_dotenv
 import threading
 
 from BlueLLMTeam.agents.designers.base import HoneypotDesignerRole
-from BlueLLMTeam.LLMEndpoint import LLMEndpointBase
+from BlueLLMTeam.LLMEndpoint import LLMEndpointBase, AsyncLLMEndpointBase
+from BlueLLMTeam.LLMBatch import BatchBackendBase
 from BlueLLMTeam.agents.designers.fs.pickle_fs import pickledir
 from BlueLLMTeam.agents.designers.cmd import CowrieCommandDesigner
 from BlueLLMTeam.agents.designers.fs.fs import copy_local_filenames
 import BlueLLMTeam.PromptDict as prompt
 from BlueLLMTeam.utils.path import conf
 from BlueLLMTeam.utils.text import generate_random_id
+from BlueLLMTeam.utils.fs_budget import FS_CONTENT_WORKERS, FS_CONTENT_DEADLINE
 
 
 logger = logging.getLogger(__name__)
@@ -27,9 +29,16 @@ load_dotenv()
 # File creation
 if os.getenv("FS_V2") is not None:
     from .fs.v2.createFiles import generate_file_system, generate_file_contents
+    from .fs.v2.createFiles import generate_file_system_async, generate_file_contents_async
+    from .fs.v2.createFiles import generate_file_contents_batch
+    # Version 2 designs the whole structure in one request, there is nothing to pipeline
+    generate_file_system_with_contents = None
     print("Using version 2 of the file system creation")
 else:
     from .fs.v1.createFiles import generate_file_system, generate_file_contents
+    from .fs.v1.createFiles import generate_file_system_async, generate_file_contents_async
+    from .fs.v1.createFiles import generate_file_contents_batch
+    from .fs.v1.createFiles import generate_file_system_with_contents
     print("Using version 1 of the file system creation")
 
 
@@ -38,7 +47,7 @@ AVAILABLE_HONEYPOTS = {
     "cowrie": "An SSH honeypot"
 }
 HONEYPOT_RESOURCES = "\n".join(f"- {honeypot}: {description}" for honeypot, description in AVAILABLE_HONEYPOTS.items())
-EXAMPLE_OUTPUT = "\n".join(f"- {honeypot}: {randint(0, 5)}" for honeypot in AVAILABLE_HONEYPOTS.keys())
+EXAMPLE_OUTPUT = "\n".join(f"- {honeypot}: 2" for honeypot in AVAILABLE_HONEYPOTS.keys())
 
 linux_top_level_directories = [
     "bin",
@@ -89,9 +98,18 @@ class CowrieDesignerRole(HoneypotDesignerRole):
             llm_endpoint: LLMEndpointBase,
             honeypot_description: str,
             depth: int = 3,
-            light_weight: bool = False
+            light_weight: bool = False,
+            async_llm_endpoint: AsyncLLMEndpointBase = None,
+            batch_backend: BatchBackendBase = None,
+            multi_file: bool = False,
+            content_workers: int = FS_CONTENT_WORKERS,
+            content_deadline: float = FS_CONTENT_DEADLINE,
+            pipeline: bool = False,
         ) -> None:
-        super().__init__(llm_endpoint)
+        # The async endpoint is used for the file system, the command responses and the system files if given
+        super().__init__(llm_endpoint, async_llm_endpoint)
+        # Used for the file contents if given
+        self.batch_backend = batch_backend
         self.cowrie_container = None
         self.honeypotfs_id = generate_random_id(8)
 
@@ -106,6 +124,13 @@ class CowrieDesignerRole(HoneypotDesignerRole):
         self.honeypot_description = honeypot_description
         self.depth = depth
         self.light_weight = light_weight
+        # Generate small sibling files together
+        self.multi_file = multi_file
+        # Generate file contents with this many threads, and stop after the deadline in seconds
+        self.content_workers = content_workers
+        self.content_deadline = content_deadline
+        # Generate file contents while the file system is still being discovered
+        self.pipeline = pipeline
 
         # Container logs
         self.old_logs = set()
@@ -180,7 +205,7 @@ class CowrieDesignerRole(HoneypotDesignerRole):
     def chat(self, conversation_history: list[dict]) -> str:
         raise NotImplementedError("Not yet implemented")
     
-    def configure_cowrie(self):
+    def configure_cowrie(self, retries: int = 3):
         """
         Set some basic configurations for cowrie
         """
@@ -193,13 +218,21 @@ class CowrieDesignerRole(HoneypotDesignerRole):
             "operating_system": "GNU/Linux",
             "version_ssh": "SSH-2.0-OpenSSH_5.5p1 Debian-6",
         }
-        json_response = self.llm.ask(
-            prompt_dict=prompt.cowrie_configuration_creator({"keys": options})
-        )
+        prompt_dict = prompt.cowrie_configuration_creator({"keys": options})
+        for _ in range(retries):
+            json_response = self.llm.ask(prompt_dict)
+            # Do not get the same response from the cache if this one can not be used
+            prompt_dict["refresh"] = True
 
-        # Update options with LLM response
-        json_data = json.loads(json_response)
-        options.update(json_data)
+            # Update options with LLM response
+            try:
+                options.update(json.loads(json_response))
+            except (ValueError, TypeError):
+                logger.warning("Failed to parse the cowrie configuration from the LLM response")
+                continue
+            break
+        else:
+            logger.warning(f"Using the default cowrie configuration after {retries} attempts")
 
         # Update cowrie configuration
         cowrie_conf = conf("cowrie.cfg").read_text()
@@ -220,19 +253,71 @@ class CowrieDesignerRole(HoneypotDesignerRole):
             logger.info("Using version 2 of the file system creation")
         else:
             logger.info("Using version 1 of the file system creation")
-        files = generate_file_system(
-            current_folder="/home",
-            honey_context=self.honeypot_description,
-            llm=self.llm,
-            max_depth=self.depth,
-        )
-        generate_file_contents(
-            local_fs=self.fake_fs,
-            files=files,
-            honey_context=self.honeypot_description,
-            llm=self.llm,
-            light_weight=self.light_weight,
-        )
+        if self.pipeline and self.batch_backend is None and self.async_llm is None:
+            if generate_file_system_with_contents is not None:
+                generate_file_system_with_contents(
+                    current_folder="/home",
+                    honey_context=self.honeypot_description,
+                    llm=self.llm,
+                    local_fs=self.fake_fs,
+                    max_depth=self.depth,
+                    light_weight=self.light_weight,
+                    multi_file=self.multi_file,
+                    max_workers=self.content_workers,
+                    deadline=self.content_deadline,
+                )
+                logger.info(f"Created honeypot filesystem at {self.fake_fs}")
+                return
+            logger.info("Pipelined generation is not supported by version 2 of the file system creation")
+        elif self.pipeline:
+            logger.info("Pipelined generation is not supported with the async LLM endpoint or a batch backend")
+        if self.async_llm is not None:
+            files = asyncio.run(generate_file_system_async(
+                current_folder="/home",
+                honey_context=self.honeypot_description,
+                llm=self.async_llm,
+                max_depth=self.depth,
+            ))
+        else:
+            files = generate_file_system(
+                current_folder="/home",
+                honey_context=self.honeypot_description,
+                llm=self.llm,
+                max_depth=self.depth,
+            )
+        if self.batch_backend is not None:
+            generate_file_contents_batch(
+                local_fs=self.fake_fs,
+                files=files,
+                honey_context=self.honeypot_description,
+                backend=self.batch_backend,
+                work_dir=self.honeypot_data / "batch",
+                light_weight=self.light_weight,
+            )
+            logger.info(f"Created honeypot filesystem at {self.fake_fs}")
+            return
+        if self.async_llm is not None:
+            asyncio.run(generate_file_contents_async(
+                local_fs=self.fake_fs,
+                files=files,
+                honey_context=self.honeypot_description,
+                llm=self.async_llm,
+                light_weight=self.light_weight,
+                multi_file=self.multi_file,
+                max_workers=self.content_workers,
+                deadline=self.content_deadline,
+            ))
+        else:
+            generate_file_contents(
+                local_fs=self.fake_fs,
+                files=files,
+                honey_context=self.honeypot_description,
+                llm=self.llm,
+                light_weight=self.light_weight,
+                multi_file=self.multi_file,
+                max_workers=self.content_workers,
+                deadline=self.content_deadline,
+            )
 
         logger.info(f"Created honeypot filesystem at {self.fake_fs}")
 
@@ -240,7 +325,7 @@ class CowrieDesignerRole(HoneypotDesignerRole):
         """
         Add fake commands to the cowrie container
         """
-        command_designer = CowrieCommandDesigner(self.llm)
+        command_designer = CowrieCommandDesigner(self.llm, self.async_llm)
         command_responses = command_designer.generate_command_responses(100)
 
         pickle_bin_path = self.pickle_fs / "bin"
@@ -271,8 +356,28 @@ class CowrieDesignerRole(HoneypotDesignerRole):
         tokens = {
             "file": file
         }
-        file_contents = self.llm.ask(prompt.linux_important_files_creator(tokens))
-        
+        try:
+            file_contents = self.llm.ask(prompt.linux_important_files_creator(tokens))
+        except Exception as e:
+            logger.warning(f"Failed to generate system file {file}. Error: {e}")
+            file_contents = "\n"
+        self._write_system_file(file, file_contents, pbar)
+
+    async def _add_system_file_async(self, file: str, pbar: tqdm) -> None:
+        """
+        Add contents to a system file with the async LLM endpoint
+        """
+        tokens = {
+            "file": file
+        }
+        try:
+            file_contents = await self.async_llm.ask(prompt.linux_important_files_creator(tokens))
+        except Exception as e:
+            logger.warning(f"Failed to generate system file {file}. Error: {e}")
+            file_contents = "\n"
+        self._write_system_file(file, file_contents, pbar)
+
+    def _write_system_file(self, file: str, file_contents: str, pbar: tqdm) -> None:
         file_path = self.fake_fs / file
         file_path.parent.mkdir(parents=True, exist_ok=True)
         file_path.write_text(file_contents)
@@ -282,6 +387,10 @@ class CowrieDesignerRole(HoneypotDesignerRole):
         """
         Add contents to files containing system information
         """
+        if self.async_llm is not None:
+            asyncio.run(self.add_system_information_files_async())
+            return
+
         # Create a separate thread for each generation
         threads: list[threading.Thread] = []
 
@@ -301,6 +410,13 @@ class CowrieDesignerRole(HoneypotDesignerRole):
             for t in threads:
                 t.join()
 
+    async def add_system_information_files_async(self):
+        """
+        Add contents to files containing system information as asyncio tasks
+        """
+        with trange_wrapper(len(linux_system_files), desc="Generating system files", leave=False) as pbar:
+            await asyncio.gather(*(self._add_system_file_async(file, pbar) for file in linux_system_files))
+
     def configure_banners_and_prompts(self):
         """
         Configure the look of the honeypot
@@ -16,6 +16,17 @@ def safe_generator(generator):
             
 
 
+def write_file_contents(path: Path, contents: str | bytes) -> None:
+    """
+    Write text or rendered binary contents to a file, creating its folder
+    """
+    path.parent.mkdir(exist_ok=True, parents=True)
+    if isinstance(contents, bytes):
+        path.write_bytes(contents)
+    else:
+        path.write_text(contents)
+
+
 def copy_local_filenames(src_dir, dest_dir, max_depth: int = 3):
     """
     Copy all filenames from src_dir to dest_dir without copying the file contents.
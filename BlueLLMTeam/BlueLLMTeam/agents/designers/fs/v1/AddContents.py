@@ -5,92 +5,244 @@ Last Modified: Simon Paulsson
 Context: This file is part of BlueLLMTeam to add content to some types of file
 
 Feel free to add new type of files ass you need it
+
+The contents of each file type are created by a chain of prompts. The chains are
+written as generators that yield a prompt and receive the response, so that the
+same chain can be run against blocking or asyncio LLM endpoints, or batch backends.
 """
 
 import os
+import asyncio
 import logging
+from pathlib import Path
+from typing import Generator
 
-from BlueLLMTeam.LLMEndpoint import LLMEndpointBase
+from BlueLLMTeam.LLMEndpoint import LLMEndpointBase, AsyncLLMEndpointBase
+from BlueLLMTeam.LLMBatch import BatchBackendBase, run_batch
 from BlueLLMTeam import PromptDict as prompt
+from BlueLLMTeam.utils.csv_engine import parse_schema, synthesize_csv
+from BlueLLMTeam.utils.documents import is_rendered_file, parse_document, render
 
 
 logger = logging.getLogger(__name__)
 
+# 'schema' generates csv rows locally from a schema designed by the LLM, 'legacy' asks the LLM for all rows
+CSV_ENGINE = os.getenv("CSV_ENGINE", "schema")
 
-def create_file_contents(file_path, llm_endpoint: LLMEndpointBase):
+# A chain of prompts. Yields prompt dicts, receives responses and returns the file contents
+PromptSteps = Generator[dict, str, str]
+
+
+def run_steps(steps: PromptSteps, llm_endpoint: LLMEndpointBase) -> str:
+    """
+    Send every prompt of a chain to the LLM and return the result of the chain
+    """
+    try:
+        prompt_dict = next(steps)
+        while True:
+            prompt_dict = steps.send(llm_endpoint.ask(prompt_dict))
+    except StopIteration as stop:
+        return stop.value
+
+
+async def run_steps_async(steps: PromptSteps, llm_endpoint: AsyncLLMEndpointBase) -> str:
+    """
+    Send every prompt of a chain to an async LLM and return the result of the chain
+
+    The chain is advanced in a worker thread, since it may render documents or
+    generate csv rows locally after the last response
+    """
+    try:
+        prompt_dict = next(steps)
+    except StopIteration as stop:
+        return stop.value
+    while True:
+        done, value = await asyncio.to_thread(send_step, steps, await llm_endpoint.ask(prompt_dict))
+        if done:
+            return value
+        prompt_dict = value
+
+
+def send_step(steps: PromptSteps, response: str) -> tuple[bool, dict | str]:
+    """
+    Send a response to a chain and return (False, next prompt), or (True, result) when the chain is done
+
+    StopIteration can not be raised through asyncio.to_thread, so the end of the chain is returned instead
+    """
+    try:
+        return False, steps.send(response)
+    except StopIteration as stop:
+        return True, stop.value
+
+
+def run_steps_batch(chains: dict[str, PromptSteps], backend: BatchBackendBase, work_dir: Path, **kwargs) -> dict[str, str]:
+    """
+    Run many chains of prompts with a batch backend
+
+    The current prompt of every unfinished chain is sent in one batch per round.
+    Chains that get no response are dropped and missing from the result.
+    """
+    results: dict[str, str] = {}
+    pending: dict[str, dict] = {}
+    for key, steps in chains.items():
+        try:
+            pending[key] = next(steps)
+        except StopIteration as stop:
+            results[key] = stop.value
+
+    batch_round = 0
+    while pending:
+        batch_round += 1
+        logger.info(f"Running batch round {batch_round} with {len(pending)} prompts")
+        responses = run_batch(pending, backend, work_dir, **kwargs)
+        next_pending = {}
+        for key in pending:
+            if key not in responses:
+                logger.warning(f"No batch response for {key}")
+                continue
+            try:
+                next_pending[key] = chains[key].send(responses[key])
+            except StopIteration as stop:
+                results[key] = stop.value
+        pending = next_pending
+    return results
+
+
+def target_steps(steps: PromptSteps, file_path: str) -> PromptSteps:
+    """
+    Tag every prompt of a chain with the file it creates contents for
+    """
+    try:
+        prompt_dict = next(steps)
+        while True:
+            response = yield {**prompt_dict, "target": file_path}
+            prompt_dict = steps.send(response)
+    except StopIteration as stop:
+        return stop.value
+
+
+def file_contents_steps(file_path: str) -> PromptSteps:
+    """
+    Get the chain of prompts for a file, based on the file extension
+    """
     # Get the file extension
     _, file_extension = os.path.splitext(file_path)
 
     if file_extension == '.py':
-        return create_python_contents(file_path, llm_endpoint)
+        steps = python_contents_steps(file_path)
     elif file_extension == '.txt':
-        return create_text_contents(file_path, llm_endpoint)
+        steps = text_contents_steps(file_path)
     elif file_extension == '.csv':
-        return create_csv_contents(file_path, llm_endpoint)
+        steps = csv_contents_steps(file_path)
+    elif is_rendered_file(file_path):
+        steps = document_contents_steps(file_path)
     else:
-        return create_misc_file_contents(file_path, llm_endpoint)
+        steps = misc_file_contents_steps(file_path)
+    return target_steps(steps, file_path)
 
 
-def create_python_contents(file_path: str, llm_endpoint: LLMEndpointBase) -> str:
+def create_file_contents(file_path, llm_endpoint: LLMEndpointBase):
+    return run_steps(file_contents_steps(file_path), llm_endpoint)
+
+
+async def create_file_contents_async(file_path, llm_endpoint: AsyncLLMEndpointBase):
+    return await run_steps_async(file_contents_steps(file_path), llm_endpoint)
+
+
+def python_contents_steps(file_path: str) -> PromptSteps:
     """
     Create realistic looking python contents for .py files
     """
     #Ask the advisor what they think the python file should be based on within the current directory.
-    python_suggestion = prompt.python_advisor(file_path)
-    advisor_response = llm_endpoint.ask(python_suggestion)
+    advisor_response = yield prompt.python_advisor(file_path)
     #Gain insight from the advisor to produce the first set of code
-    python_code = prompt.python_coder(advisor_response)
-    python_code1 = llm_endpoint.ask(python_code)
+    python_code1 = yield prompt.python_coder(advisor_response)
     #Review itself to make sure the code looks correct and proper. Eliminate any keywords like fake data.
-    python_review = prompt.python_reviewer(python_code1)
-    file_response = llm_endpoint.ask(python_review)
+    file_response = yield prompt.python_reviewer(python_code1)
     return file_response
 
 
-def create_text_contents(file_path: str, llm_endpoint: LLMEndpointBase) -> str:
+def text_contents_steps(file_path: str) -> PromptSteps:
     """
     Create realistic looking text contents for .txt files
     """
     # Get advice from what we need to write in the text file based on the current working directory.
-    text_suggestion = prompt.text_file_advisor(file_path)
-    advisor_response = llm_endpoint.ask(text_suggestion)
+    advisor_response = yield prompt.text_file_advisor(file_path)
     # Take the advice and provide a aseries of questions for the writer to write about.
-    text_file = prompt.text_file_writer(advisor_response)
-    file_response = llm_endpoint.ask(text_file)
+    file_response = yield prompt.text_file_writer(advisor_response)
     return file_response
 
 
-def create_csv_contents(file_path: str, llm_endpoint: LLMEndpointBase) -> str:
+def csv_contents_steps(file_path: str) -> PromptSteps:
     """
     Create realistic csv contents for .csv files
+
+    The LLM designs the columns and a few example rows in one request and the
+    rows are generated locally. Falls back to the prompt chain of
+    legacy_csv_contents_steps if the schema cannot be used.
+    """
+    if CSV_ENGINE == "legacy":
+        return (yield from legacy_csv_contents_steps(file_path))
+    schema_response = yield prompt.csv_schema(file_path)
+    try:
+        return synthesize_csv(parse_schema(schema_response))
+    except Exception as e:
+        logger.warning(f"Failed to generate csv rows from the schema for {file_path}. Error: {e}")
+    return (yield from legacy_csv_contents_steps(file_path))
+
+
+def legacy_csv_contents_steps(file_path: str) -> PromptSteps:
+    """
+    Create csv contents for .csv files with a header prompt and nine prompts for rows
     """
     contents = ""
-    csv_advisor = prompt.csv_advisor(file_path)
-    csv_advisor_response = llm_endpoint.ask(csv_advisor)
-    csv_header = prompt.csv_header(csv_advisor_response)
-    csv_header_response = llm_endpoint.ask(csv_header)
+    csv_advisor_response = yield prompt.csv_advisor(file_path)
+    csv_header_response = yield prompt.csv_header(csv_advisor_response)
     contents += csv_header_response
-    
-    csv_first_rows = prompt.csv_writer(csv_header_response)
-    csv_first_rows_response = llm_endpoint.ask(csv_first_rows)
+
+    csv_first_rows_response = yield prompt.csv_writer(csv_header_response)
     contents += csv_first_rows_response
     x=0
     while x < 8:
-        csv_append = prompt.csv_appender(csv_header_response, csv_first_rows_response)
-        csv_append_response = llm_endpoint.ask(csv_append)
+        csv_append_response = yield prompt.csv_appender(csv_header_response, csv_first_rows_response)
         contents += csv_append_response
         x+=1
     return contents
 
 
-def create_misc_file_contents(file_path: str, llm_endpoint: LLMEndpointBase) -> str:
+def document_contents_steps(file_path: str) -> PromptSteps:
+    """
+    Create real .xlsx, .docx, .pdf, .png and .zip files
+
+    The LLM writes only the content, the file is rendered locally in a process pool.
+    """
+    _, file_extension = os.path.splitext(file_path)
+    document_response = yield prompt.document_content(file_path)
+    return render(file_extension, parse_document(document_response, file_path))
+
+
+def misc_file_contents_steps(file_path: str) -> PromptSteps:
     """
     Create miscellaneous file contents
     """
     #Get advice from what we need to write in the text file based on the current working directory.
-    text_suggestion = prompt.text_file_advisor(file_path)
-    advisor_response = llm_endpoint.ask(text_suggestion)
+    advisor_response = yield prompt.text_file_advisor(file_path)
     #Take the advice and provide a aseries of questions for the writer to write about.
-    text_file = prompt.text_file_writer(advisor_response)
-    file_response = llm_endpoint.ask(text_file)
+    file_response = yield prompt.text_file_writer(advisor_response)
     return file_response
+
+
+def create_python_contents(file_path: str, llm_endpoint: LLMEndpointBase) -> str:
+    return run_steps(python_contents_steps(file_path), llm_endpoint)
+
+
+def create_text_contents(file_path: str, llm_endpoint: LLMEndpointBase) -> str:
+    return run_steps(text_contents_steps(file_path), llm_endpoint)
+
+
+def create_csv_contents(file_path: str, llm_endpoint: LLMEndpointBase) -> str:
+    return run_steps(csv_contents_steps(file_path), llm_endpoint)
+
+
+def create_misc_file_contents(file_path: str, llm_endpoint: LLMEndpointBase) -> str:
+    return run_steps(misc_file_contents_steps(file_path), llm_endpoint)
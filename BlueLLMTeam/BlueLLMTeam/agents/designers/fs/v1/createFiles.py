@@ -1,13 +1,19 @@
 import os
+import functools
 from pathlib import Path
 import threading
 import logging
 from BlueLLMTeam.utils.tqdm import tqdm_wrapper, tqdm
 
 from BlueLLMTeam import PromptDict as prompt
-from BlueLLMTeam.LLMEndpoint import LLMEndpointBase, ChatGPTEndpoint
+from BlueLLMTeam.LLMEndpoint import LLMEndpointBase, AsyncLLMEndpointBase, ChatGPTEndpoint
+from BlueLLMTeam.LLMBatch import BatchBackendBase
 from . import AddContents
-from BlueLLMTeam.utils.threading import ThreadWithReturnValue
+from BlueLLMTeam.utils.multifile import group_small_files, parse_file_map
+from BlueLLMTeam.agents.designers.fs.fs import write_file_contents
+from BlueLLMTeam.utils.file_priority import file_value
+from BlueLLMTeam.utils.threading import PriorityPool, run_prioritized_async
+from BlueLLMTeam.utils.fs_budget import FileSystemBudget, OnFiles, breadth_first, breadth_first_async, FS_CONTENT_WORKERS, FS_CONTENT_DEADLINE
 
 
 logger = logging.getLogger(__name__)
@@ -37,51 +43,182 @@ def generate_file_content(file: str, local_fs: Path, llm: LLMEndpointBase, light
 
     # Write contents to the file
     try:
-        local_file_path.parent.mkdir(exist_ok=True, parents=True)
-        local_file_path.write_text(contents)
+        write_file_contents(local_file_path, contents)
     except Exception as e:
         logger.warning(f"Failed to write file contents for {local_file_path}. Error: {e}")
         return
 
 
+def generate_file_group_content(
+        files: list[str],
+        local_fs: Path,
+        llm: LLMEndpointBase,
+):
+    """
+    Generate the contents of several small files in one request
+
+    The LLM answers with a JSON map from file path to contents. Files that are
+    missing or malformed in the answer are generated one by one.
+    """
+    try:
+        contents = parse_file_map(llm.ask(prompt.multi_file_contents_employee(files)), files)
+    except Exception as e:
+        logger.warning(f"Failed to generate file contents for {len(files)} files in {os.path.dirname(files[0])}. Error: {e}")
+        contents = {}
+    if len(contents) < len(files):
+        logger.info(f"Generating {len(files) - len(contents)} of {len(files)} files one by one")
+
+    for file in files:
+        if file not in contents:
+            generate_file_content(file, local_fs, llm)
+            continue
+        local_file_path = local_fs / file.lstrip("/")
+        try:
+            local_file_path.parent.mkdir(exist_ok=True, parents=True)
+            local_file_path.write_text(contents[file])
+        except Exception as e:
+            logger.warning(f"Failed to write file contents for {local_file_path}. Error: {e}")
+
+
 def generate_file_contents(
         local_fs: Path,
         files: list[str],
         honey_context: str,
         llm: LLMEndpointBase,
         light_weight: bool = False,
+        multi_file: bool = False,
+        max_workers: int = FS_CONTENT_WORKERS,
+        deadline: float = FS_CONTENT_DEADLINE,
     ):
     """
     Create a file for the fake file system
+
+    With multi_file, small files in the same folder are generated together in one request.
+    Files are generated by max_workers threads, most valuable first. Files that have
+    not been started when the deadline in seconds is reached are left empty.
     """
     # Remove possible duplicates
     files = set(files)
 
-    # Wrapper function for file generation to update a progress bar
-    def wrapper(pbar: tqdm, lock: threading.Lock, **kwargs):
-        generate_file_content(**kwargs)
+    # Generate the most valuable files first, so the honeypot is usable early
+    with tqdm_wrapper(total=len(files), desc="Generating file contents", leave=False) as pbar:
+        pool = PriorityPool(max_workers, deadline)
+        submit_file_contents(pool, files, local_fs, llm, pbar, light_weight, multi_file)
+        skipped = pool.close()
+
+    write_skipped_files(skipped, local_fs, llm)
+
+
+def submit_file_contents(
+        pool: PriorityPool,
+        files: list[str],
+        local_fs: Path,
+        llm: LLMEndpointBase,
+        pbar: tqdm,
+        light_weight: bool = False,
+        multi_file: bool = False,
+    ):
+    """
+    Queue the generation of the file contents on the pool, prioritized by file_value
+    """
+    if multi_file and not light_weight:
+        groups = group_small_files(files)
+    else:
+        groups = [[file] for file in files]
+
+    lock = threading.Lock()
+
+    def task(group: list[str]):
+        if len(group) == 1:
+            generate_file_content(group[0], local_fs, llm, light_weight)
+        else:
+            generate_file_group_content(group, local_fs, llm)
         with lock:
-            pbar.update(1)
+            pbar.update(len(group))
 
-    # Create a lot of threads
-    with tqdm_wrapper(total=len(files), desc="Generating file contents", leave=False) as pbar:
-        lock = threading.Lock()
-        threads: list[threading.Thread] = []
-        for file in files:
-            kwargs = {
-                "pbar": pbar,
-                "lock": lock,
-                "file": file,
-                "local_fs": local_fs,
-                "llm": llm,
-                "light_weight": light_weight,
-            }
-            t = threading.Thread(target=wrapper, kwargs=kwargs)
-            threads.append(t)
-        for t in threads:
-            t.start()
-        for t in threads:
-            t.join()
+    for group in groups:
+        pool.submit(max(file_value(file) for file in group), functools.partial(task, group))
+
+
+def write_skipped_files(skipped: list[functools.partial], local_fs: Path, llm: LLMEndpointBase):
+    """
+    Leave the files that were cut off by the deadline empty
+    """
+    for skipped_task in skipped:
+        for file in skipped_task.args[0]:
+            generate_file_content(file, local_fs, llm, light_weight=True)
+
+
+def generate_file_system_with_contents(
+        current_folder: str,
+        honey_context: str,
+        llm: LLMEndpointBase,
+        local_fs: Path,
+        max_depth: int = 5,
+        budget: FileSystemBudget = None,
+        light_weight: bool = False,
+        multi_file: bool = False,
+        max_workers: int = FS_CONTENT_WORKERS,
+        deadline: float = FS_CONTENT_DEADLINE,
+    ) -> list[str]:
+    """
+    Generate a file system and its file contents at the same time
+
+    The files of each folder are queued for content generation as soon as the
+    folder is listed, instead of after the whole tree is discovered. See
+    generate_file_system and generate_file_contents. The deadline counts from
+    the start of the discovery.
+
+    Returns:
+        files: all files of the file system
+    """
+    seen: set[str] = set()
+    with tqdm_wrapper(total=0, desc="Generating file contents", leave=False) as pbar:
+        pool = PriorityPool(max_workers, deadline)
+
+        def on_files(files: list[str]):
+            # Remove possible duplicates
+            new_files = [file for file in dict.fromkeys(files) if file not in seen]
+            seen.update(new_files)
+            pbar.total += len(new_files)
+            pbar.refresh()
+            submit_file_contents(pool, new_files, local_fs, llm, pbar, light_weight, multi_file)
+
+        files = generate_file_system(current_folder, honey_context, llm, max_depth=max_depth, budget=budget, on_files=on_files)
+        skipped = pool.close()
+
+    write_skipped_files(skipped, local_fs, llm)
+    return files
+
+
+def generate_file_contents_batch(
+        local_fs: Path,
+        files: list[str],
+        honey_context: str,
+        backend: BatchBackendBase,
+        work_dir: Path,
+        light_weight: bool = False,
+    ):
+    """
+    Create the files for the fake file system with a batch backend
+
+    All prompt chains advance one step per batch. Files without a result get empty contents.
+    """
+    # Remove possible duplicates
+    files = set(files)
+
+    if light_weight:
+        contents = {}
+    else:
+        chains = {file: AddContents.file_contents_steps(file) for file in files}
+        contents = AddContents.run_steps_batch(chains, backend, work_dir)
+
+    for file in tqdm_wrapper(files, desc="Writing file contents", leave=False):
+        local_file_path = local_fs / file.lstrip("/")
+        try:
+            write_file_contents(local_file_path, contents.get(file, "\n"))
+        except Exception as e:
+            logger.warning(f"Failed to write file contents for {local_file_path}. Error: {e}")
 
 
 def generate_file_system(
@@ -89,41 +226,44 @@ def generate_file_system(
         honey_context: str, 
         llm: LLMEndpointBase, 
         depth: int = 0, 
-        max_depth: int = 5
+        max_depth: int = 5,
+        budget: FileSystemBudget = None,
+        on_files: OnFiles = None,
     ) -> list[str]:
     """
-    Generate a file system recursively. 
+    Generate a file system breadth first. 
     
     From the 'current_folder' generate subfolders and files. 
-    Recursively generate more contents in the subfolders and
-    generate contents for the files with an LLM.
-
-    Break at a maximum depth to stop to deep filesystems
+    The subfolders are expanded in turn from a work queue, until the
+    maximum depth or the budget for folders, files or LLM calls is reached.
 
     Args:
-        local_fs: path to the local storage of the filesystem
         current_folder: current folder to generate contents for
         honey_context: the context for the filesystem
         llm: the LLM endpoint to use for prompting
         depth: current depth
-        max_depth: maximum depth, break if this is exceeded
+        max_depth: maximum depth, folders deeper than this are not expanded
+        budget: limits on folders, files, LLM calls and concurrency. Defaults to the FS_MAX_* settings
+        on_files: called with the files of each folder as soon as it is listed
     """
-    folder_contents: list[str] = []
-    if depth > max_depth:
-        return folder_contents
-    
-    tokens = {
-        "HONEY_DESCRIPTION": honey_context,
-        "PATH": current_folder,
-    }
-    prompt_dict = prompt.file_system_creator(tokens)
-    response: str = llm.ask(prompt_dict)
+    def expand(folder: str) -> tuple[list[str], list[str]]:
+        tokens = {
+            "HONEY_DESCRIPTION": honey_context,
+            "PATH": folder,
+        }
+        response: str = llm.ask(prompt.file_system_creator(tokens))
+        return parse_folder_contents(folder, response)
 
-    new_folder_contents = response.split("\n")
+    return breadth_first(current_folder, expand, budget, max_depth, depth, on_files)
 
-    threads: list[ThreadWithReturnValue] = []
 
-    for folder_content in new_folder_contents:
+def parse_folder_contents(current_folder: str, response: str) -> tuple[list[str], list[str]]:
+    """
+    Parse the response of the file system creator into files and sub folders
+    """
+    files: list[str] = []
+    folders: list[str] = []
+    for folder_content in response.split("\n"):
         folder_content = folder_content.strip()
 
         # Ignore empty lines
@@ -133,36 +273,121 @@ def generate_file_system(
         if folder_content.startswith("#"):
             # Remove '#' from folder name
             folder_name = folder_content[1:].strip()
-            next_folder = os.path.join(current_folder, folder_name)
-
-            # Recursively add more folders in a new thread
-            kwargs = {
-                "current_folder" : next_folder,
-                "honey_context" : honey_context,
-                "llm" : llm,
-                "depth" : depth + 1,
-                "max_depth" : max_depth,
-            }
-            t = ThreadWithReturnValue(target=generate_file_system, kwargs=kwargs)
-            threads.append(t)
+            folders.append(os.path.join(current_folder, folder_name))
         else:
-            # Add the file to the contents of this folder
-            folder_contents.append(os.path.join(current_folder, folder_content.strip()))
-            
-            
-    # Spawn new threads
-    for t in threads:
-        t.start()
-    
-    # Wait for all threads to complete and extend the folder contents
-    sub_contents = []
-    for t in threads:
-        contents = t.join()
-        if contents is not None:
-            sub_contents.extend(contents)
-    
-    folder_contents.extend(sub_contents)
-    return folder_contents
+            files.append(os.path.join(current_folder, folder_content))
+    return files, folders
+
+
+async def generate_file_content_async(file: str, local_fs: Path, llm: AsyncLLMEndpointBase, light_weight: bool = False):
+    """
+    Generate file contents with an async LLM endpoint. See generate_file_content
+    """
+    local_file_path = local_fs / file.lstrip("/")
+
+    # Generate file contents
+    if light_weight:
+        contents = "\n"
+    else:
+        try:
+            contents = await AddContents.create_file_contents_async(file, llm)
+        except Exception as e:
+            logger.warning(f"Failed to generate file contents for {file}. Error: {e}")
+            contents = "\n"
+
+    # Write contents to the file
+    try:
+        write_file_contents(local_file_path, contents)
+    except Exception as e:
+        logger.warning(f"Failed to write file contents for {local_file_path}. Error: {e}")
+
+
+async def generate_file_group_content_async(
+        files: list[str],
+        local_fs: Path,
+        llm: AsyncLLMEndpointBase,
+):
+    """
+    Generate the contents of several small files in one request with an async LLM endpoint. See generate_file_group_content
+    """
+    try:
+        contents = parse_file_map(await llm.ask(prompt.multi_file_contents_employee(files)), files)
+    except Exception as e:
+        logger.warning(f"Failed to generate file contents for {len(files)} files in {os.path.dirname(files[0])}. Error: {e}")
+        contents = {}
+    if len(contents) < len(files):
+        logger.info(f"Generating {len(files) - len(contents)} of {len(files)} files one by one")
+
+    for file in files:
+        if file not in contents:
+            await generate_file_content_async(file, local_fs, llm)
+            continue
+        local_file_path = local_fs / file.lstrip("/")
+        try:
+            local_file_path.parent.mkdir(exist_ok=True, parents=True)
+            local_file_path.write_text(contents[file])
+        except Exception as e:
+            logger.warning(f"Failed to write file contents for {local_file_path}. Error: {e}")
+
+
+async def generate_file_contents_async(
+        local_fs: Path,
+        files: list[str],
+        honey_context: str,
+        llm: AsyncLLMEndpointBase,
+        light_weight: bool = False,
+        multi_file: bool = False,
+        max_workers: int = FS_CONTENT_WORKERS,
+        deadline: float = FS_CONTENT_DEADLINE,
+    ):
+    """
+    Create the files for the fake file system as asyncio tasks instead of threads
+
+    Takes the same options as generate_file_contents, with max_workers tasks in flight at a time
+    """
+    # Remove possible duplicates
+    files = set(files)
+
+    if multi_file and not light_weight:
+        groups = group_small_files(files)
+    else:
+        groups = [[file] for file in files]
+
+    with tqdm_wrapper(total=len(files), desc="Generating file contents", leave=False) as pbar:
+        async def task(group: list[str]):
+            if len(group) == 1:
+                await generate_file_content_async(group[0], local_fs, llm, light_weight)
+            else:
+                await generate_file_group_content_async(group, local_fs, llm)
+            pbar.update(len(group))
+
+        # Generate the most valuable files first, so the honeypot is usable early
+        tasks = [(max(file_value(file) for file in group), functools.partial(task, group)) for group in groups]
+        skipped = await run_prioritized_async(tasks, max_workers, deadline)
+
+    write_skipped_files(skipped, local_fs, llm)
+
+
+async def generate_file_system_async(
+        current_folder: str,
+        honey_context: str,
+        llm: AsyncLLMEndpointBase,
+        depth: int = 0,
+        max_depth: int = 5,
+        budget: FileSystemBudget = None,
+    ) -> list[str]:
+    """
+    Generate a file system breadth first with an async LLM endpoint. See generate_file_system
+    """
+    async def expand(folder: str) -> tuple[list[str], list[str]]:
+        tokens = {
+            "HONEY_DESCRIPTION": honey_context,
+            "PATH": folder,
+        }
+        response: str = await llm.ask(prompt.file_system_creator(tokens))
+        return parse_folder_contents(folder, response)
+
+    return await breadth_first_async(current_folder, expand, budget, max_depth, depth)
 
 
 if __name__ == "__main__":
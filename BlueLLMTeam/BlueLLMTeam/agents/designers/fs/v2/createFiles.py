@@ -1,12 +1,26 @@
 import os
-import json
+import asyncio
 import logging
+import functools
 import threading
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from BlueLLMTeam.utils.tqdm import trange_wrapper, tqdm, tqdm_wrapper
 
-from BlueLLMTeam.LLMEndpoint import LLMEndpointBase
+from BlueLLMTeam.LLMEndpoint import LLMEndpointBase, AsyncLLMEndpointBase
+from BlueLLMTeam.LLMBatch import BatchBackendBase, run_batch
 from BlueLLMTeam import PromptDict as prompt
+from BlueLLMTeam.utils.multifile import group_small_files, parse_file_map
+from BlueLLMTeam.agents.designers.fs.fs import write_file_contents
+from BlueLLMTeam.utils.documents import is_rendered_file, parse_document, render, render_async
+from BlueLLMTeam.utils.file_priority import file_value
+from BlueLLMTeam.utils.fs_budget import FS_CONTENT_WORKERS, FS_CONTENT_DEADLINE
+from BlueLLMTeam.utils.fs_budget import FS_ENHANCE_ROUNDS, FS_ENHANCE_MIN_GROWTH, FS_ENHANCE_TARGET_ENTRIES, FS_ENHANCE_SUBTREES, FS_JSON_RETRIES
+from BlueLLMTeam.utils.fs_budget import FS_PROMPT_TOKENS, FS_OVERVIEW_TOKENS
+from BlueLLMTeam.utils.text import repair_json
+from BlueLLMTeam.utils.fs_structure import structure_entries, structure_growth, split_subtrees, merge_subtrees
+from BlueLLMTeam.utils.fs_structure import relevant_structure, structure_overview
+from BlueLLMTeam.utils.threading import run_prioritized, run_prioritized_async
 
 
 logger = logging.getLogger(__name__)
@@ -18,24 +32,95 @@ def create_file_structure(llm_endpoint: LLMEndpointBase) -> str:
     return response
 
 
-def create_file_structure_employee(file_structure, llm_endpoint: LLMEndpointBase) -> str:
-    file_creator = prompt.file_system_employee(file_structure)
+def create_file_structure_employee(file_structure, llm_endpoint: LLMEndpointBase, error: str = None) -> str:
+    file_creator = prompt.file_system_employee(file_structure, error)
     response = llm_endpoint.ask(file_creator)
     return response
 
 
+def convert_file_structure(file_structure: str, llm_endpoint: LLMEndpointBase, retries: int = FS_JSON_RETRIES) -> dict:
+    """
+    Convert the enhanced file structure to JSON
+
+    Truncated or almost valid JSON is repaired locally. Only this conversion
+    step is retried on failure, with the error added to the prompt.
+    """
+    error = None
+    for attempt in range(retries + 1):
+        response = create_file_structure_employee(file_structure, llm_endpoint, error)
+        try:
+            json_structure = repair_json(response)
+        except ValueError as e:
+            error = str(e)
+        else:
+            if isinstance(json_structure, dict) and json_structure:
+                return json_structure
+            error = "expected a non-empty JSON object"
+        logger.warning(f"Failed to convert the file structure to JSON, attempt {attempt + 1}. Error: {error}")
+    raise ValueError(f"Failed to convert the file structure to JSON: {error}")
+
+
 def create_file_structure_enhance(file_structure, llm_endpoint: LLMEndpointBase) -> str:
     file_enhancer = prompt.file_system_enhancer(file_structure)
     response = llm_endpoint.ask(file_enhancer)
     return response
 
 
-def create_file_structure_contents(file_structure, llm_endpoint: LLMEndpointBase, file) -> str:
-    file_contents = prompt.file_contents_employee(file_structure, file)
+def create_file_structure_contents(file_structure, llm_endpoint: LLMEndpointBase, file, overview: str = None) -> str | bytes:
+    file_contents = file_contents_prompt(file_structure, file, overview)
     response = llm_endpoint.ask(file_contents)
+    return finish_contents(file, response)
+
+
+def finish_contents(file: str, response: str) -> str | bytes:
+    """
+    Render office documents, images and archives from the content the LLM wrote for them
+    """
+    if is_rendered_file(file):
+        _, extension = os.path.splitext(file)
+        return render(extension, parse_document(response, file))
     return response
 
 
+async def finish_contents_async(file: str, response: str) -> str | bytes:
+    """
+    Asyncio version of finish_contents, which renders without blocking the event loop
+    """
+    if is_rendered_file(file):
+        _, extension = os.path.splitext(file)
+        return await render_async(extension, parse_document(response, file))
+    return response
+
+
+def file_contents_prompt(file_structure: dict, file: str, overview: str = None) -> dict:
+    """
+    Prompt for the contents of a file with a compact file structure
+
+    The prompt contains only the part of the structure around the file, within
+    FS_PROMPT_TOKENS, and an overview of the whole structure within
+    FS_OVERVIEW_TOKENS. The overview is the same for all files, so pass it in
+    when generating many files. The full structure is used if FS_PROMPT_TOKENS is 0.
+    """
+    # The LLM writes only the content of files that are rendered locally
+    build_prompt = prompt.document_content if is_rendered_file(file) else prompt.file_contents_employee
+    if FS_PROMPT_TOKENS <= 0:
+        return build_prompt(file_structure=file_structure, file=file)
+    if overview is None:
+        overview = structure_overview(file_structure, FS_OVERVIEW_TOKENS)
+    return build_prompt(file_structure=relevant_structure(file_structure, file, FS_PROMPT_TOKENS), file=file, overview=overview)
+
+
+def multi_file_contents_prompt(files: list[str], file_structure: dict, overview: str = None) -> dict:
+    """
+    Prompt for the contents of several files in the same folder. See file_contents_prompt
+    """
+    if FS_PROMPT_TOKENS <= 0:
+        return prompt.multi_file_contents_employee(files, file_structure)
+    if overview is None:
+        overview = structure_overview(file_structure, FS_OVERVIEW_TOKENS)
+    return prompt.multi_file_contents_employee(files, relevant_structure(file_structure, files[0], FS_PROMPT_TOKENS), overview)
+
+
 def json_fs_to_file_paths(current_folder: str, fs: dict) -> list[str]:
     files = []
     for key, value in fs.items():
@@ -47,6 +132,68 @@ def json_fs_to_file_paths(current_folder: str, fs: dict) -> list[str]:
     return files
 
 
+def build_file_structure(files: set[str]) -> dict:
+    """
+    Build a nested dictionary of folders from a list of file paths
+    """
+    file_structure = {}
+    for file in files:
+        parts = os.path.normpath(file).split(os.sep)
+        sub_file_structure = file_structure
+        for part in parts[:-1]:
+            if part not in sub_file_structure:
+                sub_file_structure[part] = {}
+            sub_file_structure = sub_file_structure[part]
+        sub_file_structure[parts[-1]] = ""
+    return file_structure
+
+
+def enhance_file_structure(
+        file_structure: str,
+        llm_endpoint: LLMEndpointBase,
+        rounds: int = FS_ENHANCE_ROUNDS,
+        min_growth: float = FS_ENHANCE_MIN_GROWTH,
+        target_entries: int = FS_ENHANCE_TARGET_ENTRIES,
+        subtrees: int = FS_ENHANCE_SUBTREES,
+) -> str:
+    """
+    Enhance a file structure until it stops growing
+
+    Stops after 'rounds' rounds, when a round adds less than min_growth new
+    files and folders relative to the previous round, or when the structure
+    has target_entries files and folders. With subtrees, the top level
+    subtrees are enhanced by that many threads in parallel and merged.
+    """
+    entries = structure_entries(file_structure)
+    for step in trange_wrapper(rounds, desc="Increasing filesystem complexity", leave=False):
+        header, parts, indent = split_subtrees(file_structure)
+        if subtrees > 0 and len(parts) > 1:
+            with ThreadPoolExecutor(max_workers=subtrees) as executor:
+                enhanced = list(executor.map(lambda part: enhance_subtree(part, llm_endpoint), parts))
+            file_structure = merge_subtrees(header, enhanced, indent)
+        else:
+            file_structure = create_file_structure_enhance(file_structure, llm_endpoint)
+
+        new_entries = structure_entries(file_structure)
+        growth = structure_growth(entries, new_entries)
+        entries = new_entries
+        logger.info(f"Enhancement round {step + 1}: {len(entries)} files and folders, growth {growth:.0%}")
+        if growth < min_growth or len(entries) >= target_entries:
+            break
+    return file_structure
+
+
+def enhance_subtree(subtree: str, llm_endpoint: LLMEndpointBase) -> str:
+    """
+    Enhance one subtree of a file structure. The subtree is kept as it is on errors
+    """
+    try:
+        return create_file_structure_enhance(subtree, llm_endpoint)
+    except Exception as e:
+        logger.warning(f"Failed to enhance subtree. Error: {e}")
+        return subtree
+
+
 def generate_file_system(
         current_folder: str, 
         honey_context: str, 
@@ -60,13 +207,11 @@ def generate_file_system(
     # Initial prompt and response
     pm_response = create_file_structure(llm)
     system_file = create_file_structure_enhance(pm_response, llm)
-    #Range determines how complex and deep the system will generate file contents
-    for _ in trange_wrapper(8, desc="Increasing filesystem complexity", leave=False):
-        system_file = create_file_structure_enhance(system_file, llm)
+    # Enhance the structure until it converges. FS_ENHANCE_* determine how complex and deep the system will be
+    system_file = enhance_file_structure(system_file, llm)
     #Generate the json from the instructions given from the for loop.
-    file_structure_response=create_file_structure_employee(system_file, llm)
     try:
-        final_file_structure = json.loads(file_structure_response)
+        final_file_structure = convert_file_structure(system_file, llm)
         # Convert JSON to list of files
         return json_fs_to_file_paths(current_folder, final_file_structure)
     except Exception as e:
@@ -85,7 +230,8 @@ def generate_file_content(
         local_fs: Path,
         file_structure: dict,
         llm: LLMEndpointBase,
-        light_weight: bool = False
+        light_weight: bool = False,
+        overview: str = None,
 ):
     """
     Generate file contents and add them to a file on the system
@@ -95,6 +241,7 @@ def generate_file_content(
         local_fs: Path to the local directory to store the file under
         llm: LLM endpoint to send the request to
         light_weight: No generation with LLM, add only the text "\n" to each file
+        overview: Overview of the file structure, see file_contents_prompt
     """
     local_file_path = local_fs / file.lstrip("/")
     
@@ -103,68 +250,317 @@ def generate_file_content(
         contents = "\n"
     else:
         try:
-            contents = create_file_structure_contents(file_structure, llm, file)
+            contents = create_file_structure_contents(file_structure, llm, file, overview)
         except Exception as e:
             logger.warning(f"Failed to generate file contents for {file}. Error: {e}")
             contents = "\n"
 
     # Write contents to the file
     try:
-        local_file_path.parent.mkdir(exist_ok=True, parents=True)
-        local_file_path.write_text(contents)
+        write_file_contents(local_file_path, contents)
     except Exception as e:
         logger.warning(f"Failed to write file contents for {local_file_path}. Error: {e}")
         return
 
 
+def generate_file_group_content(
+        files: list[str],
+        local_fs: Path,
+        file_structure: dict,
+        llm: LLMEndpointBase,
+        overview: str = None,
+):
+    """
+    Generate the contents of several small files in one request
+
+    The LLM answers with a JSON map from file path to contents. Files that are
+    missing or malformed in the answer are generated one by one.
+    """
+    try:
+        contents = parse_file_map(llm.ask(multi_file_contents_prompt(files, file_structure, overview)), files)
+    except Exception as e:
+        logger.warning(f"Failed to generate file contents for {len(files)} files in {os.path.dirname(files[0])}. Error: {e}")
+        contents = {}
+    if len(contents) < len(files):
+        logger.info(f"Generating {len(files) - len(contents)} of {len(files)} files one by one")
+
+    for file in files:
+        if file not in contents:
+            generate_file_content(file, local_fs, file_structure, llm, overview=overview)
+            continue
+        local_file_path = local_fs / file.lstrip("/")
+        try:
+            local_file_path.parent.mkdir(exist_ok=True, parents=True)
+            local_file_path.write_text(contents[file])
+        except Exception as e:
+            logger.warning(f"Failed to write file contents for {local_file_path}. Error: {e}")
+
+
 def generate_file_contents(
         local_fs: Path,
         files: list[str],
         honey_context: str,
         llm: LLMEndpointBase,
         light_weight: bool = False,
+        multi_file: bool = False,
+        max_workers: int = FS_CONTENT_WORKERS,
+        deadline: float = FS_CONTENT_DEADLINE,
 ) -> list[str]:
     """
     Create a file for the fake file system
+
+    With multi_file, small files in the same folder are generated together in one request.
+    Files are generated by max_workers threads, most valuable first. Files that have
+    not been started when the deadline in seconds is reached are left empty.
     """
     # Remove possible duplicates
     files = set(files)
+    file_structure = build_file_structure(files)
+    overview = structure_overview(file_structure, FS_OVERVIEW_TOKENS)
+    if multi_file and not light_weight:
+        groups = group_small_files(files)
+    else:
+        groups = [[file] for file in files]
+
+    # Generate the most valuable files first, so the honeypot is usable early
+    logger.info(f"Generating file contents for {len(files)} files in {len(groups)} requests")
+    with tqdm_wrapper(total=len(files), desc="Generating file contents", leave=False) as pbar:
+        lock = threading.Lock()
+
+        def task(group: list[str]):
+            if len(group) == 1:
+                generate_file_content(group[0], local_fs, file_structure, llm, light_weight, overview)
+            else:
+                generate_file_group_content(group, local_fs, file_structure, llm, overview)
+            with lock:
+                pbar.update(len(group))
+
+        tasks = [
+            (max(file_value(file) for file in group), functools.partial(task, group))
+            for group in groups
+        ]
+        skipped = run_prioritized(tasks, max_workers, deadline)
+
+    # Leave the files that were cut off by the deadline empty
+    for skipped_task in skipped:
+        for file in skipped_task.args[0]:
+            generate_file_content(file, local_fs, file_structure, llm, light_weight=True)
+
+
+async def enhance_file_structure_async(
+        file_structure: str,
+        llm: AsyncLLMEndpointBase,
+        rounds: int = FS_ENHANCE_ROUNDS,
+        min_growth: float = FS_ENHANCE_MIN_GROWTH,
+        target_entries: int = FS_ENHANCE_TARGET_ENTRIES,
+        subtrees: int = FS_ENHANCE_SUBTREES,
+) -> str:
+    """
+    Enhance a file structure with an async LLM endpoint. See enhance_file_structure
+    """
+    semaphore = asyncio.Semaphore(max(1, subtrees))
+
+    async def enhance_subtree(subtree: str) -> str:
+        async with semaphore:
+            try:
+                return await llm.ask(prompt.file_system_enhancer(subtree))
+            except Exception as e:
+                logger.warning(f"Failed to enhance subtree. Error: {e}")
+                return subtree
+
+    entries = structure_entries(file_structure)
+
+    for step in trange_wrapper(rounds, desc="Increasing filesystem complexity", leave=False):
+        header, parts, indent = split_subtrees(file_structure)
+        if subtrees > 0 and len(parts) > 1:
+            enhanced = await asyncio.gather(*(enhance_subtree(part) for part in parts))
+            file_structure = merge_subtrees(header, enhanced, indent)
+        else:
+            file_structure = await llm.ask(prompt.file_system_enhancer(file_structure))
+
+        new_entries = structure_entries(file_structure)
+        growth = structure_growth(entries, new_entries)
+        entries = new_entries
+        logger.info(f"Enhancement round {step + 1}: {len(entries)} files and folders, growth {growth:.0%}")
+        if growth < min_growth or len(entries) >= target_entries:
+            break
+    return file_structure
+
+
+async def convert_file_structure_async(file_structure: str, llm: AsyncLLMEndpointBase, retries: int = FS_JSON_RETRIES) -> dict:
+    """
+    Convert the enhanced file structure to JSON with an async LLM endpoint. See convert_file_structure
+    """
+    error = None
+    for attempt in range(retries + 1):
+        response = await llm.ask(prompt.file_system_employee(file_structure, error))
+        try:
+            json_structure = repair_json(response)
+        except ValueError as e:
+            error = str(e)
+        else:
+            if isinstance(json_structure, dict) and json_structure:
+                return json_structure
+            error = "expected a non-empty JSON object"
+        logger.warning(f"Failed to convert the file structure to JSON, attempt {attempt + 1}. Error: {error}")
+    raise ValueError(f"Failed to convert the file structure to JSON: {error}")
+
+
+async def generate_file_system_async(
+        current_folder: str,
+        honey_context: str,
+        llm: AsyncLLMEndpointBase,
+        depth: int = 0,
+        max_depth: int = 5
+):
+    """
+    Generate a file system with an async LLM endpoint. See generate_file_system
+    """
+    for attempt in range(depth, max_depth):
+        pm_response = await llm.ask(prompt.file_system_lead())
+        system_file = await llm.ask(prompt.file_system_enhancer(pm_response))
+        system_file = await enhance_file_structure_async(system_file, llm)
+        try:
+            final_file_structure = await convert_file_structure_async(system_file, llm)
+            return json_fs_to_file_paths(current_folder, final_file_structure)
+        except Exception as e:
+            logger.error(f"Handle Conversation Error: {e}")
+    raise RecursionError(f"Failed to generate file system {max_depth} times")
+
+
+async def generate_file_content_async(
+        file: str,
+        local_fs: Path,
+        file_structure: dict,
+        llm: AsyncLLMEndpointBase,
+        light_weight: bool = False,
+        overview: str = None,
+):
+    """
+    Generate file contents with an async LLM endpoint. See generate_file_content
+    """
+    local_file_path = local_fs / file.lstrip("/")
+
+    # Generate file contents
+    if light_weight:
+        contents = "\n"
+    else:
+        try:
+            contents = await finish_contents_async(file, await llm.ask(file_contents_prompt(file_structure, file, overview)))
+        except Exception as e:
+            logger.warning(f"Failed to generate file contents for {file}. Error: {e}")
+            contents = "\n"
+
+    # Write contents to the file
+    try:
+        write_file_contents(local_file_path, contents)
+    except Exception as e:
+        logger.warning(f"Failed to write file contents for {local_file_path}. Error: {e}")
+
+
+async def generate_file_group_content_async(
+        files: list[str],
+        local_fs: Path,
+        file_structure: dict,
+        llm: AsyncLLMEndpointBase,
+        overview: str = None,
+):
+    """
+    Generate the contents of several small files in one request with an async LLM endpoint. See generate_file_group_content
+    """
+    try:
+        contents = parse_file_map(await llm.ask(multi_file_contents_prompt(files, file_structure, overview)), files)
+    except Exception as e:
+        logger.warning(f"Failed to generate file contents for {len(files)} files in {os.path.dirname(files[0])}. Error: {e}")
+        contents = {}
+    if len(contents) < len(files):
+        logger.info(f"Generating {len(files) - len(contents)} of {len(files)} files one by one")
 
-    # Build file structure
-    file_structure = {}
     for file in files:
-        parts = os.path.normpath(file).split(os.sep)
-        sub_file_structure = file_structure
-        for part in parts[:-1]:
-            if part not in sub_file_structure:
-                sub_file_structure[part] = {}
-            sub_file_structure = sub_file_structure[part]
-        sub_file_structure[parts[-1]] = ""
+        if file not in contents:
+            await generate_file_content_async(file, local_fs, file_structure, llm, overview=overview)
+            continue
+        local_file_path = local_fs / file.lstrip("/")
+        try:
+            local_file_path.parent.mkdir(exist_ok=True, parents=True)
+            local_file_path.write_text(contents[file])
+        except Exception as e:
+            logger.warning(f"Failed to write file contents for {local_file_path}. Error: {e}")
 
-    # Wrapper function for file generation to update a progress bar
-    def wrapper(pbar: tqdm, lock: threading.Lock, **kwargs):
-        generate_file_content(**kwargs)
-        with lock:
-            pbar.update(1)
 
-    # Create a lot of threads
-    logger.info(f"Generating file contents for {len(files)} files")
+async def generate_file_contents_async(
+        local_fs: Path,
+        files: list[str],
+        honey_context: str,
+        llm: AsyncLLMEndpointBase,
+        light_weight: bool = False,
+        multi_file: bool = False,
+        max_workers: int = FS_CONTENT_WORKERS,
+        deadline: float = FS_CONTENT_DEADLINE,
+):
+    """
+    Create the files for the fake file system as asyncio tasks instead of threads
+
+    Takes the same options as generate_file_contents, with max_workers tasks in flight at a time
+    """
+    # Remove possible duplicates
+    files = set(files)
+    file_structure = build_file_structure(files)
+    overview = structure_overview(file_structure, FS_OVERVIEW_TOKENS)
+    if multi_file and not light_weight:
+        groups = group_small_files(files)
+    else:
+        groups = [[file] for file in files]
+
+    # Generate the most valuable files first, so the honeypot is usable early
+    logger.info(f"Generating file contents for {len(files)} files in {len(groups)} requests")
     with tqdm_wrapper(total=len(files), desc="Generating file contents", leave=False) as pbar:
-        lock = threading.Lock()
-        threads: list[threading.Thread] = []
-        for file in files:
-            kwargs = {
-                "pbar": pbar,
-                "lock": lock,
-                "file": file,
-                "file_structure": file_structure,
-                "local_fs": local_fs,
-                "llm": llm,
-                "light_weight": light_weight,
-            }
-            t = threading.Thread(target=wrapper, kwargs=kwargs)
-            threads.append(t)
-        for t in threads:
-            t.start()
-        for t in threads:
-            t.join()
+        async def task(group: list[str]):
+            if len(group) == 1:
+                await generate_file_content_async(group[0], local_fs, file_structure, llm, light_weight, overview)
+            else:
+                await generate_file_group_content_async(group, local_fs, file_structure, llm, overview)
+            pbar.update(len(group))
+
+        tasks = [
+            (max(file_value(file) for file in group), functools.partial(task, group))
+            for group in groups
+        ]
+        skipped = await run_prioritized_async(tasks, max_workers, deadline)
+
+    # Leave the files that were cut off by the deadline empty
+    for skipped_task in skipped:
+        for file in skipped_task.args[0]:
+            await generate_file_content_async(file, local_fs, file_structure, llm, light_weight=True)
+
+
+def generate_file_contents_batch(
+        local_fs: Path,
+        files: list[str],
+        honey_context: str,
+        backend: BatchBackendBase,
+        work_dir: Path,
+        light_weight: bool = False,
+):
+    """
+    Create the files for the fake file system with a batch backend
+
+    Files without a result get empty contents.
+    """
+    # Remove possible duplicates
+    files = set(files)
+    file_structure = build_file_structure(files)
+
+    if light_weight:
+        contents = {}
+    else:
+        overview = structure_overview(file_structure, FS_OVERVIEW_TOKENS)
+        prompts = {file: file_contents_prompt(file_structure, file, overview) for file in files}
+        contents = {file: finish_contents(file, response) for file, response in run_batch(prompts, backend, work_dir).items()}
+
+    for file in tqdm_wrapper(files, desc="Writing file contents", leave=False):
+        local_file_path = local_fs / file.lstrip("/")
+        try:
+            write_file_contents(local_file_path, contents.get(file, "\n"))
+        except Exception as e:
+            logger.warning(f"Failed to write file contents for {local_file_path}. Error: {e}")
@@ -1,6 +1,5 @@
 import json
 import logging
-from random import randint
 
 from BlueLLMTeam.agents.base import AgentRoleBase
 from BlueLLMTeam.LLMEndpoint import LLMEndpointBase
@@ -14,7 +13,8 @@ AVAILABLE_HONEYPOTS = {
     "cowrie": "An SSH honeypot"
 }
 HONEYPOT_RESOURCES = "\n".join(f"- {honeypot}: {description}" for honeypot, description in AVAILABLE_HONEYPOTS.items())
-EXAMPLE_OUTPUT = "\n".join(f"- {honeypot}: {randint(0, 5)}" for honeypot in AVAILABLE_HONEYPOTS.keys())
+# Fixed, so the prompt is the same in every run and can be cached and replayed
+EXAMPLE_OUTPUT = "\n".join(f"- {honeypot}: 2" for honeypot in AVAILABLE_HONEYPOTS.keys())
 
 
 class TeamLeaderRole(AgentRoleBase):
@@ -28,9 +28,11 @@ class TeamLeaderRole(AgentRoleBase):
     def chat(self, conversation_history: list[dict]) -> str:
         raise NotImplementedError
     
-    def honeypot_amount(self, context: dict, retries: int = 5) -> dict[str, int]:
+    def honeypot_amount(self, context: dict, retries: int = 5, refresh: bool = False) -> dict[str, int]:
         """
         Get the number of honeypots to deploy of each type
+
+        With refresh, cached responses are not used, e.g. when the last answer was rejected
         """
         prompt = """
 # Task Description
@@ -62,10 +64,14 @@ Based on the company information provided and the available honeypots, generate
             "user": "",
             "context": "",
             "message": replace_tokens(prompt, tokens),
+            "kind": "honeypot_amount",
+            "refresh": refresh,
         }
 
         for _ in range(retries):
             response = self.llm.ask(prompt_dict)
+            # Do not get the same response from the cache if this one can not be used
+            prompt_dict["refresh"] = True
             # Parse out markdown list of honeypots from the LLM response
             try:
                 honeypot_list = extract_markdown_list(response)
@@ -93,11 +99,15 @@ Based on the company information provided and the available honeypots, generate
                     continue
                 count = int(count)
                 honeypot_count[honeypot_type] = count
+            if honeypot_count:
+                break
         return honeypot_count
     
-    def honeypot_design(self, context: dict, honeypot_count: dict[str, int], retries: int = 5) -> list[dict]:
+    def honeypot_design(self, context: dict, honeypot_count: dict[str, int], retries: int = 5, refresh: bool = False) -> list[dict]:
         """
         Get the honeypot design for all requested honeypots
+
+        With refresh, cached responses are not used, e.g. when the last designs were rejected
         """
         prompt = """
 You are to deploy one or more honeypots to defend a business with the following information:
@@ -130,10 +140,14 @@ Generate a list with {COUNT} honeypots.
                 "user": "",
                 "context": "",
                 "message": replace_tokens(prompt, tokens),
+                "kind": "honeypot_design",
+                "refresh": refresh,
             }
             honeypot_descriptions = []
             for _ in range(retries):
                 response = self.llm.ask(prompt_dict)
+                # Do not get the same response from the cache if this one can not be used
+                prompt_dict["refresh"] = True
                 try:
                     json_data = extract_json_from_text(response)
                 except ValueError:
@@ -1,13 +1,17 @@
 import os
+import time
+import queue
+import atexit
 import requests
 import logging
 import json
+import threading
 import pandas as pd
+from pathlib import Path
 from BlueLLMTeam.utils.tqdm import trange_wrapper, tqdm
 
 from dotenv import load_dotenv
 
-from threading import Thread
 from BlueLLMTeam.utils.threading import ThreadWithReturnValue
 
 
@@ -19,9 +23,26 @@ COLLECTION_URL_PROMPT = os.getenv('COLLECTION_URL_PROMPT')
 
 PAGE_COUNT = 5000
 
+PROMPT_LOG_BATCH_SIZE = int(os.getenv("PROMPT_LOG_BATCH_SIZE", 100))
+PROMPT_LOG_FLUSH_INTERVAL = float(os.getenv("PROMPT_LOG_FLUSH_INTERVAL", 5.0))
+PROMPT_LOG_QUEUE_SIZE = int(os.getenv("PROMPT_LOG_QUEUE_SIZE", 10000))
+PROMPT_LOG_SPILL_FILE = Path(os.getenv("PROMPT_LOG_SPILL_FILE", Path.home() / ".cache" / "BlueLLMTeam" / "prompt_log_spill.jsonl"))
+PROMPT_LOG_SPILL_MAX_BYTES = int(os.getenv("PROMPT_LOG_SPILL_MAX_BYTES", 50 * 1024 * 1024))
+
 logger = logging.getLogger(__name__)
 
 
+def is_configured(destination: str) -> bool:
+    """
+    Check if the collection URL of a destination is set
+    """
+    urls = {
+        "CowrieLogs": COLLECTION_URL_COWRIE,
+        "PromptLog": COLLECTION_URL_PROMPT,
+    }
+    return bool(urls.get(destination))
+
+
 def send_payload(payload: dict, destination: str, endpoint: str) -> requests.Response:
     """
     Build the payload
@@ -54,6 +75,221 @@ def send_payload(payload: dict, destination: str, endpoint: str) -> requests.Res
     return response
 
 
+class DocumentQueue:
+    """
+    Bounded in-process buffer that inserts documents in batches with insertMany
+
+    A background thread sends a batch when batch_size documents are waiting or
+    when flush_interval seconds have passed. Producers block for at most
+    put_timeout seconds when the buffer is full. Documents that do not fit,
+    or that fail to be sent, are appended to a local spill file and sent the
+    next time the queue starts. The spill file is capped at max_spill_bytes.
+    Documents are dropped if the destination is not configured.
+    """
+
+    def __init__(
+            self,
+            destination: str,
+            batch_size: int = PROMPT_LOG_BATCH_SIZE,
+            flush_interval: float = PROMPT_LOG_FLUSH_INTERVAL,
+            max_size: int = PROMPT_LOG_QUEUE_SIZE,
+            spill_file: Path = PROMPT_LOG_SPILL_FILE,
+            put_timeout: float = 1.0,
+            max_spill_bytes: int = PROMPT_LOG_SPILL_MAX_BYTES,
+        ) -> None:
+        self.destination = destination
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_file = Path(spill_file)
+        self.put_timeout = put_timeout
+        self.max_spill_bytes = max_spill_bytes
+        self.warned = False
+
+        self.queue: queue.Queue[dict] = queue.Queue(maxsize=max_size)
+        self.spill_lock = threading.Lock()
+        self.start_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread: threading.Thread | None = None
+
+    def _start(self) -> None:
+        with self.start_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name=f"{self.destination}Queue", daemon=True)
+                self.thread.start()
+
+    def put(self, document: dict) -> bool:
+        """
+        Add a document to the buffer
+
+        Returns:
+            queued: False if the buffer was full and the document was spilled to disk,
+                    or if the destination is not configured and the document was dropped
+        """
+        if not is_configured(self.destination):
+            if not self.warned:
+                self.warned = True
+                logger.warning(f"{self.destination} is not configured. Its documents are not stored")
+            return False
+        self._start()
+        try:
+            self.queue.put(document, timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            logger.warning(f"{self.destination} buffer is full. Spilling to {self.spill_file}")
+            self.spill([document])
+            return False
+
+    def spill(self, documents: list[dict]) -> None:
+        """
+        Append documents to the spill file. Documents that do not fit under max_spill_bytes are dropped
+        """
+        with self.spill_lock:
+            size = self.spill_file.stat().st_size if self.spill_file.exists() else 0
+            lines = []
+            for document in documents:
+                line = json.dumps(document) + "\n"
+                if size + len(line) > self.max_spill_bytes:
+                    break
+                size += len(line)
+                lines.append(line)
+            if len(lines) < len(documents):
+                logger.warning(f"{self.spill_file} is full. Dropping {len(documents) - len(lines)} {self.destination} documents")
+            if lines:
+                self.spill_file.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.spill_file, "a") as f:
+                    f.writelines(lines)
+
+    def _insert(self, documents: list[dict]) -> bool:
+        """
+        Insert documents with one request
+        """
+        try:
+            response = send_payload({"documents": documents}, self.destination, "insertMany")
+            return response.ok
+        except Exception as e:
+            logger.warning(f"Failed to send {len(documents)} documents to {self.destination}: {e}")
+            return False
+
+    def send(self, documents: list[dict]) -> bool:
+        """
+        Insert documents with one request. Failed batches are spilled to disk
+        """
+        if not is_configured(self.destination):
+            return False
+        if self._insert(documents):
+            return True
+        self.spill(documents)
+        return False
+
+    def send_spilled(self) -> None:
+        """
+        Send the documents of the spill file
+
+        Documents that fail again are kept in the file. Lines that are not
+        valid JSON, e.g. the end of a file cut off by a crash, are dropped.
+        """
+        if not is_configured(self.destination):
+            return
+        with self.spill_lock:
+            if not self.spill_file.exists():
+                return
+            data = self.spill_file.read_bytes()
+
+        documents = []
+        corrupt = 0
+        for line in data.decode(errors="replace").splitlines():
+            if not line.strip():
+                continue
+            try:
+                documents.append(json.loads(line))
+            except json.JSONDecodeError:
+                corrupt += 1
+        if corrupt:
+            logger.warning(f"Dropping {corrupt} corrupt lines of {self.spill_file}")
+        if documents:
+            logger.info(f"Sending {len(documents)} spilled documents to {self.destination}")
+
+        failed = []
+        for i in range(0, len(documents), self.batch_size):
+            batch = documents[i:i + self.batch_size]
+            if not self._insert(batch):
+                failed.extend(batch)
+
+        with self.spill_lock:
+            # Keep the documents spilled while sending
+            with open(self.spill_file, "rb") as f:
+                f.seek(len(data))
+                spilled = f.read()
+            if failed or spilled:
+                with open(self.spill_file, "wb") as f:
+                    f.writelines((json.dumps(document) + "\n").encode() for document in failed)
+                    f.write(spilled)
+            else:
+                self.spill_file.unlink()
+
+    def _next_batch(self) -> list[dict]:
+        """
+        Wait for the next batch of documents. Returns an empty list if nothing arrived
+        """
+        try:
+            # Wake up regularly to notice when the queue is closed
+            batch = [self.queue.get(timeout=min(self.flush_interval, 0.5))]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0 or self.stopped.is_set():
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        try:
+            self.send_spilled()
+        except Exception as e:
+            logger.warning(f"Failed to send spilled documents: {e}")
+
+        while not (self.stopped.is_set() and self.queue.empty()):
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                self.send(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def flush(self) -> None:
+        """
+        Block until all buffered documents have been sent or spilled
+        """
+        if self.thread is not None:
+            self.queue.join()
+
+    def close(self, timeout: float = 30.0) -> None:
+        """
+        Flush the buffer and stop the background thread
+        """
+        if self.thread is None:
+            return
+        self.stopped.set()
+        self.thread.join(timeout=timeout)
+        # Anything left could not be sent in time
+        remaining = []
+        while not self.queue.empty():
+            remaining.append(self.queue.get_nowait())
+        if remaining:
+            self.spill(remaining)
+
+
+prompt_log_queue = DocumentQueue("PromptLog")
+atexit.register(prompt_log_queue.close)
+
+
 def add_log(
         session_id: str,
         src_ip: str,
@@ -89,6 +325,8 @@ def add_prompt(
 ) -> bool:
     """
     Add a prompt to the database
+
+    With wait=False the prompt is buffered and inserted in a batch in the background
     """
     document = {
         "document":  { 
@@ -99,15 +337,9 @@ def add_prompt(
             "outputContent": output,
         }
     }
-    kwargs = {
-        "payload": document,
-        "destination": "PromptLog",
-        "endpoint": "insertOne",
-    }
     if not wait:
-        Thread(target=send_payload, kwargs=kwargs).start()
-        return True
-    response = send_payload(**kwargs)
+        return prompt_log_queue.put(document["document"])
+    response = send_payload(document, "PromptLog", "insertOne")
     return response.ok
 
 
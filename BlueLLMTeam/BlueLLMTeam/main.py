@@ -6,13 +6,55 @@ from argparse import ArgumentParser
 from dataclasses import dataclass
 
 from BlueLLMTeam.agents import TeamLeaderRole, CowrieDesignerRole
-from BlueLLMTeam.LLMEndpoint import ChatGPTEndpoint
+from BlueLLMTeam.agents.designers.cowrie import HONEYPOT_FS
+from BlueLLMTeam.LLMEndpoint import (
+    LLMEndpointBase,
+    LLMEndpointWrapper,
+    ChatGPTEndpoint,
+    Llama2Endpoint,
+    RouterEndpoint,
+    HedgedEndpoint,
+    ModelPolicyEndpoint,
+    AdaptiveTokensEndpoint,
+    SemanticCacheEndpoint,
+    CachedEndpoint,
+    SingleFlightEndpoint,
+    AccountingEndpoint,
+    RecordingEndpoint,
+    ReplayEndpoint,
+    RefreshEndpoint,
+    AsyncLLMEndpointBase,
+    AsyncChatGPTEndpoint,
+    AsyncModelPolicyEndpoint,
+    AsyncAdaptiveTokensEndpoint,
+    AsyncSemanticCacheEndpoint,
+    AsyncCachedEndpoint,
+    AsyncSingleFlightEndpoint,
+    AsyncAccountingEndpoint,
+    AsyncRecordingEndpoint,
+    AsyncReplayEndpoint,
+    AsyncRefreshEndpoint,
+    CassetteMissError,
+    OLLAMA_MODEL,
+)
+from BlueLLMTeam.LLMBatch import BatchBackendBase, OpenAIBatchBackend, LocalBatchBackend
 from BlueLLMTeam.banner import TEAM_BANNER, LLM_DESIGNER, LLM_TEAM_LEAD
 from BlueLLMTeam.monitor import monitor_logs
 from BlueLLMTeam.utils.docker import verify_docker_installation
+from BlueLLMTeam.utils.usage import UsageTracker
+from BlueLLMTeam.utils.model_policy import ModelPolicy, MODEL_POLICY_FILE
+from BlueLLMTeam.utils.token_budget import TokenBudget, TOKEN_HISTORY_FILE
+from BlueLLMTeam.utils.fs_budget import FS_CONTENT_WORKERS, FS_CONTENT_DEADLINE
+from BlueLLMTeam.utils.similarity import SEMANTIC_CACHE_THRESHOLD
 
 
 designers: list[CowrieDesignerRole] = []
+usage_tracker = UsageTracker()
+usage_report_file: str | None = None
+llm_router: RouterEndpoint | None = None
+token_budget = TokenBudget()
+semantic_cache: SemanticCacheEndpoint | None = None
+async_semantic_cache: AsyncSemanticCacheEndpoint | None = None
 
 
 @dataclass
@@ -25,6 +67,27 @@ class Arguments:
     max_honeypots: int
     logfile: str
     analyst_on: bool
+    cache: bool
+    refresh_cache: bool
+    async_llm: bool
+    batch: str
+    record: str
+    replay: str
+    replay_latency: float
+    replay_fallback: bool
+    usage_report: str
+    ollama_host: str
+    ollama_model: str
+    hedge: float
+    hedge_budget: float
+    model_policy: str
+    adaptive_tokens: bool
+    token_history: str
+    semantic_cache: float
+    multi_file: bool
+    content_workers: int
+    content_deadline: float
+    pipeline: bool
 
     @classmethod
     def from_cli(cls):
@@ -40,8 +103,33 @@ class Arguments:
         parser.add_argument("--max-honeypots", "-m", type=int, default=-1, help="Do not deploy more honeypots than this")
         parser.add_argument("--logfile", "-L", type=str, default=None, help="Log file to write to")
         parser.add_argument("--no-analyst", "-A", action="store_true", help="Turn of the analyst")
+        parser.add_argument("--cache", action="store_true", help="Reuse LLM responses for identical prompts from the local disk cache")
+        parser.add_argument("--refresh-cache", action="store_true", help="Ignore cached LLM responses, but store the new ones")
+        parser.add_argument("--async-llm", action="store_true", help="Generate the file systems with asyncio instead of one thread per request")
+        parser.add_argument("--record", type=str, default=None, help="Record all LLM prompts and responses to this cassette file")
+        parser.add_argument("--replay", type=str, default=None, help="Answer LLM prompts from this cassette file instead of ChatGPT")
+        parser.add_argument("--replay-latency", type=float, default=0.0, help="Simulate the recorded latencies times this factor when replaying")
+        parser.add_argument("--replay-fallback", action="store_true", help="Ask ChatGPT for prompts that are not in the --replay cassette instead of stopping")
+        parser.add_argument("--usage-report", type=str, default="usage_report.json", help="Write the LLM token and latency usage per agent and prompt to this file")
+        parser.add_argument("--ollama-host", type=str, default=None, help="Route LLM requests between ChatGPT and the Ollama server at this host, e.g. http://localhost:11434")
+        parser.add_argument("--ollama-model", type=str, default=None, help="Ollama model to use when routing to Ollama. Defaults to OLLAMA_MODEL")
+        parser.add_argument("--hedge", type=float, default=None, metavar="PERCENTILE", help="Send a duplicate of LLM requests that take longer than this latency percentile, e.g. 95")
+        parser.add_argument("--hedge-budget", type=float, default=0.1, help="Largest share of LLM requests that may be duplicated by --hedge")
+        parser.add_argument("--model-policy", type=str, nargs="?", const=str(MODEL_POLICY_FILE), default=None, metavar="FILE", help=f"Pick models and max_tokens per prompt kind and agent from this JSON file, {MODEL_POLICY_FILE} if not given. Without it the prompts keep their models")
+        parser.add_argument("--adaptive-tokens", action="store_true", help="Size max_tokens from the lengths of earlier responses in this run")
+        parser.add_argument("--token-history", type=str, nargs="?", const=str(TOKEN_HISTORY_FILE), default=None, metavar="FILE", help=f"Like --adaptive-tokens, but keep the response lengths between runs in this file, {TOKEN_HISTORY_FILE} if not given")
+        parser.add_argument("--semantic-cache", type=float, nargs="?", const=SEMANTIC_CACHE_THRESHOLD, default=None, metavar="THRESHOLD", help=f"Reuse responses to prompts for similar commands and file paths. Similarity threshold between 0 and 1, {SEMANTIC_CACHE_THRESHOLD} if not given")
+        parser.add_argument("--multi-file", action="store_true", help="Generate small files in the same folder together, one request per group")
+        parser.add_argument("--content-workers", type=int, default=FS_CONTENT_WORKERS, help="Generate file contents with at most this many concurrent requests, most valuable files first")
+        parser.add_argument("--content-deadline", type=float, default=FS_CONTENT_DEADLINE, metavar="SECONDS", help="Leave files that have not been started after this many seconds empty")
+        parser.add_argument("--pipeline", action="store_true", help="Generate the contents of files while the rest of the file system is still being discovered")
+        parser.add_argument("--batch", choices=["openai", "local"], default=None, help="Generate file contents as an offline batch job. 'local' answers the batch in-process")
         
         args = parser.parse_args()
+        if args.async_llm and args.ollama_host is not None:
+            parser.error("--async-llm can not be combined with --ollama-host")
+        if args.async_llm and args.hedge is not None:
+            parser.error("--async-llm can not be combined with --hedge")
         return cls(
             context_file=args.context,
             verbosity=args.verbose,
@@ -50,7 +138,28 @@ class Arguments:
             light_weight=args.light_weight,
             max_honeypots=args.max_honeypots,
             logfile=args.logfile,
-            analyst_on=not args.no_analyst
+            analyst_on=not args.no_analyst,
+            cache=args.cache or args.refresh_cache,
+            refresh_cache=args.refresh_cache,
+            async_llm=args.async_llm,
+            batch=args.batch,
+            record=args.record,
+            replay=args.replay,
+            replay_latency=args.replay_latency,
+            replay_fallback=args.replay_fallback,
+            usage_report=args.usage_report,
+            ollama_host=args.ollama_host,
+            ollama_model=args.ollama_model,
+            hedge=args.hedge,
+            hedge_budget=args.hedge_budget,
+            adaptive_tokens=args.adaptive_tokens or args.token_history is not None,
+            token_history=args.token_history,
+            semantic_cache=args.semantic_cache,
+            multi_file=args.multi_file,
+            content_workers=args.content_workers,
+            content_deadline=args.content_deadline,
+            pipeline=args.pipeline,
+            model_policy=args.model_policy,
         )
     
     @property
@@ -63,6 +172,21 @@ def quit():
     for designer in designers:
         designer.stop()
 
+    # Keep the response lengths for the next run
+    token_budget.save()
+
+    # Report where time and tokens were spent
+    if usage_report_file is not None:
+        sections = {}
+        if llm_router is not None:
+            sections["backends"] = llm_router.report()
+        if semantic_cache is not None:
+            sections["semantic_cache"] = semantic_cache.stats()
+        if async_semantic_cache is not None:
+            sections["async_semantic_cache"] = async_semantic_cache.stats()
+        usage_tracker.write_report(usage_report_file, **sections)
+        print(f"LLM usage report written to {usage_report_file}")
+
 
 def happy_with_llm_decision(prompt: str, yes: bool = False) -> bool:
     if yes:
@@ -99,6 +223,102 @@ def config_logging(logfile: str, verbosity: int):
     
     logging.basicConfig(level=min(log_level, logging.INFO), handlers=handlers)
 
+def build_llm_endpoint(args: Arguments) -> LLMEndpointBase:
+    """
+    Create the LLM endpoint shared by all agents
+    """
+    global llm_router, semantic_cache
+    if args.replay is not None:
+        fallback = ChatGPTEndpoint() if args.replay_fallback else None
+        llm_endpoint = ReplayEndpoint(args.replay, latency_scale=args.replay_latency, fallback=fallback)
+    elif args.ollama_host is not None:
+        # Use the fastest healthy backend and spill over to Ollama when ChatGPT is out of quota
+        llm_router = RouterEndpoint({
+            "chatgpt": ChatGPTEndpoint(),
+            "ollama": Llama2Endpoint(args.ollama_host, model=args.ollama_model or OLLAMA_MODEL),
+        })
+        llm_endpoint = llm_router
+    else:
+        llm_endpoint = ChatGPTEndpoint()
+    if args.adaptive_tokens and args.replay is None:
+        # Inside the recording, cache and single flight, so they are keyed by the
+        # max_tokens of the prompt and a replay finds the responses of any history
+        llm_endpoint = AdaptiveTokensEndpoint(llm_endpoint, token_budget)
+    if args.record is not None:
+        llm_endpoint = RecordingEndpoint(llm_endpoint, args.record)
+    llm_endpoint = AccountingEndpoint(llm_endpoint, usage_tracker)
+    if args.hedge is not None:
+        # Duplicates are accounted for, and may be routed to another backend
+        llm_endpoint = HedgedEndpoint(llm_endpoint, percentile=args.hedge, budget=args.hedge_budget)
+    # Identical prompts from concurrent designers are only sent once
+    llm_endpoint = SingleFlightEndpoint(llm_endpoint)
+    if args.cache:
+        llm_endpoint = CachedEndpoint(llm_endpoint, refresh=args.refresh_cache)
+    if args.semantic_cache is not None:
+        semantic_cache = SemanticCacheEndpoint(llm_endpoint, threshold=args.semantic_cache)
+        llm_endpoint = semantic_cache
+    if args.model_policy is not None:
+        llm_endpoint = ModelPolicyEndpoint(llm_endpoint, ModelPolicy.from_file(args.model_policy))
+    return llm_endpoint
+
+
+def build_async_llm_endpoint(args: Arguments, llm_endpoint: LLMEndpointBase) -> AsyncLLMEndpointBase:
+    """
+    Create the asyncio LLM endpoint with the same layers as the blocking llm_endpoint
+
+    The cassette, caches, token budget and usage tracker are shared with llm_endpoint,
+    so both are recorded, replayed, cached and accounted for together
+    """
+    global async_semantic_cache
+    layers: list[LLMEndpointBase] = []
+    while isinstance(llm_endpoint, LLMEndpointWrapper):
+        layers.append(llm_endpoint)
+        llm_endpoint = llm_endpoint.llm
+
+    def layer(kind: type[LLMEndpointWrapper]) -> LLMEndpointWrapper | None:
+        return next((layer for layer in layers if isinstance(layer, kind)), None)
+
+    if isinstance(llm_endpoint, ReplayEndpoint):
+        fallback = None if llm_endpoint.fallback is None else AsyncChatGPTEndpoint()
+        async_llm_endpoint = AsyncReplayEndpoint(llm_endpoint.cassette, latency_scale=args.replay_latency, fallback=fallback)
+    else:
+        async_llm_endpoint = AsyncChatGPTEndpoint()
+    if (adaptive := layer(AdaptiveTokensEndpoint)) is not None:
+        async_llm_endpoint = AsyncAdaptiveTokensEndpoint(async_llm_endpoint, adaptive.budget)
+    if (recording := layer(RecordingEndpoint)) is not None:
+        async_llm_endpoint = AsyncRecordingEndpoint(async_llm_endpoint, recording.cassette)
+    async_llm_endpoint = AsyncAccountingEndpoint(async_llm_endpoint, usage_tracker)
+    async_llm_endpoint = AsyncSingleFlightEndpoint(async_llm_endpoint)
+    if (cached := layer(CachedEndpoint)) is not None:
+        async_llm_endpoint = AsyncCachedEndpoint(async_llm_endpoint, cached.cache, refresh=cached.refresh)
+    if (semantic := layer(SemanticCacheEndpoint)) is not None:
+        async_semantic_cache = AsyncSemanticCacheEndpoint(async_llm_endpoint, threshold=semantic.threshold, index=semantic.index)
+        async_llm_endpoint = async_semantic_cache
+    if (policy := layer(ModelPolicyEndpoint)) is not None:
+        async_llm_endpoint = AsyncModelPolicyEndpoint(async_llm_endpoint, policy.policy)
+    return async_llm_endpoint
+
+
+def build_batch_backend(args: Arguments, llm_endpoint: LLMEndpointBase) -> BatchBackendBase | None:
+    """
+    Create the batch backend for file contents, if requested
+    """
+    policy = None
+    if isinstance(llm_endpoint, ModelPolicyEndpoint):
+        # Apply the policy to the job file, where the kinds of the prompts are still known
+        policy = llm_endpoint.policy
+        llm_endpoint = llm_endpoint.llm
+
+    if args.batch == "openai":
+        backend = OpenAIBatchBackend()
+    elif args.batch == "local":
+        backend = LocalBatchBackend(HONEYPOT_FS / "batches", llm_endpoint)
+    else:
+        return None
+    backend.model_policy = policy
+    return backend
+
+
 def main():
     # Greeting
     print(TEAM_BANNER)
@@ -110,6 +330,11 @@ def main():
     # Configure logging
     config_logging(args.logfile, args.verbosity)
 
+    global usage_report_file, token_budget
+    usage_report_file = args.usage_report
+    if args.token_history is not None:
+        token_budget = TokenBudget(args.token_history)
+
     # Verify docker
     if not verify_docker_installation():
         print("Failed to verify the docker installation...")
@@ -135,14 +360,21 @@ def main():
         print(context)
     
     # Create LLM endpoint and team leader
-    llm_endpoint = ChatGPTEndpoint()
+    llm_endpoint = build_llm_endpoint(args)
+    async_llm_endpoint = None
+    if args.async_llm:
+        async_llm_endpoint = build_async_llm_endpoint(args, llm_endpoint)
+    batch_backend = build_batch_backend(args, llm_endpoint)
     team_lead = TeamLeaderRole(llm_endpoint)
 
     # Decide on honeypots
     print(LLM_TEAM_LEAD)
+    refresh = False
     while True:
         print("\nThinking about what honeypots to deploy...")
-        honeypot_count = team_lead.honeypot_amount(context)
+        honeypot_count = team_lead.honeypot_amount(context, refresh=refresh)
+        # Ask for a new answer, not the cached one, if this one is not used
+        refresh = True
 
         if len(honeypot_count) == 0:
             print("Failed to generate a valid honeypot count. Trying again...")
@@ -160,8 +392,10 @@ def main():
             honeypot_count[honey_type] = args.max_honeypots
     
     # Create honeypot descriptions
+    refresh = False
     while True:
-        honeypot_descriptions = team_lead.honeypot_design(context, honeypot_count)
+        honeypot_descriptions = team_lead.honeypot_design(context, honeypot_count, refresh=refresh)
+        refresh = True
 
         print("Team Lead wants to deploy the following honeypots: ")
         for honeypot_description in honeypot_descriptions:
@@ -176,26 +410,37 @@ def main():
 
     # Design the contents of all honeypots
     print(LLM_DESIGNER)
+    designer_llm_endpoint, designer_async_llm_endpoint = llm_endpoint, async_llm_endpoint
     while True:
         print("Creating custom contents for all requested honeypots...")
         for honeypot_description in tqdm_wrapper(honeypot_descriptions):
             designer = CowrieDesignerRole(
-                llm_endpoint,
+                designer_llm_endpoint,
                 honeypot_description["description"],
                 light_weight=args.light_weight,
+                async_llm_endpoint=designer_async_llm_endpoint,
+                batch_backend=batch_backend,
+                multi_file=args.multi_file,
+                content_workers=args.content_workers,
+                content_deadline=args.content_deadline,
+                pipeline=args.pipeline,
             )
             designers.append(designer)
             designer.create_honeypot()
         
         if happy_with_llm_decision("Deploy honeypots according to the descriptions", args.yes):
             break
+        # Generate the contents again instead of reusing the cached responses
+        designer_llm_endpoint = RefreshEndpoint(llm_endpoint)
+        if async_llm_endpoint is not None:
+            designer_async_llm_endpoint = AsyncRefreshEndpoint(async_llm_endpoint)
     
     print("Deploying honeypots...")
     for designer in tqdm_wrapper(designers):
         designer.deploy_honeypot()
     
     # Monitor attacker
-    monitor_logs(args.frequency, args.verbosity, args.analyst_on)
+    monitor_logs(args.frequency, args.verbosity, args.analyst_on, llm_endpoint)
 
     print("Stopping execution")
 
@@ -203,6 +448,8 @@ def main():
 if __name__ == "__main__":
     try:
         main()
+    except CassetteMissError as e:
+        print(f"Stopped the replay: {e}. Record the run again, or use --replay-fallback to ask ChatGPT for missing prompts")
     finally:
         print("Cleanup of containers and temporary files...")
         quit()
@@ -0,0 +1,258 @@
+"""
+Local mock of the OpenAI chat completions and Ollama chat APIs
+
+The server answers with generated text after a configurable latency, injects
+rate limit errors and timeouts, and streams tokens at a set rate. Point the
+endpoints at it to measure the generators and the rate limiter under
+realistic API conditions without a network:
+
+    python -m BlueLLMTeam.mock_server --port 8000 --latency-mean 2 --rate-limit-probability 0.05
+    GPT_BASE_URL=http://localhost:8000/v1 OLLAMA_HOST=http://localhost:8000 blueLLMTeam ...
+"""
+
+import json
+import time
+import random
+import asyncio
+import logging
+from argparse import ArgumentParser
+from collections import Counter, deque
+from dataclasses import dataclass, asdict, fields
+
+from aiohttp import web
+
+
+logger = logging.getLogger(__name__)
+
+WORDS = (
+    "the server backup report finance quarterly employee account password config "
+    "system network user admin project customer invoice database schedule meeting "
+    "review update access policy security audit budget contract vendor"
+).split()
+
+
+@dataclass
+class MockProfile:
+    """
+    Behavior of the mock server
+
+    Attributes:
+        latency: latency distribution before the first token. One of 'fixed', 'uniform' or 'lognormal'
+        latency_mean: mean latency in seconds
+        latency_spread: spread of the latency. Half width for 'uniform', sigma for 'lognormal'
+        rate_limit_probability: probability that a request is answered with 429
+        timeout_probability: probability that a request hangs for 'timeout' seconds and then fails
+        timeout: seconds a timed out request hangs
+        tokens_per_second: generation speed, also used for streaming
+        completion_tokens: number of tokens in each response, capped by max_tokens
+        requests_per_minute: answer with 429 when more requests arrive per minute. 0 for no limit
+    """
+    latency: str = "lognormal"
+    latency_mean: float = 1.0
+    latency_spread: float = 0.5
+    rate_limit_probability: float = 0.0
+    timeout_probability: float = 0.0
+    timeout: float = 60.0
+    tokens_per_second: float = 50.0
+    completion_tokens: int = 200
+    requests_per_minute: int = 0
+
+    def sample_latency(self, rng: random.Random) -> float:
+        if self.latency == "fixed":
+            return self.latency_mean
+        if self.latency == "uniform":
+            return max(0.0, rng.uniform(self.latency_mean - self.latency_spread, self.latency_mean + self.latency_spread))
+        if self.latency == "lognormal":
+            # Choose mu so that the mean of the distribution is latency_mean
+            mu = -self.latency_spread ** 2 / 2
+            return self.latency_mean * rng.lognormvariate(mu, self.latency_spread)
+        raise ValueError(f"Unknown latency distribution {self.latency}")
+
+
+class MockLLMServer:
+    """
+    aiohttp application that imitates the OpenAI and Ollama chat APIs
+    """
+
+    def __init__(self, profile: MockProfile = None, seed: int = None) -> None:
+        self.profile = profile or MockProfile()
+        self.rng = random.Random(seed)
+        self.request_times: deque[float] = deque()
+        self.stats = Counter()
+
+        self.app = web.Application()
+        self.app.add_routes([
+            web.post("/v1/chat/completions", self.openai_chat),
+            web.post("/chat/completions", self.openai_chat),
+            web.post("/api/chat", self.ollama_chat),
+            web.get("/stats", self.get_stats),
+        ])
+
+    def completion(self, messages: list[dict], max_tokens: int = None, json_format: bool = False) -> list[str]:
+        """
+        Create the tokens of a response
+        """
+        count = self.profile.completion_tokens
+        if max_tokens is not None:
+            count = min(count, max_tokens)
+        if json_format:
+            return ['{"mock": ', '"response"}']
+        return [self.rng.choice(WORDS) + " " for _ in range(count)]
+
+    def rate_limit_headers(self) -> dict[str, str]:
+        limit = self.profile.requests_per_minute
+        if limit <= 0:
+            return {}
+        remaining = max(0, limit - len(self.request_times))
+        reset = 0.0 if not self.request_times else max(0.0, self.request_times[0] + 60 - time.monotonic())
+        return {
+            "x-ratelimit-limit-requests": str(limit),
+            "x-ratelimit-remaining-requests": str(remaining),
+            "x-ratelimit-reset-requests": f"{reset:.3f}s",
+        }
+
+    async def admit(self) -> web.Response | None:
+        """
+        Decide the fate of a request. Returns an error response, or None to answer it
+        """
+        self.stats["requests"] += 1
+        now = time.monotonic()
+        while self.request_times and now - self.request_times[0] > 60:
+            self.request_times.popleft()
+
+        limit = self.profile.requests_per_minute
+        over_limit = limit > 0 and len(self.request_times) >= limit
+        if over_limit or self.rng.random() < self.profile.rate_limit_probability:
+            self.stats["rate_limited"] += 1
+            retry_after = self.request_times[0] + 60 - now if over_limit else self.rng.uniform(0.5, 2.0)
+            headers = {"retry-after": f"{retry_after:.3f}", **self.rate_limit_headers()}
+            body = {"error": {"message": "Rate limit reached (mock)", "type": "requests", "code": "rate_limit_exceeded"}}
+            return web.json_response(body, status=429, headers=headers)
+        self.request_times.append(now)
+
+        if self.rng.random() < self.profile.timeout_probability:
+            self.stats["timed_out"] += 1
+            await asyncio.sleep(self.profile.timeout)
+            return web.json_response({"error": {"message": "Request timed out (mock)", "type": "timeout"}}, status=504)
+
+        await asyncio.sleep(self.profile.sample_latency(self.rng))
+        return None
+
+    async def openai_chat(self, request: web.Request) -> web.StreamResponse:
+        error = await self.admit()
+        if error is not None:
+            return error
+
+        body = await request.json()
+        json_format = body.get("response_format", {}).get("type") == "json_object"
+        tokens = self.completion(body.get("messages", []), body.get("max_tokens"), json_format)
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 4
+        finish_reason = "length" if body.get("max_tokens") is not None and len(tokens) >= body["max_tokens"] else "stop"
+        completion_id = f"chatcmpl-mock{self.stats['requests']}"
+        model = body.get("model", "mock")
+        self.stats["completion_tokens"] += len(tokens)
+
+        if not body.get("stream", False):
+            await asyncio.sleep(len(tokens) / self.profile.tokens_per_second)
+            self.stats["completed"] += 1
+            return web.json_response({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": finish_reason,
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(tokens),
+                    "total_tokens": prompt_tokens + len(tokens),
+                },
+            }, headers=self.rate_limit_headers())
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", **self.rate_limit_headers()})
+        await response.prepare(request)
+        for i, token in enumerate(tokens):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": token},
+                    "finish_reason": finish_reason if i == len(tokens) - 1 else None,
+                }],
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            await asyncio.sleep(1 / self.profile.tokens_per_second)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        self.stats["completed"] += 1
+        return response
+
+    async def ollama_chat(self, request: web.Request) -> web.StreamResponse:
+        error = await self.admit()
+        if error is not None:
+            return error
+
+        body = await request.json()
+        json_format = body.get("format") == "json"
+        tokens = self.completion(body.get("messages", []), body.get("options", {}).get("num_predict"), json_format)
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 4
+        model = body.get("model", "mock")
+        self.stats["completion_tokens"] += len(tokens)
+        final = {
+            "model": model,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "done": True,
+            "done_reason": "stop",
+            "prompt_eval_count": prompt_tokens,
+            "eval_count": len(tokens),
+        }
+
+        # Ollama streams by default
+        if not body.get("stream", True):
+            await asyncio.sleep(len(tokens) / self.profile.tokens_per_second)
+            self.stats["completed"] += 1
+            return web.json_response({**final, "message": {"role": "assistant", "content": "".join(tokens)}})
+
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        for token in tokens:
+            chunk = {
+                "model": model,
+                "created_at": final["created_at"],
+                "message": {"role": "assistant", "content": token},
+                "done": False,
+            }
+            await response.write((json.dumps(chunk) + "\n").encode())
+            await asyncio.sleep(1 / self.profile.tokens_per_second)
+        await response.write((json.dumps({**final, "message": {"role": "assistant", "content": ""}}) + "\n").encode())
+        await response.write_eof()
+        self.stats["completed"] += 1
+        return response
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"profile": asdict(self.profile), **self.stats})
+
+
+def main():
+    parser = ArgumentParser("mock_server", description="Mock OpenAI and Ollama chat server")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for the random generator")
+    for field in fields(MockProfile):
+        parser.add_argument(f"--{field.name.replace('_', '-')}", type=type(field.default), default=field.default)
+    args = vars(parser.parse_args())
+
+    logging.basicConfig(level=logging.INFO)
+    profile = MockProfile(**{field.name: args[field.name] for field in fields(MockProfile)})
+    server = MockLLMServer(profile, seed=args["seed"])
+    web.run_app(server.app, host=args["host"], port=args["port"])
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,7 @@ import logging
 import pandas as pd
 
 from BlueLLMTeam.agents import CowrieAnalystRole
-from BlueLLMTeam.LLMEndpoint import ChatGPTEndpoint
+from BlueLLMTeam.LLMEndpoint import LLMEndpointBase, ChatGPTEndpoint
 from BlueLLMTeam.banner import LLM_ANALYST
 from BlueLLMTeam.database.db_interaction import get_updated_sessions
 
@@ -32,13 +32,14 @@ def analyze_session(df: pd.DataFrame, analyst: CowrieAnalystRole, analyst_on: bo
     print("##########################")
 
 
-def monitor_logs(frequency: float, verbosity: int = 0, analyst_on: bool = True):
+def monitor_logs(frequency: float, verbosity: int = 0, analyst_on: bool = True, llm_endpoint: LLMEndpointBase = None):
     """
     Monitor all sessions logs and analyze them with an LLM
     Present the user with a description of the current threats and activities of the attacker
     """
     print(LLM_ANALYST)
-    llm_endpoint = ChatGPTEndpoint()
+    if llm_endpoint is None:
+        llm_endpoint = ChatGPTEndpoint()
     analyst = CowrieAnalystRole(llm_endpoint)
     print("Ready to analyse attackers. Waiting for connections...")
 
@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from pathlib import Path
+
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_DIR = Path(os.getenv("LLM_CACHE_DIR", Path.home() / ".cache" / "BlueLLMTeam" / "responses"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+LLM_CACHE_MAX_AGE = float(os.getenv("LLM_CACHE_MAX_AGE", 30 * 24 * 60 * 60))
+
+# Fields of a prompt dictionary that decide the response of the LLM
+CACHE_KEY_FIELDS = (
+    "systemRole",
+    "user",
+    "context",
+    "message",
+    "model",
+    "max_tokens",
+    "json_format",
+)
+
+
+def prompt_key(prompt_dict: dict) -> str:
+    """
+    Create a canonical hash for a prompt dictionary
+
+    Only the fields that affect the response are part of the key,
+    so metadata added to the prompt does not change the hash.
+    """
+    canonical = {field: prompt_dict.get(field) for field in CACHE_KEY_FIELDS}
+    data = json.dumps(canonical, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Content-addressed cache of LLM responses stored on the local disk
+
+    Each response is stored in its own JSON file named after the prompt key.
+    Entries older than max_age seconds are dropped, and the least recently
+    used entries are removed when the cache grows beyond max_bytes.
+    """
+
+    def __init__(
+            self,
+            directory: Path = LLM_CACHE_DIR,
+            max_bytes: int = LLM_CACHE_MAX_BYTES,
+            max_age: float = LLM_CACHE_MAX_AGE,
+        ) -> None:
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = threading.Lock()
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.size = sum(p.stat().st_size for p in self._entries())
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def _entries(self) -> list[Path]:
+        return list(self.directory.glob("*/*.json"))
+
+    def get(self, key: str) -> str | None:
+        """
+        Get a cached response. Returns None if the key is missing or expired
+        """
+        path = self._path(key)
+        try:
+            entry = json.loads(path.read_text())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Dropping unreadable cache entry {path.name}: {e}")
+            self.delete(key)
+            return None
+
+        if time.time() - entry.get("created", 0) > self.max_age:
+            self.delete(key)
+            return None
+
+        # Mark the entry as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry["response"]
+
+    def set(self, key: str, response: str) -> None:
+        """
+        Store a response in the cache
+        """
+        path = self._path(key)
+        data = json.dumps({"created": time.time(), "response": response})
+        with self.lock:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            old_size = path.stat().st_size if path.exists() else 0
+            # Write to a temporary file first so readers never see half an entry
+            tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+            tmp_path.write_text(data)
+            os.replace(tmp_path, path)
+            self.size += path.stat().st_size - old_size
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def delete(self, key: str) -> None:
+        """
+        Remove a response from the cache
+        """
+        path = self._path(key)
+        with self.lock:
+            try:
+                size = path.stat().st_size
+                path.unlink()
+                self.size -= size
+            except FileNotFoundError:
+                pass
+
+    def evict(self) -> None:
+        """
+        Remove expired entries and shrink the cache below its size limit
+        """
+        with self.lock:
+            self._evict()
+
+    def _evict(self) -> None:
+        now = time.time()
+        entries = []
+        for path in self._entries():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        # Least recently used first
+        entries.sort()
+        size = sum(entry[1] for entry in entries)
+        for mtime, entry_size, path in entries:
+            if size <= self.max_bytes and now - mtime <= self.max_age:
+                continue
+            try:
+                path.unlink()
+                size -= entry_size
+            except FileNotFoundError:
+                pass
+        self.size = size
+
+    def clear(self) -> None:
+        """
+        Remove all entries from the cache
+        """
+        with self.lock:
+            for path in self._entries():
+                path.unlink(missing_ok=True)
+            self.size = 0
@@ -0,0 +1,90 @@
+import json
+import logging
+import threading
+from pathlib import Path
+from collections import defaultdict
+
+from BlueLLMTeam.utils.cache import CACHE_KEY_FIELDS, prompt_key
+
+
+logger = logging.getLogger(__name__)
+
+
+class CassetteMissError(LookupError):
+    """
+    Raised when a replayed prompt was never recorded
+    """
+
+
+class Cassette:
+    """
+    A JSONL file of recorded prompts and responses
+
+    Every line holds one interaction with the prompt key, the prompt, the
+    response, the latency in seconds and the token counts. A prompt that was
+    recorded several times is played back in the recorded order, and starts
+    over from the first recording when all of them have been used.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.interactions: dict[str, list[dict]] = defaultdict(list)
+        self.positions: dict[str, int] = defaultdict(int)
+        if self.path.exists():
+            self.load()
+
+    def load(self) -> None:
+        with self.lock:
+            self.interactions.clear()
+            self.positions.clear()
+            for i, line in enumerate(self.path.read_text().splitlines()):
+                if not line.strip():
+                    continue
+                try:
+                    interaction = json.loads(line)
+                    self.interactions[interaction["key"]].append(interaction)
+                except (ValueError, KeyError) as e:
+                    logger.warning(f"Skipping bad line {i + 1} in cassette {self.path}: {e}")
+
+    def __len__(self) -> int:
+        return sum(len(interactions) for interactions in self.interactions.values())
+
+    def record(
+            self,
+            prompt_dict: dict,
+            response: str,
+            latency: float,
+            prompt_tokens: int = None,
+            completion_tokens: int = None,
+        ) -> None:
+        """
+        Append an interaction to the cassette
+        """
+        interaction = {
+            "key": prompt_key(prompt_dict),
+            "kind": prompt_dict.get("kind"),
+            "prompt": {field: prompt_dict.get(field) for field in CACHE_KEY_FIELDS},
+            "response": response,
+            "latency": latency,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+        }
+        with self.lock:
+            self.interactions[interaction["key"]].append(interaction)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(interaction) + "\n")
+
+    def play(self, prompt_dict: dict) -> dict | None:
+        """
+        Get the next recorded interaction for a prompt. None if it was never recorded
+        """
+        key = prompt_key(prompt_dict)
+        with self.lock:
+            interactions = self.interactions.get(key)
+            if not interactions:
+                return None
+            position = self.positions[key]
+            self.positions[key] = position + 1
+            return interactions[position % len(interactions)]
@@ -0,0 +1,235 @@
+import os
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from BlueLLMTeam.utils.text import repair_json
+
+
+# Number of rows when the schema does not give one, and the largest number of rows of a file
+CSV_ROWS = int(os.getenv("CSV_ROWS", 200))
+CSV_MAX_ROWS = int(os.getenv("CSV_MAX_ROWS", 1000))
+
+CSV_COLUMN_TYPES = [
+    "id", "first_name", "last_name", "full_name", "email", "phone", "ssn", "city",
+    "date", "datetime", "integer", "float", "amount", "rating", "category", "text",
+]
+
+# Fallback values for columns that come without any
+FIRST_NAMES = [
+    "Ingrid", "Tomasz", "Amara", "Kenji", "Lucia", "Oluwaseun", "Matteo", "Siobhan", "Rashid", "Elif",
+    "Henrik", "Priya", "Joaquin", "Yuki", "Dagny", "Thabo", "Marguerite", "Anselm", "Leilani", "Bogdan",
+    "Farah", "Cormac", "Ines", "Wendell", "Soraya", "Augustin", "Nkechi", "Lorenzo", "Hana", "Ezekiel",
+]
+LAST_NAMES = [
+    "Solberg", "Kowalczyk", "Okafor", "Takahashi", "Ferreira", "Adeyemi", "Bianchi", "Gallagher", "Haddad", "Yilmaz",
+    "Lindqvist", "Raghunathan", "Echeverria", "Morimoto", "Halvorsen", "Mokoena", "Delacroix", "Brandt", "Kahananui", "Petrescu",
+    "Nasser", "Fitzgerald", "Carvalho", "Whitaker", "Mansouri", "Lefebvre", "Eze", "Rinaldi", "Novak", "Abernathy",
+]
+CITIES = [
+    "Lyon", "Osaka", "Porto Alegre", "Tampere", "Ghent", "Cluj-Napoca", "Hobart", "Kraków", "Mombasa", "Valparaíso",
+    "Bergen", "Izmir", "Chattanooga", "Bilbao", "Pune", "Halifax", "Graz", "Cebu City", "Aarhus", "Tucson",
+]
+
+
+@dataclass
+class CsvColumn:
+    """
+    A column of a csv file and how to generate its values
+
+    Attributes:
+        name: header of the column
+        type: one of CSV_COLUMN_TYPES
+        min: smallest value of numeric and date columns
+        max: largest value of numeric and date columns
+        values: values to choose from for category, city, text and name columns, or the domains of email columns
+        prefix: prefix of id columns
+    """
+    name: str
+    type: str = "text"
+    min: float | str = None
+    max: float | str = None
+    values: list = field(default_factory=list)
+    prefix: str = ""
+
+
+@dataclass
+class CsvSchema:
+    columns: list[CsvColumn]
+    examples: list[list] = field(default_factory=list)
+    rows: int = CSV_ROWS
+
+
+def parse_schema(response: str) -> CsvSchema:
+    """
+    Parse the JSON answer to a csv_schema prompt
+
+    Unknown column types are generated as text. Example rows that do not
+    match the columns are dropped. Raises ValueError if there are no columns.
+    """
+    data = repair_json(response)
+    if not isinstance(data, dict) or not isinstance(data.get("columns"), list):
+        raise ValueError("Expected a JSON object with a list of columns")
+
+    columns = []
+    for column in data["columns"]:
+        if not isinstance(column, dict) or not column.get("name"):
+            continue
+        column_type = str(column.get("type", "text")).lower()
+        values = column.get("values")
+        columns.append(CsvColumn(
+            name=str(column["name"]),
+            type=column_type if column_type in CSV_COLUMN_TYPES else "text",
+            min=column.get("min"),
+            max=column.get("max"),
+            values=[value for value in values if value not in (None, "")] if isinstance(values, list) else [],
+            prefix=str(column.get("prefix") or ""),
+        ))
+    if not columns:
+        raise ValueError("No columns in the csv schema")
+
+    examples = [
+        row for row in data.get("examples") or []
+        if isinstance(row, list) and len(row) == len(columns)
+    ]
+    try:
+        rows = int(data.get("rows") or CSV_ROWS)
+    except (TypeError, ValueError):
+        rows = CSV_ROWS
+    return CsvSchema(columns, examples, max(1, min(rows, CSV_MAX_ROWS)))
+
+
+def _number(value, default: float) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _date(value, default: str) -> np.datetime64:
+    try:
+        return np.datetime64(str(value)[:10], "D")
+    except ValueError:
+        return np.datetime64(default, "D")
+
+
+def _bounds(column: CsvColumn, low: float, high: float) -> tuple[float, float]:
+    low, high = _number(column.min, low), _number(column.max, high)
+    return (low, high) if low <= high else (high, low)
+
+
+def _choices(rng: np.random.Generator, values: list, size: int) -> np.ndarray:
+    return rng.choice(np.array(values, dtype=object), size=size)
+
+
+def _digits(rng: np.random.Generator, low: int, high: int, width: int, size: int) -> pd.Series:
+    return pd.Series(rng.integers(low, high + 1, size=size)).astype(str).str.zfill(width)
+
+
+def generate_people(schema: CsvSchema, size: int, rng: np.random.Generator) -> tuple[pd.Series, pd.Series]:
+    """
+    First and last names of the person on each row, shared by all name and email columns
+    """
+    first_names, last_names = list(FIRST_NAMES), list(LAST_NAMES)
+    for column in schema.columns:
+        if column.type == "first_name":
+            first_names += column.values
+        elif column.type == "last_name":
+            last_names += column.values
+    return pd.Series(_choices(rng, first_names, size)).astype(str), pd.Series(_choices(rng, last_names, size)).astype(str)
+
+
+def generate_column(
+        column: CsvColumn,
+        examples: list,
+        size: int,
+        rng: np.random.Generator,
+        people: tuple[pd.Series, pd.Series],
+    ) -> np.ndarray | pd.Series:
+    """
+    Generate 'size' values for a column at once
+
+    Values of the example rows are reused for columns without a list of values.
+    Names and emails are taken from people, see generate_people.
+    """
+    values = column.values or [value for value in examples if value not in (None, "")]
+    kind = column.type
+
+    if kind == "id":
+        start = int(rng.integers(100, 5000))
+        ids = pd.Series(np.arange(start, start + size)).astype(str).str.zfill(5)
+        return column.prefix + ids
+    first, last = people
+    if kind == "first_name":
+        return first
+    if kind == "last_name":
+        return last
+    if kind == "full_name":
+        return first + " " + last
+    if kind == "email":
+        domains = pd.Series(_choices(rng, column.values or ["example.com"], size)).astype(str).str.lstrip("@")
+        return (first.str[0] + "." + last.str.replace(" ", "")).str.lower() + "@" + domains
+    if kind == "phone":
+        return "(" + _digits(rng, 201, 989, 3, size) + ") " + _digits(rng, 200, 999, 3, size) + "-" + _digits(rng, 0, 9999, 4, size)
+    if kind == "ssn":
+        # Area numbers 000, 666 and 900-999 are never issued
+        area = rng.integers(1, 899, size=size)
+        area = np.where(area == 666, 667, area)
+        area = pd.Series(area).astype(str).str.zfill(3)
+        return area + "-" + _digits(rng, 1, 99, 2, size) + "-" + _digits(rng, 1, 9999, 4, size)
+    if kind == "city":
+        return _choices(rng, values or CITIES, size)
+    if kind in ("date", "datetime"):
+        start = _date(column.min, "2018-01-01")
+        end = max(start, _date(column.max, "2024-06-30"))
+        days = rng.integers(0, int((end - start).astype(int)) + 1, size=size)
+        dates = pd.Series(start + days.astype("timedelta64[D]"))
+        if kind == "date":
+            return dates.dt.strftime("%Y-%m-%d")
+        seconds = pd.to_timedelta(rng.integers(7 * 3600, 20 * 3600, size=size), unit="s")
+        return (dates + seconds).dt.strftime("%Y-%m-%d %H:%M:%S")
+    if kind == "integer":
+        low, high = _bounds(column, 1, 1000)
+        return rng.integers(int(low), int(high) + 1, size=size)
+    if kind == "float":
+        low, high = _bounds(column, 0, 100)
+        return np.round(rng.uniform(low, high, size=size), 2)
+    if kind == "amount":
+        # Skewed towards smaller amounts, never round numbers
+        low, high = _bounds(column, 10, 10000)
+        amounts = low + (high - low) * rng.beta(2, 5, size=size)
+        amounts += rng.integers(1, 100, size=size) / 100
+        return np.char.mod("%.2f", np.minimum(amounts, high))
+    if kind == "rating":
+        if column.values:
+            return _choices(rng, column.values, size)
+        low, high = _bounds(column, 1, 5)
+        return rng.integers(int(low), int(high) + 1, size=size)
+    # category and text
+    return _choices(rng, values or [column.name.lower()], size)
+
+
+def synthesize_rows(schema: CsvSchema, rows: int = None, seed: int = None) -> pd.DataFrame:
+    """
+    Generate the rows of a csv file from its schema, starting with the example rows
+    """
+    rows = schema.rows if rows is None else rows
+    rng = np.random.default_rng(seed)
+    examples = schema.examples[:rows]
+    size = rows - len(examples)
+
+    people = generate_people(schema, size, rng)
+    data = {}
+    for index, column in enumerate(schema.columns):
+        example_values = [row[index] for row in examples]
+        generated = generate_column(column, example_values, size, rng, people) if size > 0 else []
+        data[column.name] = list(example_values) + list(generated)
+    return pd.DataFrame(data)
+
+
+def synthesize_csv(schema: CsvSchema, rows: int = None, seed: int = None) -> str:
+    """
+    Generate the contents of a csv file from its schema
+    """
+    return synthesize_rows(schema, rows, seed).to_csv(index=False)
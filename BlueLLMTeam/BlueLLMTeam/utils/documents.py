@@ -0,0 +1,440 @@
+import io
+import os
+import re
+import zlib
+import asyncio
+import atexit
+import struct
+import logging
+import zipfile
+import textwrap
+import threading
+import posixpath
+import multiprocessing
+from xml.sax.saxutils import escape
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from BlueLLMTeam.utils.text import repair_json
+
+
+logger = logging.getLogger(__name__)
+
+# Processes that render documents. 0 renders in the calling thread
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", 2))
+
+# What the LLM is asked to write for each rendered file format
+DOCUMENT_HINTS = {
+    ".xlsx": "one to three tables with a header and 10 to 40 rows of realistic values each. Paragraphs are optional",
+    ".docx": "a title, an author and 4 to 10 paragraphs. Add a table if the document would have one",
+    ".pdf": "a title, an author and 4 to 10 paragraphs. Add a table if the document would have one",
+    ".png": "a title and a caption describing the image. Add a table with a name column and a number column if the image is a chart",
+    ".zip": "files, a map of 2 to 6 file names in the archive to their text contents",
+}
+RENDERED_EXTENSIONS = set(DOCUMENT_HINTS)
+
+
+def is_rendered_file(file: str) -> bool:
+    _, extension = posixpath.splitext(file)
+    return extension.lower() in RENDERED_EXTENSIONS
+
+
+def parse_document(response: str, file: str) -> dict:
+    """
+    Parse the semantic content of a document from the JSON answer of the LLM
+
+    The document has a title, author, paragraphs, tables of header and rows,
+    a caption and files. Missing or malformed parts are left empty. An answer
+    that is not JSON is used as the paragraphs of the document.
+    """
+    title = posixpath.splitext(posixpath.basename(file))[0].replace("_", " ").replace("-", " ").strip()
+    try:
+        data = repair_json(response)
+    except ValueError:
+        data = {"paragraphs": [paragraph for paragraph in response.split("\n\n") if paragraph.strip()]}
+    if not isinstance(data, dict):
+        data = {}
+
+    tables = []
+    for table in data.get("tables") or []:
+        if not isinstance(table, dict) or not isinstance(table.get("rows"), list):
+            continue
+        rows = [list(row) for row in table["rows"] if isinstance(row, list)]
+        header = table.get("header") if isinstance(table.get("header"), list) else []
+        tables.append({"name": str(table.get("name") or f"Sheet{len(tables) + 1}"), "header": header, "rows": rows})
+
+    files = data.get("files") if isinstance(data.get("files"), dict) else {}
+    return {
+        "title": str(data.get("title") or title),
+        "author": str(data.get("author") or ""),
+        "paragraphs": [str(paragraph) for paragraph in data.get("paragraphs") or [] if str(paragraph).strip()],
+        "tables": tables,
+        "caption": str(data.get("caption") or ""),
+        "files": {str(name): str(contents) for name, contents in files.items()},
+    }
+
+
+def _xml(text) -> str:
+    # Control characters are not allowed in XML
+    return escape(re.sub(r"[\x00-\x08\x0b\x0c\x0e-\x1f]", "", str(text)), {'"': "&quot;"})
+
+
+def _zip(entries: dict[str, str | bytes]) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in entries.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def _core_properties(document: dict) -> str:
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" '
+        'xmlns:dc="http://purl.org/dc/elements/1.1/">'
+        f'<dc:title>{_xml(document["title"])}</dc:title><dc:creator>{_xml(document["author"])}</dc:creator>'
+        '</cp:coreProperties>'
+    )
+
+
+def _package_rels(target: str) -> str:
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        f'<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="{target}"/>'
+        '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/package/2006/relationships/metadata/core-properties" Target="docProps/core.xml"/>'
+        '</Relationships>'
+    )
+
+
+def _is_number(value) -> bool:
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, (int, float)):
+        return True
+    # Keep leading zeros of ids and codes
+    return bool(re.fullmatch(r"-?(0|[1-9]\d*)(\.\d+)?", str(value).strip()))
+
+
+def _sheet_name(name: str, used: set[str]) -> str:
+    name = re.sub(r"[\[\]:*?/\\]", " ", name).strip()[:31] or "Sheet"
+    unique, number = name, 2
+    while unique in used:
+        unique = f"{name[:28]} {number}"
+        number += 1
+    used.add(unique)
+    return unique
+
+
+def _cell_ref(row: int, column: int) -> str:
+    letters = ""
+    column += 1
+    while column:
+        column, remainder = divmod(column - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return f"{letters}{row + 1}"
+
+
+def _sheet_xml(rows: list[list]) -> str:
+    xml_rows = []
+    for row_index, row in enumerate(rows):
+        cells = []
+        for column_index, value in enumerate(row):
+            ref = _cell_ref(row_index, column_index)
+            if _is_number(value):
+                cells.append(f'<c r="{ref}"><v>{str(value).strip()}</v></c>')
+            else:
+                cells.append(f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{_xml(value)}</t></is></c>')
+        xml_rows.append(f'<row r="{row_index + 1}">{"".join(cells)}</row>')
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        f'<sheetData>{"".join(xml_rows)}</sheetData></worksheet>'
+    )
+
+
+def render_xlsx(document: dict) -> bytes:
+    """
+    An Excel workbook with one sheet per table
+    """
+    sheets = [(table["name"], [table["header"]] + table["rows"] if table["header"] else table["rows"]) for table in document["tables"]]
+    if not sheets:
+        sheets = [("Sheet1", [[document["title"]]] + [[paragraph] for paragraph in document["paragraphs"]])]
+
+    used: set[str] = set()
+    names = [_sheet_name(name, used) for name, _ in sheets]
+    entries = {
+        "[Content_Types].xml": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            + "".join(
+                f'<Override PartName="/xl/worksheets/sheet{i + 1}.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+                for i in range(len(sheets))
+            )
+            + '<Override PartName="/docProps/core.xml" ContentType="application/vnd.openxmlformats-package.core-properties+xml"/>'
+            '</Types>'
+        ),
+        "_rels/.rels": _package_rels("xl/workbook.xml"),
+        "docProps/core.xml": _core_properties(document),
+        "xl/workbook.xml": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets>'
+            + "".join(f'<sheet name="{_xml(name)}" sheetId="{i + 1}" r:id="rId{i + 1}"/>' for i, name in enumerate(names))
+            + '</sheets></workbook>'
+        ),
+        "xl/_rels/workbook.xml.rels": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            + "".join(
+                f'<Relationship Id="rId{i + 1}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet{i + 1}.xml"/>'
+                for i in range(len(sheets))
+            )
+            + '</Relationships>'
+        ),
+    }
+    for i, (_, rows) in enumerate(sheets):
+        entries[f"xl/worksheets/sheet{i + 1}.xml"] = _sheet_xml(rows)
+    return _zip(entries)
+
+
+def _docx_paragraph(text: str, bold: bool = False) -> str:
+    properties = "<w:rPr><w:b/><w:sz w:val=\"32\"/></w:rPr>" if bold else ""
+    return f'<w:p><w:r>{properties}<w:t xml:space="preserve">{_xml(text)}</w:t></w:r></w:p>'
+
+
+def render_docx(document: dict) -> bytes:
+    """
+    A Word document with the title, paragraphs and tables
+    """
+    body = [_docx_paragraph(document["title"], bold=True)]
+    body += [_docx_paragraph(paragraph) for paragraph in document["paragraphs"]]
+    for table in document["tables"]:
+        rows = [table["header"]] + table["rows"] if table["header"] else table["rows"]
+        xml_rows = "".join(
+            "<w:tr>" + "".join(f"<w:tc>{_docx_paragraph(str(cell))}</w:tc>" for cell in row) + "</w:tr>"
+            for row in rows
+        )
+        borders = "".join(f'<w:{side} w:val="single" w:sz="4"/>' for side in ("top", "left", "bottom", "right", "insideH", "insideV"))
+        body.append(f"<w:tbl><w:tblPr><w:tblBorders>{borders}</w:tblBorders></w:tblPr>{xml_rows}</w:tbl>")
+        body.append(_docx_paragraph(""))
+
+    entries = {
+        "[Content_Types].xml": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+            '<Override PartName="/docProps/core.xml" ContentType="application/vnd.openxmlformats-package.core-properties+xml"/>'
+            '</Types>'
+        ),
+        "_rels/.rels": _package_rels("word/document.xml"),
+        "docProps/core.xml": _core_properties(document),
+        "word/document.xml": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+            f'<w:body>{"".join(body)}</w:body></w:document>'
+        ),
+    }
+    return _zip(entries)
+
+
+PDF_PUNCTUATION = str.maketrans({"–": "-", "—": "-", "‘": "'", "’": "'", "“": '"', "”": '"', "…": "...", "•": "*"})
+
+
+def _pdf_text(text: str) -> str:
+    # The standard fonts only cover Latin-1
+    text = text.translate(PDF_PUNCTUATION).encode("latin-1", "replace").decode("latin-1")
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def render_pdf(document: dict, line_width: int = 90, lines_per_page: int = 52) -> bytes:
+    """
+    A PDF with the title, paragraphs and tables as text in Helvetica
+    """
+    lines: list[tuple[str, bool]] = [(document["title"], True), ("", False)]
+    if document["author"]:
+        lines += [(document["author"], False), ("", False)]
+    for paragraph in document["paragraphs"]:
+        lines += [(line, False) for line in textwrap.wrap(paragraph, line_width) or [""]]
+        lines.append(("", False))
+    for table in document["tables"]:
+        rows = [table["header"]] + table["rows"] if table["header"] else table["rows"]
+        lines += [(line, False) for row in rows for line in textwrap.wrap(" | ".join(str(cell) for cell in row), line_width)]
+        lines.append(("", False))
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)]
+
+    # Objects 1 catalog, 2 pages, 3 and 4 fonts, then a page and a content stream per page
+    objects: list[bytes] = [b"", b"", b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>", b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold >>"]
+    page_ids = []
+    for page in pages:
+        commands = ["BT", "14 TL", "50 792 Td"]
+        for text, bold in page:
+            commands.append(f"/F{2 if bold else 1} {14 if bold else 10} Tf ({_pdf_text(text)}) '")
+        commands.append("ET")
+        stream = "\n".join(commands).encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (" ".join(f"{i} 0 R" for i in page_ids).encode(), len(page_ids))
+    title = _pdf_text(document["title"]).encode("latin-1")
+    author = _pdf_text(document["author"]).encode("latin-1")
+    objects.append(b"<< /Title (%s) /Author (%s) /Producer (Microsoft Word) >>" % (title, author))
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(output.tell())
+        output.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+    xref = output.tell()
+    output.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        output.write(b"%010d 00000 n \n" % offset)
+    output.write(b"trailer\n<< /Size %d /Root 1 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, len(objects), xref))
+    return output.getvalue()
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+
+def render_png(document: dict, width: int = 640, height: int = 400) -> bytes:
+    """
+    A PNG image: a bar chart of the first numeric table column, or an abstract picture
+
+    The colors are derived from the title, so the same document gives the same image.
+    """
+    seed = zlib.crc32(document["title"].encode())
+    base = ((seed >> 16) & 0xff, (seed >> 8) & 0xff, seed & 0xff)
+
+    values: list[float] = []
+    for table in document["tables"]:
+        for row in table["rows"]:
+            numbers = [float(cell) for cell in row if _is_number(cell)]
+            if numbers:
+                values.append(abs(numbers[0]))
+        if values:
+            break
+
+    pixels = bytearray()
+    if values:
+        values = values[:24]
+        largest = max(values) or 1.0
+        bar_width = (width - 80) // len(values)
+        for y in range(height):
+            pixels.append(0)
+            for x in range(width):
+                bar = (x - 40) // bar_width if x >= 40 else -1
+                bar_top = height - 40 - int((height - 80) * values[bar] / largest) if 0 <= bar < len(values) else height
+                if 0 <= bar < len(values) and (x - 40) % bar_width < bar_width * 3 // 4 and bar_top <= y < height - 40:
+                    pixels += bytes(((base[0] + 40 * bar) & 0xff, base[1], (base[2] + 80) & 0xff))
+                elif y == height - 40 or x == 40:
+                    pixels += b"\x40\x40\x40"
+                else:
+                    pixels += b"\xff\xff\xff"
+    else:
+        for y in range(height):
+            pixels.append(0)
+            for x in range(width):
+                shade = (x * 255 // width + y * 255 // height) // 2
+                pixels += bytes(((base[0] + shade) & 0xff, (base[1] + y // 3) & 0xff, (base[2] + x // 5) & 0xff))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", header)
+        + _png_chunk(b"tEXt", b"Title\x00" + document["title"].encode("latin-1", "replace"))
+        + _png_chunk(b"tEXt", b"Description\x00" + document["caption"].encode("latin-1", "replace"))
+        + _png_chunk(b"IDAT", zlib.compress(bytes(pixels), 6))
+        + _png_chunk(b"IEND", b"")
+    )
+
+
+def render_zip(document: dict) -> bytes:
+    """
+    A zip archive with the files of the document, or its paragraphs and tables as files
+    """
+    entries: dict[str, str | bytes] = {name.lstrip("/"): contents for name, contents in document["files"].items()}
+    if not entries:
+        if document["paragraphs"]:
+            entries["README.txt"] = "\n\n".join([document["title"]] + document["paragraphs"])
+        for table in document["tables"]:
+            rows = [table["header"]] + table["rows"] if table["header"] else table["rows"]
+            entries[f"{table['name']}.csv"] = "\n".join(",".join(str(cell) for cell in row) for row in rows)
+    return _zip(entries or {"README.txt": document["title"]})
+
+
+RENDERERS = {
+    ".xlsx": render_xlsx,
+    ".docx": render_docx,
+    ".pdf": render_pdf,
+    ".png": render_png,
+    ".zip": render_zip,
+}
+
+
+def render_document(extension: str, document: dict) -> bytes:
+    """
+    Render the semantic content of a document to a file of the given format
+    """
+    return RENDERERS[extension.lower()](document)
+
+
+_pool: ProcessPoolExecutor = None
+_pool_broken = False
+_pool_lock = threading.Lock()
+
+
+def _render_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawn, since forking a process with running threads is not safe
+            _pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            atexit.register(_pool.shutdown)
+        return _pool
+
+
+def render(extension: str, document: dict) -> bytes:
+    """
+    Render a document in the process pool, so that the generation threads are not blocked by the GIL
+
+    Renders in the calling thread if RENDER_WORKERS is 0 or the pool is broken.
+    """
+    global _pool_broken
+    if RENDER_WORKERS <= 0 or _pool_broken:
+        return render_document(extension, document)
+    try:
+        return _render_pool().submit(render_document, extension, document).result()
+    except (BrokenProcessPool, OSError) as e:
+        logger.warning(f"Rendering documents in the calling threads, the process pool failed. Error: {e}")
+        _pool_broken = True
+        return render_document(extension, document)
+
+
+async def render_async(extension: str, document: dict) -> bytes:
+    """
+    Asyncio version of render, which waits for the process pool without blocking the event loop
+
+    Renders in a thread of the default executor if RENDER_WORKERS is 0 or the pool is broken.
+    """
+    global _pool_broken
+    loop = asyncio.get_running_loop()
+    if RENDER_WORKERS <= 0 or _pool_broken:
+        return await loop.run_in_executor(None, render_document, extension, document)
+    try:
+        return await loop.run_in_executor(_render_pool(), render_document, extension, document)
+    except (BrokenProcessPool, OSError) as e:
+        logger.warning(f"Rendering documents in the calling threads, the process pool failed. Error: {e}")
+        _pool_broken = True
+        return await loop.run_in_executor(None, render_document, extension, document)
@@ -0,0 +1,33 @@
+import posixpath
+
+
+# Words in a file path that make it valuable bait, with their score
+VALUABLE_WORDS = {
+    "password": 10, "passwd": 10, "credential": 10, "secret": 10, "shadow": 10, "id_rsa": 10,
+    "token": 8, "apikey": 8, "api_key": 8, "private": 7, "key": 6, "ssh": 6, "vpn": 6,
+    "employee": 7, "payroll": 7, "salary": 7, "ssn": 7, "hr": 4, "personnel": 6,
+    "customer": 5, "client": 4, "invoice": 4, "finance": 4, "bank": 5, "account": 5,
+    "backup": 4, "database": 4, "db": 3, "admin": 4, "config": 3,
+}
+VALUABLE_EXTENSIONS = {
+    ".env": 9, ".pem": 9, ".key": 9, ".kdbx": 9, ".sql": 5,
+    ".sh": 5, ".py": 4, ".ps1": 4, ".conf": 3, ".cfg": 3, ".ini": 3, ".yaml": 3, ".yml": 3,
+    ".csv": 3, ".xlsx": 3, ".json": 2,
+}
+
+
+def file_value(file: str) -> int:
+    """
+    Score how valuable a file is as bait for an attacker. Higher is more valuable
+    """
+    path = file.lower()
+    name = posixpath.basename(path)
+    _, extension = posixpath.splitext(name)
+    if name.startswith(".env"):
+        extension = ".env"
+    score = VALUABLE_EXTENSIONS.get(extension, 0)
+    score += sum(value for word, value in VALUABLE_WORDS.items() if word in name)
+    # Folders count half
+    folder = posixpath.dirname(path)
+    score += sum(value for word, value in VALUABLE_WORDS.items() if word in folder) // 2
+    return score
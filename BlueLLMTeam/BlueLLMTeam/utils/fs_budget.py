@@ -0,0 +1,195 @@
+import os
+import asyncio
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+
+
+logger = logging.getLogger(__name__)
+
+FS_MAX_FOLDERS = int(os.getenv("FS_MAX_FOLDERS", 100))
+FS_MAX_FILES = int(os.getenv("FS_MAX_FILES", 500))
+FS_MAX_LLM_CALLS = int(os.getenv("FS_MAX_LLM_CALLS", 100))
+FS_MAX_CONCURRENCY = int(os.getenv("FS_MAX_CONCURRENCY", 8))
+# Threads that generate file contents, and seconds after which files that are not started are left empty
+FS_CONTENT_WORKERS = int(os.getenv("FS_CONTENT_WORKERS", 16))
+FS_CONTENT_DEADLINE = float(os.getenv("FS_CONTENT_DEADLINE")) if os.getenv("FS_CONTENT_DEADLINE") else None
+# Enhancement rounds of the v2 file system: at most this many rounds. Stop when a round grows the
+# structure by less than FS_ENHANCE_MIN_GROWTH, or it has FS_ENHANCE_TARGET_ENTRIES files and folders
+FS_ENHANCE_ROUNDS = int(os.getenv("FS_ENHANCE_ROUNDS", 8))
+FS_ENHANCE_MIN_GROWTH = float(os.getenv("FS_ENHANCE_MIN_GROWTH", 0.1))
+FS_ENHANCE_TARGET_ENTRIES = int(os.getenv("FS_ENHANCE_TARGET_ENTRIES", 400))
+# Enhance this many top level subtrees in parallel. 0 enhances the whole structure at once
+FS_ENHANCE_SUBTREES = int(os.getenv("FS_ENHANCE_SUBTREES", 0))
+# Token budgets of the file structure in the v2 file contents prompts: the part around the file
+# and the overview of the whole structure. 0 sends the full structure with every prompt
+FS_PROMPT_TOKENS = int(os.getenv("FS_PROMPT_TOKENS", 1000))
+FS_OVERVIEW_TOKENS = int(os.getenv("FS_OVERVIEW_TOKENS", 400))
+# Retries of the conversion of the v2 file structure to JSON, before starting over
+FS_JSON_RETRIES = int(os.getenv("FS_JSON_RETRIES", 2))
+
+# Expand a folder into its files and sub folders
+Expand = Callable[[str], tuple[list[str], list[str]]]
+AsyncExpand = Callable[[str], Awaitable[tuple[list[str], list[str]]]]
+# Receive the files of a folder as soon as it is expanded
+OnFiles = Callable[[list[str]], None]
+
+
+@dataclass
+class FileSystemBudget:
+    """
+    Global limits for the generation of a file system
+
+    Attributes:
+        max_folders: largest number of folders to queue for expansion, including the root
+        max_files: largest number of files to keep
+        max_calls: largest number of LLM calls to make
+        max_concurrency: largest number of folders to expand at the same time
+    """
+    max_folders: int = FS_MAX_FOLDERS
+    max_files: int = FS_MAX_FILES
+    max_calls: int = FS_MAX_LLM_CALLS
+    max_concurrency: int = FS_MAX_CONCURRENCY
+
+    folders: int = 0
+    files: int = 0
+    calls: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def take_call(self) -> bool:
+        """
+        Reserve one LLM call. False if the budget is used up
+        """
+        with self.lock:
+            if self.calls >= self.max_calls:
+                return False
+            self.calls += 1
+            return True
+
+    def take_folders(self, folders: list[str]) -> list[str]:
+        """
+        Reserve as many of the folders as the budget allows
+        """
+        with self.lock:
+            count = max(0, min(len(folders), self.max_folders - self.folders))
+            self.folders += count
+            return folders[:count]
+
+    def take_files(self, files: list[str]) -> list[str]:
+        """
+        Reserve as many of the files as the budget allows
+        """
+        with self.lock:
+            count = max(0, min(len(files), self.max_files - self.files))
+            self.files += count
+            return files[:count]
+
+    @property
+    def exhausted(self) -> bool:
+        with self.lock:
+            return self.calls >= self.max_calls or self.files >= self.max_files
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {"folders": self.folders, "files": self.files, "calls": self.calls}
+
+
+def breadth_first(
+        root: str,
+        expand: Expand,
+        budget: FileSystemBudget = None,
+        max_depth: int = 5,
+        depth: int = 0,
+        on_files: OnFiles = None,
+    ) -> list[str]:
+    """
+    Expand a folder tree breadth first from a work queue, within the budget
+
+    Folders are expanded by a pool of at most max_concurrency threads in the
+    order they were found. No more folders are expanded once a budget is
+    used up. A folder that fails to expand is left empty.
+
+    The files of each folder are passed to on_files as soon as the folder is
+    expanded, so they can be processed while the rest of the tree is discovered.
+
+    Returns:
+        files: the files of all expanded folders
+    """
+    budget = budget or FileSystemBudget()
+    files: list[str] = []
+    queue: deque[tuple[str, int]] = deque((folder, depth) for folder in budget.take_folders([root]))
+    running: dict[Future, int] = {}
+
+    with ThreadPoolExecutor(max_workers=budget.max_concurrency, thread_name_prefix="fs") as executor:
+        while queue or running:
+            while queue and len(running) < budget.max_concurrency and budget.take_call():
+                folder, folder_depth = queue.popleft()
+                running[executor.submit(expand, folder)] = folder_depth
+            if not running:
+                # The budget is used up
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                folder_depth = running.pop(future)
+                try:
+                    folder_files, sub_folders = future.result()
+                except Exception as e:
+                    logger.warning(f"Failed to expand folder: {e}")
+                    continue
+                folder_files = budget.take_files(folder_files)
+                files.extend(folder_files)
+                if on_files is not None and folder_files:
+                    on_files(folder_files)
+                if folder_depth < max_depth:
+                    queue.extend((folder, folder_depth + 1) for folder in budget.take_folders(sub_folders))
+
+    if queue:
+        logger.info(f"File system budget used up with {len(queue)} folders left to expand: {budget.to_dict()}")
+    return files
+
+
+async def breadth_first_async(
+        root: str,
+        expand: AsyncExpand,
+        budget: FileSystemBudget = None,
+        max_depth: int = 5,
+        depth: int = 0,
+        on_files: OnFiles = None,
+    ) -> list[str]:
+    """
+    Asyncio version of breadth_first
+    """
+    budget = budget or FileSystemBudget()
+    files: list[str] = []
+    queue: deque[tuple[str, int]] = deque((folder, depth) for folder in budget.take_folders([root]))
+    running: dict[asyncio.Task, int] = {}
+
+    while queue or running:
+        while queue and len(running) < budget.max_concurrency and budget.take_call():
+            folder, folder_depth = queue.popleft()
+            running[asyncio.ensure_future(expand(folder))] = folder_depth
+        if not running:
+            break
+
+        done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            folder_depth = running.pop(task)
+            try:
+                folder_files, sub_folders = task.result()
+            except Exception as e:
+                logger.warning(f"Failed to expand folder: {e}")
+                continue
+            folder_files = budget.take_files(folder_files)
+            files.extend(folder_files)
+            if on_files is not None and folder_files:
+                on_files(folder_files)
+            if folder_depth < max_depth:
+                queue.extend((folder, folder_depth + 1) for folder in budget.take_folders(sub_folders))
+
+    if queue:
+        logger.info(f"File system budget used up with {len(queue)} folders left to expand: {budget.to_dict()}")
+    return files
@@ -0,0 +1,207 @@
+import re
+import posixpath
+
+from BlueLLMTeam.utils.ratelimit import CHARS_PER_TOKEN
+
+
+# Characters that indent or mark an entry of a file structure outline
+OUTLINE_PREFIX = " \t-*+•|│├└─`>#"
+NUMBERING = re.compile(r"^\d+[.)]\s+")
+# Lines with more words than this are prose, not file or folder names
+MAX_ENTRY_WORDS = 6
+
+
+def outline_entry(line: str) -> tuple[int, str] | None:
+    """
+    Indentation and name of a line of a file structure outline. None for prose and empty lines
+    """
+    stripped = line.lstrip(OUTLINE_PREFIX)
+    name = NUMBERING.sub("", stripped).strip().strip("*`").strip()
+    words = len(name.split())
+    if not name or words > MAX_ENTRY_WORDS or (name.endswith(":") and words > 2):
+        return None
+    return len(line) - len(stripped), name.rstrip("/:").strip()
+
+
+def parse_outline(text: str) -> list[tuple[int, str]]:
+    """
+    Parse a file structure outline into (indent, name) entries
+
+    The outline is the free text of the file system lead and enhancer, e.g.
+    "- HR\n  - payroll.xlsx" or a tree with "├──" characters.
+    """
+    entries = [outline_entry(line) for line in text.split("\n")]
+    return [entry for entry in entries if entry is not None]
+
+
+def structure_entries(text: str) -> set[str]:
+    """
+    Paths of all files and folders in a file structure outline, from the indentation
+    """
+    paths = set()
+    stack: list[tuple[int, str]] = []
+    for indent, name in parse_outline(text):
+        while stack and stack[-1][0] >= indent:
+            stack.pop()
+        stack.append((indent, name.lower()))
+        paths.add("/".join(part for _, part in stack))
+    return paths
+
+
+def structure_growth(previous: set[str], current: set[str]) -> float:
+    """
+    Share of new entries in the current structure compared to the previous one
+    """
+    return len(current - previous) / max(1, len(previous))
+
+
+def split_subtrees(text: str) -> tuple[str, list[str], int]:
+    """
+    Split a file structure outline into its top level subtrees
+
+    Single root folders are skipped, so the subtrees are the children of the root.
+
+    Returns:
+        header: the lines before the first subtree
+        subtrees: the text of each subtree
+        indent: the outline indentation of the subtrees
+    """
+    lines = text.split("\n")
+    entries = [outline_entry(line) for line in lines]
+    items = [entry[0] for entry in entries if entry is not None]
+    if not items:
+        return text, [], 0
+
+    level = min(items)
+    while items.count(level) == 1 and any(indent > level for indent in items):
+        level = min(indent for indent in items if indent > level)
+
+    header: list[str] = []
+    subtrees: list[list[str]] = []
+    for line, entry in zip(lines, entries):
+        if entry is not None and entry[0] == level:
+            subtrees.append([line])
+        elif subtrees:
+            subtrees[-1].append(line)
+        else:
+            header.append(line)
+    return "\n".join(header), ["\n".join(subtree) for subtree in subtrees], level
+
+
+def merge_subtrees(header: str, subtrees: list[str], indent: int) -> str:
+    """
+    Join subtrees under a header, indenting each subtree by the given number of spaces
+
+    Prose around the outline in the subtrees is dropped.
+    """
+    merged = [header] if header.strip() else []
+    for subtree in subtrees:
+        lines = [line for line in subtree.split("\n") if outline_entry(line) is not None]
+        if not lines:
+            continue
+        # Remove the indentation of the answer before adding the one of the subtree
+        offset = min(len(line) - len(line.lstrip(" \t")) for line in lines)
+        merged.extend(" " * indent + line[offset:] for line in lines)
+    return "\n".join(merged)
+
+
+def count_files(node: dict) -> int:
+    """
+    Number of files in a nested folder dictionary, see build_file_structure of the v2 file system
+    """
+    return sum(count_files(value) if isinstance(value, dict) else 1 for value in node.values())
+
+
+def _fits(lines: list[str], max_tokens: int) -> bool:
+    return sum(len(line) + 1 for line in lines) // CHARS_PER_TOKEN <= max_tokens
+
+
+def _folder_label(name: str) -> str:
+    # The root of absolute paths has an empty name
+    return f"{name}/" if name else "/"
+
+
+def _render_folder(name: str, node: dict, indent: str) -> str:
+    files = count_files(node)
+    return f"{indent}{_folder_label(name)} ({files} {'file' if files == 1 else 'files'})"
+
+
+def _render_path(node: dict, parts: list[str], depth: int, limit: int, lines: list[str]) -> None:
+    part = parts[0] if parts else None
+    others = [name for name in sorted(node) if name != part]
+    shown = set(others[:limit])
+    if part in node:
+        shown.add(part)
+
+    indent = "  " * depth
+    for name in sorted(node):
+        if name not in shown:
+            continue
+        value = node[name]
+        if not isinstance(value, dict):
+            lines.append(f"{indent}{name}")
+        elif name == part and len(parts) > 1:
+            lines.append(f"{indent}{_folder_label(name)}")
+            _render_path(value, parts[1:], depth + 1, limit, lines)
+        else:
+            lines.append(_render_folder(name, value, indent))
+    if len(others) > limit:
+        lines.append(f"{indent}... {len(others) - limit} more")
+
+
+def relevant_structure(file_structure: dict, file: str, max_tokens: int) -> str:
+    """
+    The part of a file structure that matters for one file, within a token budget
+
+    Contains the ancestors of the file and the siblings of the file and of each
+    ancestor. Other folders are summarized by their number of files. Long lists
+    of siblings are cut until the text fits in max_tokens.
+    """
+    parts = posixpath.normpath(file).split("/")
+    limit = max(len(node) for node in _nodes_on_path(file_structure, parts))
+    while True:
+        lines: list[str] = []
+        _render_path(file_structure, parts, 0, limit, lines)
+        if limit == 0 or _fits(lines, max_tokens):
+            return "\n".join(lines)
+        limit //= 2
+
+
+def _nodes_on_path(file_structure: dict, parts: list[str]) -> list[dict]:
+    nodes = [file_structure]
+    for part in parts[:-1]:
+        node = nodes[-1].get(part)
+        if not isinstance(node, dict):
+            break
+        nodes.append(node)
+    return nodes
+
+
+def structure_overview(file_structure: dict, max_tokens: int) -> str:
+    """
+    Outline of the folders of a file structure with their number of files, within a token budget
+
+    The outline is as deep as the budget allows and the same for every file, so
+    prompts that start with it share a prefix.
+    """
+    def render(node: dict, depth: int, max_depth: int, lines: list[str]) -> None:
+        for name in sorted(node):
+            value = node[name]
+            if isinstance(value, dict):
+                lines.append(_render_folder(name, value, "  " * depth))
+                if depth + 1 < max_depth:
+                    render(value, depth + 1, max_depth, lines)
+
+    previous: list[str] = []
+    max_depth = 1
+    while True:
+        lines: list[str] = []
+        render(file_structure, 0, max_depth, lines)
+        if not _fits(lines, max_tokens) or lines == previous:
+            break
+        previous = lines
+        max_depth += 1
+    if not previous:
+        # Not even the top level fits
+        previous = lines[:max(1, max_tokens * CHARS_PER_TOKEN // 40)]
+    return "\n".join(previous)
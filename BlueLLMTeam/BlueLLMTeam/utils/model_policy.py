@@ -0,0 +1,68 @@
+import os
+import json
+import logging
+from pathlib import Path
+
+from BlueLLMTeam.utils.path import conf
+
+
+logger = logging.getLogger(__name__)
+
+MODEL_POLICY_FILE = Path(os.getenv("MODEL_POLICY_FILE", conf("model_policy.json")))
+
+
+class ModelPolicy:
+    """
+    Declarative choice of model and max_tokens for each prompt
+
+    The policy maps prompt kinds and agent roles to a tier, and tiers to a model.
+    Rules for a kind take precedence over rules for an agent, which take
+    precedence over the default. A rule may also set max_tokens, which caps
+    the max_tokens of the prompt.
+
+    Example:
+        {
+            "tiers": {"fast": {"model": "gpt-4o-mini"}, "strong": {"model": "gpt-4o"}},
+            "default": {"tier": "fast"},
+            "agents": {"Analyst": {"tier": "strong"}},
+            "kinds": {"python_advisor": {"tier": "fast", "max_tokens": 1024}}
+        }
+    """
+
+    def __init__(self, policy: dict) -> None:
+        self.tiers: dict[str, dict] = policy.get("tiers", {})
+        self.default: dict = policy.get("default", {})
+        self.agents: dict[str, dict] = policy.get("agents", {})
+        self.kinds: dict[str, dict] = policy.get("kinds", {})
+
+        for rule in [self.default, *self.agents.values(), *self.kinds.values()]:
+            if "tier" in rule and rule["tier"] not in self.tiers:
+                raise ValueError(f"Unknown model tier {rule['tier']!r} in model policy")
+
+    @classmethod
+    def from_file(cls, path: Path = MODEL_POLICY_FILE) -> "ModelPolicy":
+        return cls(json.loads(Path(path).read_text()))
+
+    def rule(self, prompt_dict: dict) -> dict:
+        """
+        Get the merged rule for a prompt
+        """
+        rule = dict(self.default)
+        rule.update(self.agents.get(prompt_dict.get("agent"), {}))
+        rule.update(self.kinds.get(prompt_dict.get("kind"), {}))
+        return rule
+
+    def apply(self, prompt_dict: dict) -> dict:
+        """
+        Get a copy of the prompt with the model and max_tokens of the policy
+        """
+        rule = self.rule(prompt_dict)
+        prompt_dict = dict(prompt_dict)
+        if "tier" in rule:
+            prompt_dict["model"] = self.tiers[rule["tier"]]["model"]
+            prompt_dict["tier"] = rule["tier"]
+        if "model" in rule:
+            prompt_dict["model"] = rule["model"]
+        if "max_tokens" in rule:
+            prompt_dict["max_tokens"] = min(rule["max_tokens"], prompt_dict.get("max_tokens", rule["max_tokens"]))
+        return prompt_dict
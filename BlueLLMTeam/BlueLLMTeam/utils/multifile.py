@@ -0,0 +1,70 @@
+import os
+import json
+import posixpath
+
+from BlueLLMTeam.utils.text import extract_json_from_text
+
+
+MULTI_FILE_GROUP_SIZE = int(os.getenv("MULTI_FILE_GROUP_SIZE", 8))
+# Files that are usually short enough to be written together with their siblings
+SMALL_FILE_EXTENSIONS = {
+    "", ".txt", ".md", ".log", ".cfg", ".conf", ".ini", ".env", ".json", ".yaml", ".yml",
+    ".xml", ".sh", ".bashrc", ".profile", ".html", ".css", ".js", ".sql", ".list", ".key", ".pub",
+}
+
+
+def is_small_file(file: str) -> bool:
+    _, extension = posixpath.splitext(file)
+    return extension.lower() in SMALL_FILE_EXTENSIONS
+
+
+def group_small_files(files: set[str], group_size: int = MULTI_FILE_GROUP_SIZE) -> list[list[str]]:
+    """
+    Group small files in the same folder, at most group_size in each group
+
+    Other files get a group of their own.
+    """
+    groups: list[list[str]] = []
+    folders: dict[str, list[str]] = {}
+    for file in sorted(files):
+        if group_size > 1 and is_small_file(file):
+            folders.setdefault(posixpath.dirname(file), []).append(file)
+        else:
+            groups.append([file])
+    for siblings in folders.values():
+        groups.extend(siblings[i:i + group_size] for i in range(0, len(siblings), group_size))
+    return groups
+
+
+def parse_file_map(response: str, files: list[str]) -> dict[str, str]:
+    """
+    Get the contents of each requested file from a JSON map of file path to contents
+
+    Paths are matched with or without a leading slash, or by file name if it
+    is unique in the group. Entries that are missing, empty or not text are
+    left out. JSON values of .json files are written back as JSON.
+    """
+    try:
+        file_map = extract_json_from_text(response)
+    except ValueError:
+        return {}
+    if not isinstance(file_map, dict):
+        return {}
+
+    names = [posixpath.basename(file) for file in files]
+    contents = {}
+    for file in files:
+        name = posixpath.basename(file)
+        candidates = [file, file.lstrip("/"), "/" + file.lstrip("/")]
+        if names.count(name) == 1:
+            candidates.append(name)
+        for candidate in candidates:
+            if candidate not in file_map:
+                continue
+            value = file_map[candidate]
+            if isinstance(value, (dict, list)) and file.endswith(".json"):
+                value = json.dumps(value, indent=4)
+            if isinstance(value, str) and value.strip():
+                contents[file] = value
+            break
+    return contents
@@ -0,0 +1,289 @@
+import re
+import time
+import asyncio
+import heapq
+import logging
+import itertools
+import threading
+from enum import IntEnum
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+
+
+logger = logging.getLogger(__name__)
+
+WINDOW = 60.0
+# Seconds between checks of asyncio requests waiting for a slot. Releases do not wake them up
+ASYNC_POLL_INTERVAL = 0.05
+CHARS_PER_TOKEN = 4
+
+
+class Priority(IntEnum):
+    """
+    Priority classes of LLM requests. Lower values are served first
+    """
+    INTERACTIVE = 0
+    SYSTEM = 1
+    BULK = 2
+
+
+# Analysis of live attacker sessions
+INTERACTIVE_AGENTS = {"Analyst"}
+INTERACTIVE_KINDS = {"analyse_logs"}
+# Requests that decide the honeypot design, configuration, system files and command responses
+SYSTEM_KINDS = {
+    "honeypot_amount",
+    "honeypot_design",
+    "generate_prompt",
+    "file_system_creator",
+    "file_system_lead",
+    "file_system_enhancer",
+    "file_system_employee",
+    "linux_important_files_creator",
+    "cowrie_configuration_creator",
+    "linux_command_response",
+}
+
+
+def prompt_priority(prompt_dict: dict) -> Priority:
+    """
+    Get the priority of a prompt
+
+    An explicit 'priority' in the prompt is used if set. Otherwise the priority
+    follows from the agent that made the request and the kind of prompt. File
+    contents and other unknown prompts are bulk traffic.
+    """
+    if prompt_dict.get("priority") is not None:
+        return Priority(prompt_dict["priority"])
+    if prompt_dict.get("agent") in INTERACTIVE_AGENTS or prompt_dict.get("kind") in INTERACTIVE_KINDS:
+        return Priority.INTERACTIVE
+    if prompt_dict.get("kind") in SYSTEM_KINDS:
+        return Priority.SYSTEM
+    return Priority.BULK
+
+
+def estimate_tokens(prompt_dict: dict, max_tokens: int = 0) -> int:
+    """
+    Estimate the number of tokens a request counts against the tokens-per-minute limit
+
+    The API counts the prompt and the requested max_tokens, so both are included.
+    """
+    text_length = sum(len(str(prompt_dict.get(key, ""))) for key in ("systemRole", "user", "context", "message"))
+    return text_length // CHARS_PER_TOKEN + max_tokens
+
+
+def parse_duration(value: str) -> float:
+    """
+    Parse durations as given in rate limit headers, e.g. '1s', '6m0s' or '20ms', into seconds
+    """
+    units = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+    parts = re.findall(r"([\d.]+)(ms|h|m|s)", value)
+    if not parts:
+        return float(value)
+    return sum(float(amount) * units[unit] for amount, unit in parts)
+
+
+class Slot:
+    """
+    A granted request slot. Set 'tokens' to the actual usage once it is known
+    """
+
+    def __init__(self, tokens: int) -> None:
+        self.tokens = tokens
+        self.time = time.monotonic()
+
+
+class RateLimiter:
+    """
+    Shared limiter for requests per minute, tokens per minute and concurrency
+
+    Callers wait in a priority queue until the limits allow their request.
+    Requests of the same priority are served first-in-first-out. Some of the
+    concurrency is reserved for interactive requests, so they do not wait for
+    bulk requests to finish. The concurrency limit shrinks when the API answers
+    with rate limit errors and slowly grows back while requests succeed.
+    """
+
+    def __init__(
+            self,
+            requests_per_minute: int,
+            tokens_per_minute: int,
+            max_concurrency: int,
+            min_concurrency: int = 1,
+            default_cooldown: float = 1.0,
+            reserved_concurrency: int = 1,
+        ) -> None:
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.default_cooldown = default_cooldown
+        self.reserved_concurrency = reserved_concurrency
+
+        self.concurrency = float(max_concurrency)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.slots: deque[Slot] = deque()
+        # Heap of (priority, sequence number)
+        self.queue: list[tuple[int, int]] = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+
+    def _prune(self, now: float) -> None:
+        while self.slots and now - self.slots[0].time > WINDOW:
+            self.slots.popleft()
+
+    def concurrency_limit(self, priority: int) -> int:
+        """
+        Number of requests of this priority that may be in flight
+        """
+        if priority <= Priority.INTERACTIVE:
+            return int(self.concurrency)
+        return max(1, int(self.concurrency) - self.reserved_concurrency)
+
+    def _wait_time(self, tokens: int, now: float, priority: int = Priority.SYSTEM) -> float:
+        """
+        Time to wait before a request with 'tokens' fits in the limits. 0 if it fits now
+        """
+        self._prune(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.in_flight >= self.concurrency_limit(priority):
+            # Woken up by release
+            wait = max(wait, WINDOW)
+        if len(self.slots) >= self.requests_per_minute:
+            wait = max(wait, self.slots[0].time + WINDOW - now)
+        used_tokens = sum(slot.tokens for slot in self.slots)
+        if self.slots and used_tokens + tokens > self.tokens_per_minute:
+            # Wait until enough tokens have left the window
+            for slot in self.slots:
+                used_tokens -= slot.tokens
+                if used_tokens + tokens <= self.tokens_per_minute:
+                    wait = max(wait, slot.time + WINDOW - now)
+                    break
+            else:
+                # The request is larger than the limit, send it alone
+                wait = max(wait, self.slots[-1].time + WINDOW - now)
+        return wait
+
+    def acquire(self, tokens: int, priority: int = Priority.SYSTEM) -> Slot:
+        """
+        Block until the request can be sent. Returns the slot to release afterwards
+        """
+        ticket = (int(priority), next(self.counter))
+        with self.condition:
+            heapq.heappush(self.queue, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    if self.queue[0] == ticket:
+                        wait = self._wait_time(tokens, now, priority)
+                        if wait <= 0:
+                            break
+                    else:
+                        wait = WINDOW
+                    self.condition.wait(timeout=wait)
+            finally:
+                self.queue.remove(ticket)
+                heapq.heapify(self.queue)
+
+            slot = Slot(tokens)
+            self.slots.append(slot)
+            self.in_flight += 1
+            self.condition.notify_all()
+            return slot
+
+    async def acquire_async(self, tokens: int, priority: int = Priority.SYSTEM) -> Slot:
+        """
+        Asyncio version of acquire. Waits without blocking the event loop
+        """
+        ticket = (int(priority), next(self.counter))
+        with self.condition:
+            heapq.heappush(self.queue, ticket)
+        try:
+            while True:
+                with self.condition:
+                    wait = WINDOW
+                    if self.queue[0] == ticket:
+                        wait = self._wait_time(tokens, time.monotonic(), priority)
+                        if wait <= 0:
+                            slot = Slot(tokens)
+                            self.slots.append(slot)
+                            self.in_flight += 1
+                            return slot
+                await asyncio.sleep(min(wait, ASYNC_POLL_INTERVAL))
+        finally:
+            with self.condition:
+                self.queue.remove(ticket)
+                heapq.heapify(self.queue)
+                self.condition.notify_all()
+
+    def release(self, slot: Slot) -> None:
+        """
+        Release a slot after the response has been received
+        """
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    @contextmanager
+    def limit(self, tokens: int, priority: int = Priority.SYSTEM):
+        """
+        Context manager that acquires and releases a slot
+        """
+        slot = self.acquire(tokens, priority)
+        try:
+            yield slot
+        finally:
+            self.release(slot)
+
+    @asynccontextmanager
+    async def limit_async(self, tokens: int, priority: int = Priority.SYSTEM):
+        """
+        Asyncio version of limit
+        """
+        slot = await self.acquire_async(tokens, priority)
+        try:
+            yield slot
+        finally:
+            self.release(slot)
+
+    def on_success(self) -> None:
+        """
+        Additively increase the concurrency after a successful request
+        """
+        with self.condition:
+            if self.concurrency < self.max_concurrency:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / max(1.0, self.concurrency))
+                self.condition.notify_all()
+
+    def on_rate_limited(self, retry_after: float = None) -> None:
+        """
+        Multiplicatively decrease the concurrency and pause all requests after a rate limit error
+        """
+        with self.condition:
+            self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+            cooldown = self.default_cooldown if retry_after is None else retry_after
+            self.blocked_until = max(self.blocked_until, time.monotonic() + cooldown)
+            logger.info(f"Rate limited. Lowering concurrency to {int(self.concurrency)} and pausing for {cooldown:.2f}s")
+
+    def update_from_headers(self, headers) -> None:
+        """
+        Update the limits from the x-ratelimit-* headers returned by the API
+        """
+        try:
+            with self.condition:
+                if "x-ratelimit-limit-requests" in headers:
+                    self.requests_per_minute = int(headers["x-ratelimit-limit-requests"])
+                if "x-ratelimit-limit-tokens" in headers:
+                    self.tokens_per_minute = int(headers["x-ratelimit-limit-tokens"])
+
+                # Pause if the current window is exhausted
+                now = time.monotonic()
+                for remaining, reset in (
+                    ("x-ratelimit-remaining-requests", "x-ratelimit-reset-requests"),
+                    ("x-ratelimit-remaining-tokens", "x-ratelimit-reset-tokens"),
+                ):
+                    if int(headers.get(remaining, 1)) <= 0 and reset in headers:
+                        self.blocked_until = max(self.blocked_until, now + parse_duration(headers[reset]))
+        except (TypeError, ValueError) as e:
+            logger.debug(f"Could not parse rate limit headers: {e}")
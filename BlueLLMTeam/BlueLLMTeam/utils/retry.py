@@ -0,0 +1,134 @@
+import time
+import random
+import logging
+import threading
+from dataclasses import dataclass
+
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of sending a request while a backend is considered down
+    """
+
+
+@dataclass
+class RetryPolicy:
+    """
+    Capped exponential backoff with full jitter
+
+    Attributes:
+        max_retries: number of retries after the first attempt
+        base_delay: delay in seconds before the first retry, before jitter
+        max_delay: largest delay in seconds, before jitter
+    """
+    max_retries: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+
+    def delay(self, attempt: int, retry_after: float = None) -> float:
+        """
+        Seconds to wait before retry number 'attempt' (starting at 0)
+
+        A retry hint from the server is respected as the lower bound.
+        """
+        backoff = min(self.max_delay, self.base_delay * 2 ** attempt)
+        delay = random.uniform(0, backoff)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+class CircuitBreaker:
+    """
+    Stop sending requests to a backend that keeps failing
+
+    After failure_threshold consecutive failures the circuit opens and all
+    calls fail fast with CircuitOpenError. After reset_timeout seconds one
+    probe call is let through. The circuit closes again if it succeeds and
+    opens again if it fails. A probe that ends any other way, e.g. with a
+    rate limit or a bad request, must be released with release_probe.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = 0.0
+        self.state = self.CLOSED
+        self.probing = False
+
+    def before_call(self) -> bool:
+        """
+        Check that a call may be made. Raises CircuitOpenError otherwise
+
+        Returns:
+            probe: True if the call is the probe of a half open circuit
+        """
+        with self.lock:
+            if self.state == self.CLOSED:
+                return False
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.probing = False
+            if self.state == self.HALF_OPEN and not self.probing:
+                # Let one probe through
+                self.probing = True
+                return True
+            raise CircuitOpenError(f"Circuit for {self.name} is open after {self.failures} failures")
+
+    def on_success(self) -> None:
+        with self.lock:
+            if self.state != self.CLOSED:
+                logger.info(f"Circuit for {self.name} closed")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.probing = False
+
+    def on_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"Circuit for {self.name} opened after {self.failures} failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+    def release_probe(self) -> None:
+        """
+        Let another call probe the backend, after a probe that neither succeeded nor failed
+        """
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.probing = False
+
+    def trip(self) -> None:
+        """
+        Open the circuit immediately, e.g. when the quota of an API is exhausted
+        """
+        with self.lock:
+            self.failures = max(self.failures, self.failure_threshold)
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self.probing = False
+            logger.warning(f"Circuit for {self.name} opened")
+
+    @property
+    def is_open(self) -> bool:
+        """
+        True while calls fail fast, i.e. the circuit is open or its probe is in flight
+        """
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                return self.probing
+            return self.state == self.OPEN and time.monotonic() - self.opened_at < self.reset_timeout
@@ -0,0 +1,145 @@
+import math
+import hashlib
+import threading
+from pathlib import PurePosixPath
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+
+
+NGRAM_SIZE = 3
+# Lowest similarity of two subjects for the semantic cache to reuse a response.
+# Only subjects with the same name are compared, see subject_name. Paths that
+# differ in one short folder, like /home/finance/2023/report.txt and
+# /home/finance/2024/report.txt, score about 0.9
+SEMANTIC_CACHE_THRESHOLD = 0.85
+
+
+def ngrams(text: str, n: int = NGRAM_SIZE) -> Counter:
+    """
+    Count the character n-grams of a text. The text is padded so that short texts get n-grams too
+    """
+    text = f" {text.lower()} "
+    return Counter(text[i:i + n] for i in range(max(1, len(text) - n + 1)))
+
+
+def cosine_similarity(a: Counter, b: Counter) -> float:
+    """
+    Cosine similarity between two n-gram count vectors
+    """
+    if len(a) > len(b):
+        a, b = b, a
+    dot = sum(count * b[gram] for gram, count in a.items() if gram in b)
+    norm = math.sqrt(sum(c * c for c in a.values())) * math.sqrt(sum(c * c for c in b.values()))
+    return dot / norm if norm else 0.0
+
+
+def canonical_command(command: str) -> str:
+    """
+    Normalize a shell command so that equivalent flag orders compare equal, e.g. 'ls -la' and 'ls -al'
+    """
+    words = []
+    for word in command.split():
+        if word.startswith("-") and not word.startswith("--") and word[1:].isalpha():
+            word = "-" + "".join(sorted(word[1:]))
+        words.append(word)
+    return " ".join(words)
+
+
+def subject_name(subject: str) -> str:
+    """
+    The part of a subject that must be equal for two subjects to be compared
+
+    The file name of a path, or the words of a command with every path reduced
+    to its file name. Similar names like passwords.txt and password.txt, or
+    a.sh and b.sh, have different contents, so only the folders may differ.
+    """
+    return " ".join(PurePosixPath(word).name or word for word in subject.split())
+
+
+@dataclass
+class Match:
+    subject: str
+    value: str
+    similarity: float
+
+
+class SimilarityIndex:
+    """
+    Index of short texts, e.g. commands or file paths, searched by character n-gram cosine similarity
+
+    Texts are indexed in separate scopes. Only texts in the same scope are
+    compared. An inverted index from n-gram to entries keeps lookups fast.
+    The oldest entries of a scope are dropped when it holds more than
+    max_entries.
+    """
+
+    def __init__(self, max_entries: int = 10000) -> None:
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        # scope -> subject -> (vector, norm, value)
+        self.entries: dict[str, OrderedDict[str, tuple[Counter, float, str]]] = {}
+        # scope -> n-gram -> subjects
+        self.postings: dict[str, dict[str, set[str]]] = {}
+
+    def add(self, scope: str, subject: str, value: str) -> None:
+        vector = ngrams(subject)
+        norm = math.sqrt(sum(c * c for c in vector.values()))
+        with self.lock:
+            entries = self.entries.setdefault(scope, OrderedDict())
+            postings = self.postings.setdefault(scope, {})
+            if subject in entries:
+                entries.move_to_end(subject)
+            else:
+                for gram in vector:
+                    postings.setdefault(gram, set()).add(subject)
+            entries[subject] = (vector, norm, value)
+
+            while len(entries) > self.max_entries:
+                old_subject, (old_vector, _, _) = entries.popitem(last=False)
+                for gram in old_vector:
+                    postings[gram].discard(old_subject)
+                    if not postings[gram]:
+                        del postings[gram]
+
+    def search(self, scope: str, subject: str) -> Match | None:
+        """
+        Find the most similar indexed text in a scope. None if the scope shares no n-gram with the text
+        """
+        vector = ngrams(subject)
+        norm = math.sqrt(sum(c * c for c in vector.values()))
+        with self.lock:
+            entries = self.entries.get(scope)
+            if not entries:
+                return None
+            postings = self.postings[scope]
+            dots: Counter = Counter()
+            for gram, count in vector.items():
+                for candidate in postings.get(gram, ()):
+                    dots[candidate] += count * entries[candidate][0][gram]
+            if not dots:
+                return None
+            best = max(dots, key=lambda candidate: dots[candidate] / entries[candidate][1])
+            _, best_norm, value = entries[best]
+        return Match(best, value, min(1.0, dots[best] / (norm * best_norm)))
+
+    def __len__(self) -> int:
+        with self.lock:
+            return sum(len(entries) for entries in self.entries.values())
+
+
+def scope_key(*parts) -> str:
+    """
+    Hash the parts of a prompt that must match exactly for two prompts to be compared
+    """
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+def substitute_subject(text: str, old: str, new: str) -> str:
+    """
+    Adapt a response for one subject to a similar subject, by replacing the old subject and its file name
+    """
+    text = text.replace(old, new)
+    old_name, new_name = PurePosixPath(old).name, PurePosixPath(new).name
+    if old_name and new_name:
+        text = text.replace(old_name, new_name)
+    return text
@@ -0,0 +1,110 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class _Call:
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls with the same key
+
+    The first caller for a key runs the function. Callers that arrive with the
+    same key while it is running wait for that result instead of running the
+    function again. Once the call is done the key is forgotten.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.calls: dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> tuple[Any, bool]:
+        """
+        Run fn(*args, **kwargs), or wait for an identical call that is already running
+
+        Returns:
+            result: the result of the call
+            shared: True if the result came from another caller
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                leader = False
+            else:
+                call = _Call()
+                self.calls[key] = call
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self) -> int:
+        """
+        Number of distinct calls currently running
+        """
+        with self.lock:
+            return len(self.calls)
+
+
+class AsyncSingleFlight:
+    """
+    Asyncio version of SingleFlight, for callers in the same event loop
+
+    Callers that wait for another caller are not cancelled with it, but
+    receive its CancelledError.
+    """
+
+    def __init__(self) -> None:
+        self.calls: dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> tuple[Any, bool]:
+        """
+        Await fn(*args, **kwargs), or wait for an identical call that is already running. See SingleFlight.do
+        """
+        call = self.calls.get(key)
+        if call is not None:
+            return await asyncio.shield(call), True
+
+        call = asyncio.get_running_loop().create_future()
+        self.calls[key] = call
+        try:
+            result = await fn(*args, **kwargs)
+        except asyncio.CancelledError:
+            call.cancel()
+            raise
+        except BaseException as e:
+            call.set_exception(e)
+            # Nobody may be waiting for the result
+            call.exception()
+            raise
+        else:
+            call.set_result(result)
+        finally:
+            del self.calls[key]
+        return result, False
+
+    def in_flight(self) -> int:
+        """
+        Number of distinct calls currently running
+        """
+        return len(self.calls)
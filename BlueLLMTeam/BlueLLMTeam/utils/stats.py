@@ -0,0 +1,76 @@
+import time
+import threading
+from collections import deque
+
+
+class RollingStats:
+    """
+    Latencies and outcomes of the most recent requests to a backend
+
+    Only the last 'size' samples that are at most 'max_age' seconds old are
+    kept, so a backend that failed a while ago is given another chance.
+    """
+
+    def __init__(self, size: int = 100, max_age: float = 300.0) -> None:
+        self.size = size
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        # (timestamp, latency, ok)
+        self.samples: deque[tuple[float, float, bool]] = deque(maxlen=size)
+
+    def add(self, latency: float, ok: bool = True) -> None:
+        with self.lock:
+            self.samples.append((time.monotonic(), latency, ok))
+
+    def _recent(self) -> list[tuple[float, float, bool]]:
+        cutoff = time.monotonic() - self.max_age
+        while self.samples and self.samples[0][0] < cutoff:
+            self.samples.popleft()
+        return list(self.samples)
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self._recent())
+
+    @property
+    def error_rate(self) -> float:
+        """
+        Share of failed requests. 0 without samples
+        """
+        with self.lock:
+            samples = self._recent()
+        if not samples:
+            return 0.0
+        return sum(not ok for _, _, ok in samples) / len(samples)
+
+    @property
+    def mean_latency(self) -> float | None:
+        """
+        Mean latency of the successful requests. None without samples
+        """
+        latencies = self.latencies()
+        if not latencies:
+            return None
+        return sum(latencies) / len(latencies)
+
+    def latencies(self) -> list[float]:
+        with self.lock:
+            return [latency for _, latency, ok in self._recent() if ok]
+
+    def percentile(self, q: float) -> float | None:
+        """
+        Latency percentile of the successful requests, with q between 0 and 100. None without samples
+        """
+        latencies = sorted(self.latencies())
+        if not latencies:
+            return None
+        index = min(len(latencies) - 1, max(0, round(q / 100 * (len(latencies) - 1))))
+        return latencies[index]
+
+    def to_dict(self) -> dict:
+        return {
+            "samples": len(self),
+            "error_rate": self.error_rate,
+            "mean_latency": self.mean_latency,
+            "p95_latency": self.percentile(95),
+        }
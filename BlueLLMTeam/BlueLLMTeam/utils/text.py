@@ -46,6 +46,87 @@ def extract_json_from_text(text: str):
     return json_obj
 
 
+def _close_json(text: str) -> str:
+    """
+    Close the open strings, arrays and objects of truncated JSON
+
+    Text after the outermost value and commas before closing brackets are removed.
+    """
+    out: list[str] = []
+    stack: list[str] = []
+    in_string = False
+    escape = False
+    for char in text:
+        if in_string:
+            out.append(char)
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]":
+            if not stack or char != stack[-1]:
+                # Unbalanced closing bracket
+                continue
+            while out and out[-1] in " \t\r\n,":
+                out.pop()
+            stack.pop()
+            out.append(char)
+            if not stack:
+                break
+            continue
+        out.append(char)
+
+    if in_string:
+        if escape:
+            out.pop()
+        out.append('"')
+    closed = "".join(out).rstrip().rstrip(",")
+    return closed + "".join(reversed(stack))
+
+
+def repair_json(text: str, max_cuts: int = 20):
+    """
+    Load JSON that is truncated or almost valid, e.g. a response cut off by max_tokens
+
+    Markdown fences and text around the JSON are ignored, trailing commas are
+    removed and open strings, arrays and objects are closed. If that is not
+    enough, the text is cut back to the last complete item, at most max_cuts times.
+
+    :param text: String containing JSON data, possibly truncated.
+    :return: JSON object.
+    :raises ValueError: If no valid JSON can be recovered.
+    """
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+
+    starts = [index for index in (text.find("{"), text.find("[")) if index > -1]
+    if not starts:
+        raise ValueError("No opening bracket found")
+    candidate = text[min(starts):]
+
+    error = None
+    for _ in range(max_cuts + 1):
+        try:
+            return json.loads(_close_json(candidate))
+        except json.JSONDecodeError as e:
+            error = e
+        # Drop the last, incomplete item
+        cut = candidate.rfind(",")
+        if cut <= 0:
+            break
+        candidate = candidate[:cut]
+    raise ValueError(f"Invalid JSON data: {error}")
+
+
 def extract_markdown_list(markdown_text: str) -> list[str]:
     """
     Extracts a markdown list from a given string and returns it as a Python list.
@@ -1,5 +1,12 @@
+import time
+import heapq
+import asyncio
+import logging
 import threading
-from typing import Callable, Iterable, Mapping, Any
+from typing import Awaitable, Callable, Iterable, Mapping, Any
+
+
+logger = logging.getLogger(__name__)
 
 
 class ThreadWithReturnValue(threading.Thread):
@@ -14,4 +21,137 @@ class ThreadWithReturnValue(threading.Thread):
 
     def join(self, *args):
         threading.Thread.join(self, *args)
-        return self._return
\ No newline at end of file
+        return self._return
+
+
+class PriorityPool:
+    """
+    Bounded pool of threads that runs the highest priority task first
+
+    Tasks may be submitted while others are running. Tasks that have not
+    started when the deadline in seconds since the pool was created is
+    reached are skipped. Running tasks finish.
+    """
+
+    def __init__(self, max_workers: int, deadline: float = None) -> None:
+        self.max_workers = max_workers
+        self.deadline = deadline
+        self.started = time.monotonic()
+
+        self.condition = threading.Condition()
+        self.queue: list[tuple[float, int, Callable[[], Any]]] = []
+        self.count = 0
+        self.closed = False
+        self.workers: list[threading.Thread] = []
+
+    def _remaining(self) -> float | None:
+        if self.deadline is None:
+            return None
+        return self.deadline - (time.monotonic() - self.started)
+
+    def _work(self) -> None:
+        while True:
+            with self.condition:
+                while not self.queue and not self.closed:
+                    remaining = self._remaining()
+                    if remaining is not None and remaining <= 0:
+                        return
+                    self.condition.wait(remaining)
+                remaining = self._remaining()
+                if not self.queue or (remaining is not None and remaining <= 0):
+                    return
+                _, _, function = heapq.heappop(self.queue)
+            try:
+                function()
+            except Exception as e:
+                logger.warning(f"Task failed: {e}")
+
+    def submit(self, priority: float, function: Callable[[], Any]) -> None:
+        """
+        Queue a function to run, higher priority first
+        """
+        with self.condition:
+            heapq.heappush(self.queue, (-priority, self.count, function))
+            self.count += 1
+            if len(self.workers) < self.max_workers:
+                worker = threading.Thread(target=self._work, daemon=True)
+                self.workers.append(worker)
+                worker.start()
+            self.condition.notify()
+
+    def close(self) -> list[Callable[[], Any]]:
+        """
+        Wait for all tasks to finish or the deadline to pass
+
+        Returns:
+            skipped: the functions that were skipped because of the deadline
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        for worker in self.workers:
+            worker.join()
+        with self.condition:
+            skipped = [function for _, _, function in sorted(self.queue)]
+            self.queue.clear()
+        if skipped:
+            logger.warning(f"Deadline of {self.deadline}s reached, skipping {len(skipped)} of {self.count} tasks")
+        return skipped
+
+
+def run_prioritized(
+        tasks: list[tuple[float, Callable[[], Any]]],
+        max_workers: int,
+        deadline: float = None,
+    ) -> list[Callable[[], Any]]:
+    """
+    Run tasks on a bounded pool of threads, highest priority first
+
+    Arguments:
+        tasks: (priority, function) pairs
+        max_workers: number of threads
+        deadline: seconds after which tasks that have not started are skipped. No deadline if None
+
+    Returns:
+        skipped: the functions that were skipped because of the deadline
+    """
+    pool = PriorityPool(max_workers, deadline)
+    for priority, function in sorted(tasks, key=lambda task: task[0], reverse=True):
+        pool.submit(priority, function)
+    return pool.close()
+
+
+async def run_prioritized_async(
+        tasks: list[tuple[float, Callable[[], Awaitable[Any]]]],
+        max_workers: int,
+        deadline: float = None,
+    ) -> list[Callable[[], Awaitable[Any]]]:
+    """
+    Run coroutine functions as asyncio tasks, at most max_workers at a time, highest priority first
+
+    See run_prioritized
+
+    Returns:
+        skipped: the functions that were skipped because of the deadline
+    """
+    queue = sorted(tasks, key=lambda task: task[0], reverse=True)
+    started = time.monotonic()
+    position = 0
+
+    async def work():
+        nonlocal position
+        while position < len(queue):
+            if deadline is not None and time.monotonic() - started >= deadline:
+                return
+            _, function = queue[position]
+            position += 1
+            try:
+                await function()
+            except Exception as e:
+                logger.warning(f"Task failed: {e}")
+
+    await asyncio.gather(*(work() for _ in range(min(max_workers, len(queue)))))
+    skipped = [function for _, function in queue[position:]]
+    if skipped:
+        logger.warning(f"Deadline of {deadline}s reached, skipping {len(skipped)} of {len(queue)} tasks")
+    return skipped
@@ -0,0 +1,107 @@
+import os
+import json
+import math
+import logging
+import threading
+from pathlib import Path
+
+from BlueLLMTeam.utils.cache import LLM_CACHE_DIR
+
+
+logger = logging.getLogger(__name__)
+
+TOKEN_HISTORY_FILE = Path(os.getenv("TOKEN_HISTORY_FILE", LLM_CACHE_DIR.parent / "token_history.json"))
+
+
+class TokenBudget:
+    """
+    Learn how long the responses to each kind of prompt are, and size max_tokens after it
+
+    Completion lengths are kept per prompt kind and file extension of the
+    prompt target. Once enough responses have been seen, max_tokens is set to
+    a high percentile of the lengths plus some headroom. The history can be
+    saved to a JSON file so that it carries over between runs.
+
+    Arguments:
+        path: JSON file with the history. Nothing is loaded or saved if None
+        history: number of lengths to keep for each kind
+        percentile: percentile of the lengths to size max_tokens after, between 0 and 100
+        headroom: factor to multiply the percentile with
+        min_tokens: smallest max_tokens to set
+        min_samples: number of lengths to see before max_tokens is set
+    """
+
+    def __init__(
+            self,
+            path: Path = None,
+            history: int = 200,
+            percentile: float = 95.0,
+            headroom: float = 1.25,
+            min_tokens: int = 32,
+            min_samples: int = 10,
+        ) -> None:
+        self.path = None if path is None else Path(path)
+        self.history = history
+        self.percentile = percentile
+        self.headroom = headroom
+        self.min_tokens = min_tokens
+        self.min_samples = min_samples
+        self.lock = threading.Lock()
+        self.lengths: dict[str, list[int]] = {}
+        if self.path is not None and self.path.exists():
+            self.load()
+
+    @staticmethod
+    def key(prompt_dict: dict) -> str | None:
+        """
+        Group prompts by kind and the extension of their target file. None for prompts without a kind
+        """
+        kind = prompt_dict.get("kind")
+        if kind is None:
+            return None
+        extension = Path(prompt_dict.get("target") or "").suffix
+        return f"{kind}{extension}"
+
+    def record(self, prompt_dict: dict, completion_tokens: int | None) -> None:
+        """
+        Record the length of a response
+        """
+        key = self.key(prompt_dict)
+        if key is None or completion_tokens is None:
+            return
+        with self.lock:
+            lengths = self.lengths.setdefault(key, [])
+            lengths.append(int(completion_tokens))
+            del lengths[:-self.history]
+
+    def max_tokens(self, prompt_dict: dict, limit: int) -> int:
+        """
+        Get max_tokens for a prompt, at most 'limit'
+        """
+        key = self.key(prompt_dict)
+        with self.lock:
+            lengths = sorted(self.lengths.get(key, []))
+        if len(lengths) < self.min_samples:
+            return limit
+        index = min(len(lengths) - 1, math.ceil(self.percentile / 100 * len(lengths)) - 1)
+        budget = max(self.min_tokens, math.ceil(lengths[index] * self.headroom))
+        return min(limit, budget)
+
+    def load(self) -> None:
+        try:
+            lengths = json.loads(self.path.read_text())
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not load token history {self.path}: {e}")
+            return
+        with self.lock:
+            self.lengths = {key: [int(n) for n in values][-self.history:] for key, values in lengths.items()}
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        with self.lock:
+            data = json.dumps(self.lengths)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(data)
+        os.replace(tmp_path, self.path)
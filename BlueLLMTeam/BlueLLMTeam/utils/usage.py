@@ -0,0 +1,103 @@
+import json
+import time
+import threading
+from pathlib import Path
+from dataclasses import dataclass, asdict
+
+
+@dataclass
+class UsageStats:
+    calls: int = 0
+    errors: int = 0
+    retries: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    seconds: float = 0.0
+
+    def add(self, other: "UsageStats") -> None:
+        self.calls += other.calls
+        self.errors += other.errors
+        self.retries += other.retries
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.seconds += other.seconds
+
+    def to_dict(self) -> dict:
+        stats = asdict(self)
+        stats["total_tokens"] = self.prompt_tokens + self.completion_tokens
+        stats["mean_seconds"] = self.seconds / self.calls if self.calls else 0.0
+        return stats
+
+
+class UsageTracker:
+    """
+    Collect call counts, tokens, wall time and retries of LLM requests
+
+    Usage is tagged by the agent role that made the request and the kind of
+    prompt, i.e. the PromptDict function that built it.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.stats: dict[tuple[str, str], UsageStats] = {}
+
+    def record(
+            self,
+            agent: str,
+            kind: str,
+            prompt_tokens: int = 0,
+            completion_tokens: int = 0,
+            seconds: float = 0.0,
+            retries: int = 0,
+            error: bool = False,
+        ) -> None:
+        """
+        Record one LLM request
+        """
+        usage = UsageStats(
+            calls=1,
+            errors=int(error),
+            retries=retries,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            seconds=seconds,
+        )
+        with self.lock:
+            self.stats.setdefault((agent, kind), UsageStats()).add(usage)
+
+    def _group(self, index: int) -> dict[str, dict]:
+        groups: dict[str, UsageStats] = {}
+        for key, stats in self.stats.items():
+            groups.setdefault(key[index], UsageStats()).add(stats)
+        # Most expensive first
+        ordered = sorted(groups.items(), key=lambda item: item[1].seconds, reverse=True)
+        return {name: stats.to_dict() for name, stats in ordered}
+
+    def report(self) -> dict:
+        """
+        Create a report with the totals and the usage per agent, per prompt kind and per both
+        """
+        with self.lock:
+            totals = UsageStats()
+            for stats in self.stats.values():
+                totals.add(stats)
+            return {
+                "started": self.started,
+                "wall_time": time.time() - self.started,
+                "totals": totals.to_dict(),
+                "by_agent": self._group(0),
+                "by_kind": self._group(1),
+                "by_agent_and_kind": [
+                    {"agent": agent, "kind": kind, **stats.to_dict()}
+                    for (agent, kind), stats in sorted(self.stats.items(), key=lambda item: item[1].seconds, reverse=True)
+                ],
+            }
+
+    def write_report(self, path: Path, **sections) -> None:
+        """
+        Write the report as JSON, with any extra sections added at the top level
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps({**self.report(), **sections}, indent=4))
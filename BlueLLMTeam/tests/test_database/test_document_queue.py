@@ -0,0 +1,83 @@
+import json
+import pytest
+from types import SimpleNamespace
+
+for module in ("requests", "pandas", "dotenv", "tqdm"):
+    pytest.importorskip(module)
+
+from BlueLLMTeam.database import db_interaction
+from BlueLLMTeam.database.db_interaction import DocumentQueue
+
+@pytest.fixture
+def sent(monkeypatch):
+    """
+    Batches sent to the database. Set sent.ok to False to make the requests fail
+    """
+    state = SimpleNamespace(batches=[], ok=True)
+
+    def send_payload(payload, destination, endpoint):
+        assert endpoint == "insertMany"
+        if state.ok:
+            state.batches.append(payload["documents"])
+        return SimpleNamespace(ok=state.ok, text="")
+
+    monkeypatch.setattr(db_interaction, "COLLECTION_URL_PROMPT", "http://localhost/action/")
+    monkeypatch.setattr(db_interaction, "send_payload", send_payload)
+    return state
+
+def make_queue(tmp_path, **kwargs):
+    return DocumentQueue("PromptLog", flush_interval=0.05, spill_file=tmp_path / "spill.jsonl", **kwargs)
+
+def read_spill(queue):
+    return [json.loads(line) for line in queue.spill_file.read_text().splitlines()]
+
+def test_documents_are_sent_in_batches(tmp_path, sent):
+    queue = make_queue(tmp_path, batch_size=3)
+    for i in range(7):
+        assert queue.put({"i": i})
+    queue.close()
+    assert [document["i"] for batch in sent.batches for document in batch] == list(range(7))
+    assert max(len(batch) for batch in sent.batches) <= 3
+    assert not queue.spill_file.exists()
+
+def test_unconfigured_destination_drops_documents(tmp_path, monkeypatch):
+    monkeypatch.setattr(db_interaction, "COLLECTION_URL_PROMPT", None)
+    queue = make_queue(tmp_path)
+    assert not queue.put({"i": 0})
+    assert not queue.send([{"i": 1}])
+    queue.close()
+    assert queue.thread is None
+    assert not queue.spill_file.exists()
+
+def test_failed_batches_are_spilled_and_sent_later(tmp_path, sent):
+    sent.ok = False
+    queue = make_queue(tmp_path)
+    assert not queue.send([{"i": 0}, {"i": 1}])
+    assert read_spill(queue) == [{"i": 0}, {"i": 1}]
+
+    sent.ok = True
+    make_queue(tmp_path).send_spilled()
+    assert sent.batches == [[{"i": 0}, {"i": 1}]]
+    assert not queue.spill_file.exists()
+
+def test_spilled_documents_are_kept_when_sending_fails_again(tmp_path, sent):
+    queue = make_queue(tmp_path)
+    queue.spill([{"i": 0}, {"i": 1}])
+    sent.ok = False
+    queue.send_spilled()
+    # Kept once, not duplicated
+    assert read_spill(queue) == [{"i": 0}, {"i": 1}]
+
+def test_corrupt_spill_lines_are_skipped(tmp_path, sent):
+    queue = make_queue(tmp_path)
+    queue.spill_file.write_text('{"i": 0}\n{"i": \n{"i": 2}\n{"i": 3')
+    queue.send_spilled()
+    assert sent.batches == [[{"i": 0}, {"i": 2}]]
+    assert not queue.spill_file.exists()
+
+def test_spill_file_is_capped(tmp_path, sent):
+    line = len(json.dumps({"i": 0}) + "\n")
+    queue = make_queue(tmp_path, max_spill_bytes=3 * line)
+    queue.spill([{"i": i} for i in range(5)])
+    queue.spill([{"i": 5}])
+    assert read_spill(queue) == [{"i": 0}, {"i": 1}, {"i": 2}]
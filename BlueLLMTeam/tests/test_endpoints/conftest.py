@@ -0,0 +1,4 @@
+import os
+
+# The OpenAI client is created when BlueLLMTeam.LLMEndpoint is imported. No request is ever sent
+os.environ.setdefault("GPT_KEY", "test")
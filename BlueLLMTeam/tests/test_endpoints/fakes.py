@@ -0,0 +1,115 @@
+"""
+Stand-ins for the OpenAI client and simple endpoints used by the endpoint tests
+"""
+import time
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import httpx
+import openai
+
+from BlueLLMTeam.LLMEndpoint import LLMEndpointBase, set_last_usage
+
+
+def api_error(cls: type, status: int, code: str = None) -> openai.APIStatusError:
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(status, request=request)
+    return cls(f"Error {status}", response=response, body={"code": code} if code else None)
+
+
+def connection_error() -> openai.APIConnectionError:
+    return openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+
+
+def completion(content: str, finish_reason: str = "stop", completion_tokens: int = 5) -> SimpleNamespace:
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content), finish_reason=finish_reason)],
+        usage=SimpleNamespace(prompt_tokens=10, completion_tokens=completion_tokens, total_tokens=10 + completion_tokens),
+    )
+
+
+class FakeOpenAI:
+    """
+    Client with the chat.completions.with_raw_response.create method of OpenAI
+
+    Every call takes the next outcome: a completion is returned, an exception raised.
+    """
+
+    def __init__(self, *outcomes) -> None:
+        self.outcomes = list(outcomes)
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(with_raw_response=self))
+
+    def create(self, **request):
+        self.requests.append(request)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return SimpleNamespace(headers={}, parse=lambda: outcome)
+
+
+class AsyncFakeOpenAI(FakeOpenAI):
+    """
+    FakeOpenAI for AsyncOpenAI. A number as outcome is slept before the next outcome
+    """
+
+    async def create(self, **request):
+        self.requests.append(request)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, (int, float)):
+            await asyncio.sleep(outcome)
+            outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return SimpleNamespace(headers={}, parse=lambda: outcome)
+
+
+class ScriptedEndpoint(LLMEndpointBase):
+    """
+    Endpoint that answers after a delay, or fails, and counts its calls
+
+    Arguments:
+        response: text of the answer, or a function of the prompt
+        delay: seconds before answering
+        error: exception to raise instead of answering
+        completion_tokens: reported usage, None to report nothing
+        finish_reason: reported finish reason
+    """
+
+    def __init__(self, response="ok", delay: float = 0.0, error: Exception = None, completion_tokens: int = None, finish_reason: str = "stop") -> None:
+        super().__init__()
+        self.response = response
+        self.delay = delay
+        self.error = error
+        self.completion_tokens = completion_tokens
+        self.finish_reason = finish_reason
+        self.prompts = []
+        self.lock = threading.Lock()
+
+    @property
+    def calls(self) -> int:
+        return len(self.prompts)
+
+    def ask(self, prompt_dict: dict[str, str], **kwargs) -> str:
+        with self.lock:
+            self.prompts.append(prompt_dict)
+        if self.delay:
+            time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        if self.completion_tokens is not None:
+            set_last_usage(prompt_tokens=10, completion_tokens=self.completion_tokens, finish_reason=self.finish_reason)
+        return self.response(prompt_dict) if callable(self.response) else self.response
+
+
+def make_prompt(message: str = "ls -la", **extra) -> dict[str, str]:
+    return {
+        "systemRole": "You are a Linux server",
+        "user": "attacker",
+        "context": "",
+        "message": message,
+        "model": "gpt-3.5-turbo-0125",
+        "max_tokens": 512,
+        **extra,
+    }
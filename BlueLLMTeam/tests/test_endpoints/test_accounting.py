@@ -0,0 +1,63 @@
+import json
+import asyncio
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("ollama")
+
+from BlueLLMTeam.LLMEndpoint import AccountingEndpoint, AsyncAccountingEndpoint, AsyncEchoEndpoint, TaggedEndpoint
+from BlueLLMTeam.utils.ratelimit import estimate_tokens
+from BlueLLMTeam.utils.usage import UsageTracker
+from tests.test_endpoints.fakes import ScriptedEndpoint, make_prompt
+
+def test_reported_usage_is_recorded_by_agent_and_kind():
+    tracker = UsageTracker()
+    backend = ScriptedEndpoint(completion_tokens=20)
+    designer = TaggedEndpoint(AccountingEndpoint(backend, tracker), agent="Command Designer")
+    analyst = TaggedEndpoint(AccountingEndpoint(backend, tracker), agent="Analyst")
+    designer.ask(make_prompt(kind="linux_command_response"))
+    designer.ask(make_prompt(kind="linux_command_response"))
+    analyst.ask(make_prompt(kind="analyse_logs"))
+
+    report = tracker.report()
+    assert report["totals"]["calls"] == 3
+    assert report["totals"]["total_tokens"] == 3 * (10 + 20)
+    assert report["by_agent"]["Command Designer"]["calls"] == 2
+    assert report["by_kind"]["analyse_logs"]["completion_tokens"] == 20
+    assert {(row["agent"], row["kind"]) for row in report["by_agent_and_kind"]} == {
+        ("Command Designer", "linux_command_response"),
+        ("Analyst", "analyse_logs"),
+    }
+
+def test_missing_usage_is_estimated():
+    tracker = UsageTracker()
+    prompt = make_prompt("cat /etc/passwd")
+    AccountingEndpoint(ScriptedEndpoint(response="x" * 400), tracker).ask(prompt)
+    totals = tracker.report()["totals"]
+    assert totals["prompt_tokens"] == estimate_tokens(prompt)
+    assert totals["completion_tokens"] == 100
+
+def test_failed_requests_are_counted():
+    tracker = UsageTracker()
+    llm_endpoint = AccountingEndpoint(ScriptedEndpoint(delay=0.05, error=RuntimeError("down")), tracker)
+    with pytest.raises(RuntimeError):
+        llm_endpoint.ask(make_prompt(kind="file_system_creator"))
+    stats = tracker.report()["by_kind"]["file_system_creator"]
+    assert stats["calls"] == 1 and stats["errors"] == 1
+    assert stats["total_tokens"] == 0
+    assert stats["seconds"] >= 0.05
+
+def test_async_usage_goes_to_the_same_tracker():
+    tracker = UsageTracker()
+    AccountingEndpoint(ScriptedEndpoint(completion_tokens=20), tracker).ask(make_prompt(kind="linux_command_response"))
+    asyncio.run(AsyncAccountingEndpoint(AsyncEchoEndpoint(), tracker).ask(make_prompt(kind="linux_command_response")))
+    assert tracker.report()["by_kind"]["linux_command_response"]["calls"] == 2
+
+def test_report_is_written_with_extra_sections(tmp_path):
+    tracker = UsageTracker()
+    AccountingEndpoint(ScriptedEndpoint(completion_tokens=20), tracker).ask(make_prompt())
+    path = tmp_path / "reports" / "usage.json"
+    tracker.write_report(path, semantic_cache={"hits": 1})
+    report = json.loads(path.read_text())
+    assert report["totals"]["calls"] == 1
+    assert report["semantic_cache"] == {"hits": 1}
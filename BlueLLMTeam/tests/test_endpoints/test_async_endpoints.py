@@ -0,0 +1,74 @@
+import io
+import json
+import time
+import asyncio
+import zipfile
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("ollama")
+
+from BlueLLMTeam.LLMEndpoint import AsyncLLMEndpointBase, AsyncCachedEndpoint, AsyncEchoEndpoint, CachedEndpoint
+from BlueLLMTeam.agents.designers.fs.v1 import AddContents
+from BlueLLMTeam.utils.cache import ResponseCache
+from tests.test_endpoints.fakes import ScriptedEndpoint, make_prompt
+
+class AsyncStepEndpoint(AsyncLLMEndpointBase):
+    """
+    Answers every prompt with the number of the step
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.prompts = []
+
+    async def ask(self, prompt_dict: dict[str, str]) -> str:
+        self.prompts.append(prompt_dict)
+        return f"step {len(self.prompts)}"
+
+def test_async_endpoint_shares_the_cache_with_the_blocking_one(tmp_path):
+    cache = ResponseCache(tmp_path)
+    CachedEndpoint(ScriptedEndpoint(response="cached"), cache).ask(make_prompt())
+    llm_endpoint = AsyncCachedEndpoint(AsyncEchoEndpoint(), cache)
+    assert asyncio.run(llm_endpoint.ask(make_prompt())) == "cached"
+    assert asyncio.run(llm_endpoint.ask(make_prompt("pwd"))) == "pwd"
+    assert llm_endpoint.hits == 1 and llm_endpoint.misses == 1
+
+def test_async_chain_sends_every_step():
+    llm_endpoint = AsyncStepEndpoint()
+    assert asyncio.run(AddContents.create_file_contents_async("/home/notes.txt", llm_endpoint)) == "step 2"
+    assert len(llm_endpoint.prompts) == 2
+    # The second prompt is built from the first response
+    assert "step 1" in str(llm_endpoint.prompts[1])
+
+class DocumentEndpoint(AsyncLLMEndpointBase):
+    """
+    Answers every prompt with the same document
+    """
+
+    async def ask(self, prompt_dict: dict[str, str]) -> str:
+        return json.dumps({"title": "Q3 Travel Expenses", "tables": [{"name": "Expenses", "header": ["Vendor", "Amount"], "rows": [["Air France", 412.37]]}]})
+
+def test_async_chain_returns_the_rendered_document():
+    # The chain ends in a worker thread, after the document is rendered
+    data = asyncio.run(asyncio.wait_for(AddContents.create_file_contents_async("/home/finance/expenses.xlsx", DocumentEndpoint()), 10))
+    assert "xl/workbook.xml" in zipfile.ZipFile(io.BytesIO(data)).namelist()
+
+class SlowCache(ResponseCache):
+    """
+    Cache on a slow disk
+    """
+
+    def get(self, key):
+        time.sleep(0.2)
+        return super().get(key)
+
+def test_async_cache_lookups_do_not_block_the_event_loop(tmp_path):
+    llm_endpoint = AsyncCachedEndpoint(AsyncEchoEndpoint(), SlowCache(tmp_path))
+
+    async def run():
+        return await asyncio.gather(*(llm_endpoint.ask(make_prompt(f"ls {i}")) for i in range(4)))
+
+    start = time.monotonic()
+    assert asyncio.run(run()) == [f"ls {i}" for i in range(4)]
+    assert time.monotonic() - start < 0.6
@@ -0,0 +1,105 @@
+import json
+import pytest
+from types import SimpleNamespace
+
+pytest.importorskip("openai")
+pytest.importorskip("ollama")
+
+from BlueLLMTeam import LLMBatch
+from BlueLLMTeam.LLMBatch import LocalBatchBackend, OpenAIBatchBackend, parse_results, run_batch
+from BlueLLMTeam.agents.designers.fs.v1.AddContents import run_steps_batch
+from BlueLLMTeam.utils.model_policy import ModelPolicy
+from tests.test_endpoints.fakes import ScriptedEndpoint, make_prompt
+
+def batch_prompt(message: str, **extra) -> dict[str, str]:
+    # The local backend gets the user, context and message back as one message
+    return make_prompt(message, user="", **extra)
+
+def answer(prompt_dict):
+    if prompt_dict["message"].strip() == "fail":
+        raise ValueError("no answer")
+    return prompt_dict["message"].strip().upper()
+
+def result_line(custom_id, content=None, status_code=200, error=None):
+    response = None
+    if content is not None:
+        response = {"status_code": status_code, "body": {"choices": [{"message": {"role": "assistant", "content": content}}]}}
+    return json.dumps({"custom_id": custom_id, "response": response, "error": error})
+
+class FakeBatches:
+    """
+    The files and batches APIs of the OpenAI client
+    """
+
+    def __init__(self, output: str, statuses: list[str]) -> None:
+        self.output = output
+        self.statuses = statuses
+        self.jobs = []
+        self.files = SimpleNamespace(create=self.create_file, content=lambda file_id: SimpleNamespace(text=self.output))
+        self.batches = SimpleNamespace(create=self.create_batch, retrieve=self.retrieve)
+
+    def create_file(self, file, purpose):
+        assert purpose == "batch"
+        self.jobs.append([json.loads(line) for line in file.read().decode().splitlines()])
+        return SimpleNamespace(id="file-in")
+
+    def create_batch(self, input_file_id, endpoint, completion_window):
+        assert input_file_id == "file-in"
+        return SimpleNamespace(id="batch-1")
+
+    def retrieve(self, batch_id):
+        status = self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+        return SimpleNamespace(status=status, output_file_id="file-out" if status == "completed" else None)
+
+def test_local_batch_maps_results_to_custom_ids(tmp_path):
+    backend = LocalBatchBackend(tmp_path / "batches", ScriptedEndpoint(response=answer))
+    prompts = {"a": batch_prompt("first"), "b": batch_prompt("fail"), "c": batch_prompt("third")}
+    assert run_batch(prompts, backend, tmp_path) == {"a": "FIRST", "c": "THIRD"}
+
+def test_model_policy_is_applied_to_the_job_file(tmp_path):
+    backend = LocalBatchBackend(tmp_path / "batches", ScriptedEndpoint(response=lambda prompt_dict: prompt_dict["model"]))
+    backend.model_policy = ModelPolicy({"tiers": {"fast": {"model": "small"}}, "kinds": {"csv_writer": {"tier": "fast"}}})
+    prompts = {"policy": batch_prompt("ls", kind="csv_writer"), "default": batch_prompt("ls", kind="other")}
+    assert run_batch(prompts, backend, tmp_path) == {"policy": "small", "default": "gpt-3.5-turbo-0125"}
+
+def test_parse_results_drops_failed_requests():
+    output = "\n".join([
+        result_line("ok", "answer"),
+        result_line("error", error={"message": "rate limited"}),
+        result_line("status", "ignored", status_code=500),
+        '{"custom_id": "broken", "response": {"status_code": 200, "body": {"choices": []}}}',
+        "not json",
+        "",
+    ])
+    assert parse_results(output) == {"ok": "answer"}
+
+def test_openai_batch_is_polled_until_completed(tmp_path, monkeypatch):
+    fake = FakeBatches(result_line("b", "second") + "\n" + result_line("a", "first"), ["validating", "in_progress", "completed"])
+    monkeypatch.setattr(LLMBatch, "client", fake)
+    prompts = {"a": batch_prompt("first"), "b": batch_prompt("second")}
+    assert run_batch(prompts, OpenAIBatchBackend(), tmp_path, poll_interval=0) == {"a": "first", "b": "second"}
+    [job] = fake.jobs
+    assert [(request["custom_id"], request["body"]["messages"][1]["content"].strip()) for request in job] == [("a", "first"), ("b", "second")]
+    assert all(request["url"] == "/v1/chat/completions" for request in job)
+
+@pytest.mark.parametrize("status", ["failed", "expired", "cancelled"])
+def test_failed_openai_batch_has_no_results(tmp_path, monkeypatch, status):
+    monkeypatch.setattr(LLMBatch, "client", FakeBatches(result_line("a", "first"), [status]))
+    assert run_batch({"a": batch_prompt("first")}, OpenAIBatchBackend(), tmp_path, poll_interval=0) == {}
+
+def test_chains_advance_one_step_per_batch(tmp_path):
+    def chain(name):
+        first = yield batch_prompt(f"{name} step one")
+        second = yield batch_prompt(f"{name} step two")
+        return f"{first} / {second}"
+
+    def broken():
+        yield batch_prompt("fail")
+        return "never"
+
+    endpoint = ScriptedEndpoint(response=answer)
+    backend = LocalBatchBackend(tmp_path / "batches", endpoint)
+    results = run_steps_batch({"x": chain("x"), "y": chain("y"), "z": broken()}, backend, tmp_path)
+    assert results == {"x": "X STEP ONE / X STEP TWO", "y": "Y STEP ONE / Y STEP TWO"}
+    # Two rounds: all first steps, then all second steps
+    assert [prompt_dict["message"].strip() for prompt_dict in endpoint.prompts] == ["x step one", "y step one", "fail", "x step two", "y step two"]
@@ -0,0 +1,170 @@
+import asyncio
+import threading
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("ollama")
+pytest.importorskip("docker")
+
+from BlueLLMTeam import main
+from BlueLLMTeam.main import Arguments, build_llm_endpoint, build_async_llm_endpoint
+from BlueLLMTeam.LLMEndpoint import LLMEndpointBase, AsyncLLMEndpointBase, CachedEndpoint, CassetteMissError, set_last_usage
+from BlueLLMTeam.utils.cache import ResponseCache
+from BlueLLMTeam.utils.token_budget import TokenBudget
+from BlueLLMTeam.utils.usage import UsageTracker
+from tests.test_endpoints.fakes import make_prompt
+
+DEFAULTS = {
+    "context_file": None,
+    "verbosity": 0,
+    "frequency": 1.0,
+    "yes": True,
+    "light_weight": False,
+    "max_honeypots": -1,
+    "logfile": None,
+    "analyst_on": False,
+    "cache": False,
+    "refresh_cache": False,
+    "async_llm": False,
+    "batch": None,
+    "record": None,
+    "replay": None,
+    "replay_latency": 0.0,
+    "replay_fallback": False,
+    "usage_report": None,
+    "ollama_host": None,
+    "ollama_model": None,
+    "hedge": None,
+    "hedge_budget": 0.1,
+    "model_policy": None,
+    "adaptive_tokens": True,
+    "token_history": None,
+    "semantic_cache": None,
+    "multi_file": False,
+    "content_workers": 4,
+    "content_deadline": 0.0,
+    "pipeline": False,
+}
+
+def make_args(**overrides) -> Arguments:
+    return Arguments(**{**DEFAULTS, **overrides})
+
+class TruncatingEndpoint(LLMEndpointBase):
+    """
+    Cuts off responses with a max_tokens below 100, like ChatGPT does for long answers
+    """
+
+    def __init__(self, delay: float = 0.0) -> None:
+        self.delay = delay
+        self.max_tokens = []
+        self.lock = threading.Lock()
+
+    def ask(self, prompt_dict):
+        with self.lock:
+            self.max_tokens.append(prompt_dict["max_tokens"])
+        threading.Event().wait(self.delay)
+        if prompt_dict["max_tokens"] < 100:
+            set_last_usage(prompt_tokens=10, completion_tokens=prompt_dict["max_tokens"], finish_reason="length")
+            return "cut"
+        set_last_usage(prompt_tokens=10, completion_tokens=80, finish_reason="stop")
+        return "full answer"
+
+class AsyncTruncatingEndpoint(AsyncLLMEndpointBase):
+    """
+    Asyncio version of TruncatingEndpoint
+    """
+
+    def __init__(self) -> None:
+        self.sync = TruncatingEndpoint()
+        self.max_tokens = self.sync.max_tokens
+
+    async def ask(self, prompt_dict):
+        return self.sync.ask(prompt_dict)
+
+def trained_budget(length: int) -> TokenBudget:
+    budget = TokenBudget(min_samples=1)
+    for _ in range(10):
+        budget.record(make_prompt(kind="linux_command_response"), length)
+    return budget
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = TruncatingEndpoint()
+    monkeypatch.setattr(main, "ChatGPTEndpoint", lambda: backend)
+    monkeypatch.setattr(main, "AsyncChatGPTEndpoint", AsyncTruncatingEndpoint)
+    monkeypatch.setattr(main, "token_budget", trained_budget(20))
+    monkeypatch.setattr(main, "usage_tracker", UsageTracker())
+    return backend
+
+def test_replay_after_the_budget_changed(tmp_path, backend, monkeypatch):
+    cassette = tmp_path / "run.jsonl"
+    prompt = make_prompt(kind="linux_command_response")
+    assert build_llm_endpoint(make_args(record=cassette)).ask(prompt) == "full answer"
+    assert backend.max_tokens == [32, 512]
+
+    monkeypatch.setattr(main, "token_budget", trained_budget(300))
+    assert build_llm_endpoint(make_args(replay=cassette)).ask(prompt) == "full answer"
+
+def test_replay_misses_go_to_chatgpt_with_the_fallback(tmp_path, backend):
+    cassette = tmp_path / "run.jsonl"
+    prompt = make_prompt(kind="linux_command_response")
+    with pytest.raises(CassetteMissError):
+        build_llm_endpoint(make_args(replay=cassette)).ask(prompt)
+    assert build_llm_endpoint(make_args(replay=cassette, replay_fallback=True)).ask(prompt) == "full answer"
+    assert asyncio.run(build_async(make_args(replay=cassette, replay_fallback=True, async_llm=True)).ask(prompt)) == "full answer"
+
+def test_cut_off_tokens_are_accounted(backend):
+    build_llm_endpoint(make_args()).ask(make_prompt(kind="linux_command_response"))
+    totals = main.usage_tracker.report()["totals"]
+    assert totals["calls"] == 1
+    assert totals["completion_tokens"] == 32 + 80
+    assert totals["retries"] == 1
+
+def test_shared_requests_get_the_complete_response(backend):
+    backend.delay = 0.1
+    llm_endpoint = build_llm_endpoint(make_args())
+    prompt = make_prompt(kind="linux_command_response")
+    responses = []
+    threads = [threading.Thread(target=lambda: responses.append(llm_endpoint.ask(prompt))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert responses == ["full answer"] * 4
+    assert backend.max_tokens == [32, 512]
+
+def build_async(args):
+    return build_async_llm_endpoint(args, build_llm_endpoint(args))
+
+def test_async_endpoint_records_and_replays_with_the_blocking_one(tmp_path, backend, monkeypatch):
+    cassette = tmp_path / "run.jsonl"
+    prompt = make_prompt(kind="linux_command_response")
+    args = make_args(record=cassette, async_llm=True)
+    llm_endpoint = build_llm_endpoint(args)
+    async_llm_endpoint = build_async_llm_endpoint(args, llm_endpoint)
+    assert asyncio.run(async_llm_endpoint.ask(prompt)) == "full answer"
+    assert llm_endpoint.ask(make_prompt("other", kind="linux_command_response")) == "full answer"
+
+    # Both share the usage tracker and the token budget, which learned from the cut off response
+    totals = main.usage_tracker.report()["totals"]
+    assert totals["calls"] == 2
+    assert totals["completion_tokens"] == 32 + 80 + 80
+
+    monkeypatch.setattr(main, "token_budget", trained_budget(300))
+    args = make_args(replay=cassette, async_llm=True)
+    assert asyncio.run(build_async(args).ask(prompt)) == "full answer"
+    assert asyncio.run(build_async(args).ask(make_prompt("other", kind="linux_command_response"))) == "full answer"
+
+def test_async_endpoint_shares_the_cache(tmp_path, backend, monkeypatch):
+    class TemporaryCachedEndpoint(CachedEndpoint):
+        def __init__(self, llm_endpoint, refresh=False):
+            super().__init__(llm_endpoint, ResponseCache(tmp_path), refresh)
+
+    monkeypatch.setattr(main, "CachedEndpoint", TemporaryCachedEndpoint)
+    args = make_args(cache=True, async_llm=True)
+    llm_endpoint = build_llm_endpoint(args)
+    async_llm_endpoint = build_async_llm_endpoint(args, llm_endpoint)
+    prompt = make_prompt(kind="linux_command_response")
+    assert llm_endpoint.ask(prompt) == "full answer"
+    assert asyncio.run(async_llm_endpoint.ask(prompt)) == "full answer"
+    assert main.usage_tracker.report()["totals"]["calls"] == 1
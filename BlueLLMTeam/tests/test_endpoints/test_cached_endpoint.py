@@ -0,0 +1,42 @@
+import asyncio
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("ollama")
+
+from BlueLLMTeam.LLMEndpoint import CachedEndpoint, RefreshEndpoint, AsyncCachedEndpoint, AsyncRefreshEndpoint, AsyncEchoEndpoint
+from BlueLLMTeam.agents.leader import TeamLeaderRole
+from BlueLLMTeam.utils.cache import ResponseCache
+from tests.test_endpoints.fakes import ScriptedEndpoint, make_prompt
+
+CONTEXT = {"Organization": "Acme"}
+
+def test_invalid_cached_response_is_asked_again(tmp_path):
+    cache = ResponseCache(tmp_path)
+    invalid = ScriptedEndpoint(response="I can not answer that")
+    assert TeamLeaderRole(CachedEndpoint(invalid, cache)).honeypot_amount(CONTEXT, retries=2) == {}
+    assert invalid.calls == 2
+
+    # The next run does not get stuck on the cached response
+    valid = ScriptedEndpoint(response="- cowrie: 3")
+    assert TeamLeaderRole(CachedEndpoint(valid, cache)).honeypot_amount(CONTEXT, retries=2) == {"cowrie": 3}
+    assert valid.calls == 1
+    # Which was replaced by the valid one
+    unused = ScriptedEndpoint(response="unused")
+    assert TeamLeaderRole(CachedEndpoint(unused, cache)).honeypot_amount(CONTEXT) == {"cowrie": 3}
+    assert unused.calls == 0
+
+def test_refreshed_prompts_replace_the_cached_response(tmp_path):
+    responses = iter(["first", "second"])
+    llm_endpoint = CachedEndpoint(ScriptedEndpoint(response=lambda prompt_dict: next(responses)), ResponseCache(tmp_path))
+    assert llm_endpoint.ask(make_prompt()) == "first"
+    assert RefreshEndpoint(llm_endpoint).ask(make_prompt()) == "second"
+    assert llm_endpoint.ask(make_prompt()) == "second"
+    assert llm_endpoint.hits == 1 and llm_endpoint.misses == 2
+
+def test_async_refreshed_prompts_replace_the_cached_response(tmp_path):
+    cache = ResponseCache(tmp_path)
+    CachedEndpoint(ScriptedEndpoint(response="cached"), cache).ask(make_prompt())
+    llm_endpoint = AsyncCachedEndpoint(AsyncEchoEndpoint(), cache)
+    assert asyncio.run(AsyncRefreshEndpoint(llm_endpoint).ask(make_prompt())) == "ls -la"
+    assert asyncio.run(llm_endpoint.ask(make_prompt())) == "ls -la"
@@ -0,0 +1,94 @@
+import time
+import asyncio
+import importlib
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("ollama")
+
+from BlueLLMTeam.LLMEndpoint import RecordingEndpoint, ReplayEndpoint, AsyncRecordingEndpoint, AsyncReplayEndpoint, AsyncEchoEndpoint, last_usage
+from BlueLLMTeam.agents import leader
+from BlueLLMTeam.utils.cassette import Cassette, CassetteMissError
+from tests.test_endpoints.fakes import ScriptedEndpoint, make_prompt
+
+def record(cassette, backend, prompts):
+    recorder = RecordingEndpoint(backend, cassette)
+    return [recorder.ask(prompt_dict) for prompt_dict in prompts]
+
+def test_recorded_run_is_replayed_from_the_file(tmp_path):
+    path = tmp_path / "run.jsonl"
+    backend = ScriptedEndpoint(response=lambda prompt_dict: f"response to {prompt_dict['message']}", completion_tokens=7)
+    recorded = record(path, backend, [make_prompt("ls"), make_prompt("pwd")])
+
+    replay = ReplayEndpoint(path)
+    assert len(replay.cassette) == 2
+    assert [replay.ask(make_prompt("pwd")), replay.ask(make_prompt("ls"))] == recorded[::-1]
+    assert last_usage()["completion_tokens"] == 7
+    assert last_usage()["prompt_tokens"] == 10
+
+def test_repeated_prompts_are_replayed_in_order(tmp_path):
+    path = tmp_path / "run.jsonl"
+    responses = iter(["first", "second"])
+    record(path, ScriptedEndpoint(response=lambda prompt_dict: next(responses)), [make_prompt("ls")] * 2)
+
+    replay = ReplayEndpoint(path)
+    assert [replay.ask(make_prompt("ls")) for _ in range(3)] == ["first", "second", "first"]
+
+def test_prompts_are_matched_by_the_fields_that_decide_the_response(tmp_path):
+    path = tmp_path / "run.jsonl"
+    record(path, ScriptedEndpoint(response="recorded"), [make_prompt("ls", agent="Analyst")])
+
+    replay = ReplayEndpoint(path)
+    # The agent tag does not change the response
+    assert replay.ask(make_prompt("ls", agent="Command Designer")) == "recorded"
+    with pytest.raises(CassetteMissError):
+        replay.ask(make_prompt("ls", max_tokens=64))
+
+def test_missing_prompts_go_to_the_fallback(tmp_path):
+    path = tmp_path / "run.jsonl"
+    record(path, ScriptedEndpoint(response="recorded"), [make_prompt("ls")])
+    fallback = ScriptedEndpoint(response="live")
+
+    replay = ReplayEndpoint(path, fallback=fallback)
+    assert replay.ask(make_prompt("ls")) == "recorded"
+    assert replay.ask(make_prompt("whoami")) == "live"
+    assert fallback.calls == 1
+
+def test_team_leader_prompts_are_replayed_after_a_reload(tmp_path):
+    path = tmp_path / "run.jsonl"
+    team_lead = leader.TeamLeaderRole(RecordingEndpoint(ScriptedEndpoint(response="- cowrie: 3"), path))
+    assert team_lead.honeypot_amount({"Organization": "Acme"}) == {"cowrie": 3}
+
+    # The prompt templates are built again, as in a new run
+    importlib.reload(leader)
+    team_lead = leader.TeamLeaderRole(ReplayEndpoint(path))
+    assert team_lead.honeypot_amount({"Organization": "Acme"}) == {"cowrie": 3}
+
+def test_bad_lines_are_skipped(tmp_path):
+    path = tmp_path / "run.jsonl"
+    record(path, ScriptedEndpoint(response="recorded"), [make_prompt("ls")])
+    with open(path, "a") as f:
+        f.write('{"key": \n{"no key": 1}\n')
+
+    assert len(Cassette(path)) == 1
+    assert ReplayEndpoint(path).ask(make_prompt("ls")) == "recorded"
+
+def test_recorded_latency_is_simulated(tmp_path):
+    path = tmp_path / "run.jsonl"
+    record(path, ScriptedEndpoint(delay=0.1), [make_prompt("ls")])
+
+    start = time.monotonic()
+    ReplayEndpoint(path).ask(make_prompt("ls"))
+    assert time.monotonic() - start < 0.05
+    start = time.monotonic()
+    ReplayEndpoint(path, latency_scale=0.5).ask(make_prompt("ls"))
+    assert time.monotonic() - start >= 0.05
+
+def test_async_endpoints_share_the_cassette(tmp_path):
+    cassette = Cassette(tmp_path / "run.jsonl")
+    record(cassette, ScriptedEndpoint(response="blocking"), [make_prompt("ls")])
+    asyncio.run(AsyncRecordingEndpoint(AsyncEchoEndpoint(), cassette).ask(make_prompt("pwd")))
+
+    replay = AsyncReplayEndpoint(tmp_path / "run.jsonl")
+    assert asyncio.run(replay.ask(make_prompt("pwd"))) == "pwd"
+    assert asyncio.run(replay.ask(make_prompt("ls"))) == "blocking"
@@ -0,0 +1,87 @@
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("ollama")
+
+import asyncio
+import openai
+
+from BlueLLMTeam.LLMEndpoint import ChatGPTEndpoint, AsyncChatGPTEndpoint, last_usage
+from BlueLLMTeam.utils.ratelimit import RateLimiter
+from BlueLLMTeam.utils.retry import RetryPolicy, CircuitBreaker, CircuitOpenError
+from tests.test_endpoints.fakes import FakeOpenAI, AsyncFakeOpenAI, api_error, connection_error, completion, make_prompt
+
+def make_endpoint(client, max_retries=0, failure_threshold=2, reset_timeout=60):
+    endpoint = ChatGPTEndpoint(
+        rate_limiter=RateLimiter(requests_per_minute=1000, tokens_per_minute=10 ** 6, max_concurrency=4, default_cooldown=0.0),
+        retry_policy=RetryPolicy(max_retries=max_retries, base_delay=0.0, max_delay=0.0),
+        circuit_breaker=CircuitBreaker("test", failure_threshold=failure_threshold, reset_timeout=reset_timeout),
+    )
+    endpoint.client = client
+    return endpoint
+
+def test_retries_and_reports_usage():
+    client = FakeOpenAI(connection_error(), completion("total 0"))
+    endpoint = make_endpoint(client, max_retries=1)
+    assert endpoint.ask(make_prompt()) == "total 0"
+    assert last_usage()["retries"] == 1
+    assert last_usage()["completion_tokens"] == 5
+
+def test_bad_requests_do_not_open_the_circuit():
+    client = FakeOpenAI(*[api_error(openai.BadRequestError, 400) for _ in range(5)])
+    endpoint = make_endpoint(client)
+    for _ in range(5):
+        with pytest.raises(openai.BadRequestError):
+            endpoint.ask(make_prompt())
+    assert not endpoint.circuit_breaker.is_open
+
+def test_backend_failures_open_the_circuit():
+    client = FakeOpenAI(*[api_error(openai.InternalServerError, 500) for _ in range(2)])
+    endpoint = make_endpoint(client)
+    for _ in range(2):
+        with pytest.raises(openai.InternalServerError):
+            endpoint.ask(make_prompt())
+    assert endpoint.circuit_breaker.is_open
+    with pytest.raises(CircuitOpenError):
+        endpoint.ask(make_prompt())
+    assert len(client.requests) == 2
+
+def test_rate_limited_probe_is_released():
+    client = FakeOpenAI(api_error(openai.RateLimitError, 429), completion("ok"))
+    endpoint = make_endpoint(client, reset_timeout=0.0)
+    endpoint.circuit_breaker.trip()
+    with pytest.raises(openai.RateLimitError):
+        endpoint.ask(make_prompt())
+    assert not endpoint.circuit_breaker.is_open
+    assert endpoint.ask(make_prompt()) == "ok"
+    assert endpoint.circuit_breaker.state == CircuitBreaker.CLOSED
+
+def test_exhausted_quota_opens_the_circuit():
+    client = FakeOpenAI(api_error(openai.RateLimitError, 429, code="insufficient_quota"))
+    endpoint = make_endpoint(client, max_retries=3)
+    with pytest.raises(openai.RateLimitError):
+        endpoint.ask(make_prompt())
+    assert endpoint.circuit_breaker.is_open
+    assert len(client.requests) == 1
+
+def test_cancelled_async_probe_is_released():
+    endpoint = AsyncChatGPTEndpoint(
+        retry_policy=RetryPolicy(max_retries=0),
+        circuit_breaker=CircuitBreaker("test", failure_threshold=1, reset_timeout=0.0),
+    )
+
+    async def run():
+        endpoint._connect()
+        endpoint.client = AsyncFakeOpenAI(10.0, completion("late"), completion("ok"))
+        endpoint.circuit_breaker.trip()
+        probe = asyncio.create_task(endpoint.ask(make_prompt()))
+        await asyncio.sleep(0.05)
+        assert endpoint.circuit_breaker.is_open
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        assert not endpoint.circuit_breaker.is_open
+        endpoint.client.outcomes.pop(0)
+        return await endpoint.ask(make_prompt())
+
+    assert asyncio.run(run()) == "ok"
@@ -0,0 +1,68 @@
+import time
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("ollama")
+
+from BlueLLMTeam.LLMEndpoint import HedgedEndpoint, last_usage
+from tests.test_endpoints.fakes import ScriptedEndpoint, make_prompt
+
+def hedged(primary, hedge=None, latency=0.02, samples=20, **kwargs) -> HedgedEndpoint:
+    """
+    A hedged endpoint that has seen 'samples' requests of 'latency' seconds
+    """
+    llm_endpoint = HedgedEndpoint(primary, hedge, percentile=95, min_samples=20, **kwargs)
+    for _ in range(samples):
+        llm_endpoint.stats.add(latency)
+    return llm_endpoint
+
+def test_slow_request_is_answered_by_the_hedge():
+    primary = ScriptedEndpoint(response="primary", delay=0.5, completion_tokens=50)
+    hedge = ScriptedEndpoint(response="hedge", completion_tokens=5)
+    llm_endpoint = hedged(primary, hedge)
+
+    start = time.monotonic()
+    assert llm_endpoint.ask(make_prompt()) == "hedge"
+    assert time.monotonic() - start < 0.3
+    # The usage of the request that answered is reported
+    assert last_usage()["completion_tokens"] == 5
+    assert llm_endpoint.hedges == 1 and llm_endpoint.hedge_wins == 1
+
+def test_hedge_that_has_not_started_is_cancelled():
+    primary = ScriptedEndpoint(response="primary", delay=0.1)
+    hedge = ScriptedEndpoint(response="hedge")
+    # A single worker is busy with the primary, the hedge waits in the queue
+    llm_endpoint = hedged(primary, hedge, max_workers=1)
+    assert llm_endpoint.ask(make_prompt()) == "primary"
+    llm_endpoint.executor.shutdown(wait=True)
+    assert llm_endpoint.hedges == 1
+    assert hedge.calls == 0
+
+def test_no_hedging_before_enough_samples():
+    primary = ScriptedEndpoint(response="primary", delay=0.1)
+    hedge = ScriptedEndpoint(response="hedge")
+    llm_endpoint = hedged(primary, hedge, samples=5)
+    assert llm_endpoint.ask(make_prompt()) == "primary"
+    assert hedge.calls == 0
+
+def test_hedges_are_capped_by_the_budget():
+    primary = ScriptedEndpoint(response="primary", delay=0.1)
+    hedge = ScriptedEndpoint(response="hedge", delay=0.1)
+    # Enough fast samples that the slow requests do not move the percentile
+    llm_endpoint = hedged(primary, hedge, samples=400, budget=0.25)
+    for _ in range(8):
+        llm_endpoint.ask(make_prompt())
+    assert llm_endpoint.hedges == 2
+    assert hedge.calls == 2
+
+def test_failed_primary_is_answered_by_the_hedge():
+    primary = ScriptedEndpoint(delay=0.1, error=RuntimeError("down"))
+    hedge = ScriptedEndpoint(response="hedge", delay=0.05)
+    llm_endpoint = hedged(primary, hedge)
+    assert llm_endpoint.ask(make_prompt()) == "hedge"
+
+def test_error_is_raised_when_both_fail():
+    primary = ScriptedEndpoint(delay=0.1, error=RuntimeError("primary down"))
+    hedge = ScriptedEndpoint(error=RuntimeError("hedge down"))
+    with pytest.raises(RuntimeError):
+        hedged(primary, hedge).ask(make_prompt())
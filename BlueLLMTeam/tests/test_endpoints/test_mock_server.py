@@ -0,0 +1,112 @@
+import json
+import random
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("ollama")
+pytest.importorskip("aiohttp")
+
+import asyncio
+from aiohttp.test_utils import TestClient, TestServer
+
+from BlueLLMTeam.mock_server import MockLLMServer, MockProfile
+from BlueLLMTeam.LLMEndpoint import AsyncChatGPTEndpoint, last_usage
+from BlueLLMTeam.utils.ratelimit import RateLimiter
+from BlueLLMTeam.utils.retry import RetryPolicy, CircuitBreaker
+from tests.test_endpoints.fakes import make_prompt
+
+FAST = {"latency": "fixed", "latency_mean": 0.0, "tokens_per_second": 10 ** 6}
+
+def serve(profile: MockProfile, test):
+    """
+    Run test(client, server) against a mock server on a free local port
+    """
+    server = MockLLMServer(profile, seed=1)
+
+    async def run():
+        async with TestClient(TestServer(server.app)) as client:
+            return await test(client, server)
+
+    return asyncio.run(run())
+
+def chat_body(**extra):
+    return {"model": "gpt-3.5-turbo-0125", "messages": [{"role": "user", "content": "ls -la"}], **extra}
+
+def test_openai_completion_is_cut_at_max_tokens():
+    async def test(client, server):
+        response = await client.post("/v1/chat/completions", json=chat_body(max_tokens=5))
+        assert response.status == 200
+        return await response.json()
+
+    body = serve(MockProfile(completion_tokens=20, **FAST), test)
+    assert body["usage"]["completion_tokens"] == 5
+    assert len(body["choices"][0]["message"]["content"].split()) == 5
+    assert body["choices"][0]["finish_reason"] == "length"
+
+def test_openai_stream_ends_with_done():
+    async def test(client, server):
+        response = await client.post("/v1/chat/completions", json=chat_body(stream=True))
+        return (await response.text()).split("\n\n")
+
+    events = [event for event in serve(MockProfile(completion_tokens=3, **FAST), test) if event]
+    assert events[-1] == "data: [DONE]"
+    chunks = [json.loads(event[len("data: "):]) for event in events[:-1]]
+    assert len(chunks) == 3
+    assert chunks[-1]["choices"][0]["finish_reason"] == "stop"
+
+def test_requests_over_the_limit_are_rate_limited():
+    async def test(client, server):
+        statuses = []
+        for _ in range(3):
+            response = await client.post("/v1/chat/completions", json=chat_body())
+            statuses.append(response.status)
+        stats = await (await client.get("/stats")).json()
+        return statuses, response.headers, stats
+
+    statuses, headers, stats = serve(MockProfile(requests_per_minute=2, **FAST), test)
+    assert statuses == [200, 200, 429]
+    assert float(headers["retry-after"]) > 0
+    assert headers["x-ratelimit-remaining-requests"] == "0"
+    assert stats["requests"] == 3 and stats["rate_limited"] == 1 and stats["completed"] == 2
+
+def test_ollama_stream_reports_token_counts():
+    async def test(client, server):
+        response = await client.post("/api/chat", json={"model": "llama2", "messages": [{"role": "user", "content": "ls"}], "options": {"num_predict": 4}})
+        return [json.loads(line) for line in (await response.text()).splitlines()]
+
+    chunks = serve(MockProfile(**FAST), test)
+    assert [chunk["done"] for chunk in chunks] == [False] * 4 + [True]
+    assert chunks[-1]["eval_count"] == 4
+
+def test_lognormal_latency_has_the_configured_mean():
+    profile = MockProfile(latency="lognormal", latency_mean=2.0, latency_spread=0.5)
+    rng = random.Random(1)
+    samples = [profile.sample_latency(rng) for _ in range(20000)]
+    assert sum(samples) / len(samples) == pytest.approx(2.0, rel=0.05)
+
+def test_async_endpoint_retries_rate_limits_of_the_mock_server():
+    async def test(client, server):
+        endpoint = AsyncChatGPTEndpoint(
+            base_url=str(client.make_url("/v1")),
+            rate_limiter=RateLimiter(requests_per_minute=1000, tokens_per_minute=10 ** 6, max_concurrency=4, default_cooldown=0.0),
+            retry_policy=RetryPolicy(max_retries=5, base_delay=0.0, max_delay=0.0),
+            circuit_breaker=CircuitBreaker("mock", failure_threshold=100),
+        )
+        # The first answers are rate limited, until the server is told to stop
+        server.profile.rate_limit_probability = 1.0
+
+        async def recover():
+            await asyncio.sleep(0.2)
+            server.profile.rate_limit_probability = 0.0
+
+        async def ask():
+            # The usage is reported in the context of the task that asked
+            return await endpoint.ask(make_prompt(max_tokens=8)), last_usage()
+
+        (response, usage), _ = await asyncio.gather(ask(), recover())
+        return response, usage, server.stats
+
+    response, usage, stats = serve(MockProfile(completion_tokens=8, **FAST), test)
+    assert len(response.split()) == 8
+    assert usage["completion_tokens"] == 8
+    assert stats["rate_limited"] >= 1 and stats["completed"] == 1
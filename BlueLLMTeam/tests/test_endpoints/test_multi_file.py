@@ -0,0 +1,64 @@
+import json
+import asyncio
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("ollama")
+
+from BlueLLMTeam.LLMEndpoint import AsyncEchoEndpoint
+from BlueLLMTeam.agents.designers.fs.v1 import createFiles as v1
+from BlueLLMTeam.agents.designers.fs.v2 import createFiles as v2
+from tests.test_endpoints.fakes import ScriptedEndpoint
+
+FILES = ["/etc/app/a.conf", "/etc/app/b.conf", "/etc/app/c.conf", "/srv/run.py"]
+
+def answer(missing=()):
+    """
+    Answer a multi file prompt with a map of its files, leaving out 'missing'
+    """
+    def respond(prompt_dict):
+        if prompt_dict.get("kind") != "multi_file_contents_employee":
+            return "single"
+        files = [line for line in prompt_dict["user"].splitlines() if line.startswith("/")]
+        return json.dumps({file: f"contents of {file}" for file in files if file not in missing})
+    return respond
+
+def multi_file_prompts(llm: ScriptedEndpoint) -> list[dict]:
+    return [prompt_dict for prompt_dict in llm.prompts if prompt_dict.get("kind") == "multi_file_contents_employee"]
+
+@pytest.mark.parametrize("generate", [
+    lambda local_fs, llm: v1.generate_file_contents(local_fs, FILES, "", llm, multi_file=True, max_workers=2),
+    lambda local_fs, llm: v2.generate_file_contents(local_fs, FILES, "", llm, multi_file=True, max_workers=2),
+], ids=["v1", "v2"])
+def test_small_siblings_are_generated_in_one_request(tmp_path, generate):
+    llm = ScriptedEndpoint(response=answer())
+    generate(tmp_path, llm)
+    # One request for the three config files, one for the python file
+    assert len(multi_file_prompts(llm)) == 1
+    for file in FILES[:3]:
+        assert (tmp_path / file.lstrip("/")).read_text() == f"contents of {file}"
+    assert (tmp_path / "srv/run.py").read_text() == "single"
+
+def test_files_missing_from_the_answer_are_generated_one_by_one(tmp_path):
+    llm = ScriptedEndpoint(response=answer(missing={"/etc/app/b.conf"}))
+    v1.generate_file_group_content(FILES[:3], tmp_path, llm)
+    assert (tmp_path / "etc/app/a.conf").read_text() == "contents of /etc/app/a.conf"
+    assert (tmp_path / "etc/app/b.conf").read_text() == "single"
+    # The fallback only asks for the missing file
+    assert {prompt_dict["target"] for prompt_dict in llm.prompts if "target" in prompt_dict} == {"/etc/app/b.conf"}
+
+def test_failed_group_request_falls_back_for_every_file(tmp_path):
+    llm = ScriptedEndpoint(response=lambda prompt_dict: "not json" if prompt_dict.get("kind") == "multi_file_contents_employee" else "single")
+    v2.generate_file_group_content(FILES[:3], tmp_path, v2.build_file_structure(set(FILES)), llm)
+    for file in FILES[:3]:
+        assert (tmp_path / file.lstrip("/")).read_text() == "single"
+
+def test_light_weight_files_are_not_grouped(tmp_path):
+    llm = ScriptedEndpoint(response=answer())
+    v1.generate_file_contents(tmp_path, FILES, "", llm, light_weight=True, multi_file=True)
+    assert llm.calls == 0
+    assert all((tmp_path / file.lstrip("/")).read_text() == "\n" for file in FILES)
+
+def test_async_groups_write_every_file(tmp_path):
+    asyncio.run(v1.generate_file_contents_async(tmp_path, FILES, "", AsyncEchoEndpoint(), multi_file=True, max_workers=2))
+    assert all((tmp_path / file.lstrip("/")).exists() for file in FILES)
@@ -0,0 +1,81 @@
+import threading
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("ollama")
+
+import openai
+
+from BlueLLMTeam.LLMEndpoint import ChatGPTEndpoint, RouterEndpoint
+from BlueLLMTeam.utils.ratelimit import RateLimiter
+from BlueLLMTeam.utils.retry import RetryPolicy, CircuitBreaker
+from tests.test_endpoints.fakes import FakeOpenAI, ScriptedEndpoint, api_error, make_prompt
+
+def chatgpt(client) -> ChatGPTEndpoint:
+    endpoint = ChatGPTEndpoint(
+        rate_limiter=RateLimiter(requests_per_minute=1000, tokens_per_minute=10 ** 6, max_concurrency=4, default_cooldown=0.0),
+        retry_policy=RetryPolicy(max_retries=0, base_delay=0.0, max_delay=0.0),
+        circuit_breaker=CircuitBreaker("test", reset_timeout=60),
+    )
+    endpoint.client = client
+    return endpoint
+
+def test_failed_request_is_retried_on_the_next_backend():
+    failing = ScriptedEndpoint(error=RuntimeError("down"))
+    working = ScriptedEndpoint(response="from ollama")
+    router = RouterEndpoint({"chatgpt": failing, "ollama": working})
+    # Backends without samples are tried in the given order
+    assert router.ask(make_prompt()) == "from ollama"
+    assert failing.calls == 1 and working.calls == 1
+    assert router.stats["chatgpt"].error_rate == 1.0
+    assert router.stats["ollama"].error_rate == 0.0
+
+def test_exhausted_quota_moves_all_requests_to_the_other_backend():
+    client = FakeOpenAI(api_error(openai.RateLimitError, 429, "insufficient_quota"))
+    ollama = ScriptedEndpoint(response="from ollama")
+    router = RouterEndpoint({"chatgpt": chatgpt(client), "ollama": ollama})
+    assert router.ask(make_prompt()) == "from ollama"
+
+    # The quota error opened the circuit, nothing more is sent to ChatGPT
+    for _ in range(5):
+        assert router.ask(make_prompt()) == "from ollama"
+    assert len(client.requests) == 1
+    assert router.report()["chatgpt"]["healthy"] is False
+    assert router.ranking() == ["ollama", "chatgpt"]
+
+def test_backends_with_many_errors_are_tried_last():
+    flaky = ScriptedEndpoint(response="flaky")
+    stable = ScriptedEndpoint(response="stable")
+    router = RouterEndpoint({"flaky": flaky, "stable": stable}, max_error_rate=0.5)
+    for _ in range(3):
+        router.stats["flaky"].add(1.0, ok=False)
+    router.stats["stable"].add(10.0)
+    assert router.ranking() == ["stable", "flaky"]
+    assert router.ask(make_prompt()) == "stable"
+
+def test_requests_are_spread_by_expected_wait():
+    fast = ScriptedEndpoint(response="fast", delay=0.05)
+    slow = ScriptedEndpoint(response="slow", delay=0.05)
+    router = RouterEndpoint({"fast": fast, "slow": slow})
+    router.stats["fast"].add(0.1)
+    router.stats["slow"].add(0.3)
+
+    responses = []
+    threads = [threading.Thread(target=lambda: responses.append(router.ask(make_prompt()))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # Three requests on the fast backend are expected to wait as long as one on the slow one
+    assert responses.count("fast") >= 2
+    assert responses.count("slow") >= 1
+    assert router.in_flight == {"fast": 0, "slow": 0}
+
+def test_last_error_is_raised_when_all_backends_fail():
+    router = RouterEndpoint({
+        "a": ScriptedEndpoint(error=RuntimeError("a down")),
+        "b": ScriptedEndpoint(error=ValueError("b down")),
+    })
+    with pytest.raises((RuntimeError, ValueError)):
+        router.ask(make_prompt())
+    assert all(stats.error_rate == 1.0 for stats in router.stats.values())
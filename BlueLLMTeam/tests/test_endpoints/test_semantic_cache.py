@@ -0,0 +1,59 @@
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("ollama")
+
+from BlueLLMTeam.LLMEndpoint import SemanticCacheEndpoint
+from tests.test_endpoints.fakes import ScriptedEndpoint, make_prompt
+
+def file_prompt(path: str) -> dict[str, str]:
+    return make_prompt(f"Write the contents of {path}", kind="file_contents_employee", subject=path)
+
+def command_prompt(command: str) -> dict[str, str]:
+    return make_prompt(command, kind="linux_command_response", subject=command)
+
+@pytest.fixture
+def cached():
+    backend = ScriptedEndpoint(response=lambda prompt_dict: f"Contents of {prompt_dict['subject']}")
+    return SemanticCacheEndpoint(backend), backend
+
+def test_same_file_in_a_similar_folder_is_answered_from_the_cache_at_the_default_threshold(cached):
+    llm_endpoint, backend = cached
+    llm_endpoint.ask(file_prompt("/home/finance/2023/report.txt"))
+    assert llm_endpoint.ask(file_prompt("/home/finance/2024/report.txt")) == "Contents of /home/finance/2024/report.txt"
+    assert backend.calls == 1
+    assert llm_endpoint.stats()["hits"] == 1
+
+@pytest.mark.parametrize("first, second", [
+    ("/home/finance/q3_report.txt", "/home/hr/employees.csv"),
+    ("/home/finance/q3_report.txt", "/home/finance/q3_budget.txt"),
+    ("/home/finance/q3_report.txt", "/home/finance/q3_report.pdf"),
+    # Sibling files that score above the threshold, but have other contents
+    ("/home/finance/q3_report.txt", "/home/finance/q4_report.txt"),
+    ("/home/admin/passwords.txt", "/home/admin/password.txt"),
+    ("/etc/app/server_config.yaml", "/etc/app/server_configs.yaml"),
+])
+def test_different_file_is_asked_at_the_default_threshold(cached, first, second):
+    llm_endpoint, backend = cached
+    llm_endpoint.ask(file_prompt(first))
+    assert llm_endpoint.ask(file_prompt(second)) == f"Contents of {second}"
+    assert backend.calls == 2
+    assert llm_endpoint.stats()["hits"] == 0
+
+def test_command_with_other_arguments_is_asked_at_the_default_threshold(cached):
+    llm_endpoint, backend = cached
+    llm_endpoint.ask(command_prompt("wget a.sh"))
+    assert llm_endpoint.ask(command_prompt("wget b.sh")) == "Contents of wget b.sh"
+    assert backend.calls == 2
+
+def test_other_kinds_are_not_compared(cached):
+    llm_endpoint, backend = cached
+    llm_endpoint.ask(file_prompt("/home/finance/q3_report.txt"))
+    llm_endpoint.ask({**file_prompt("/home/finance/q4_report.txt"), "kind": "text_file_advisor"})
+    assert backend.calls == 2
+
+def test_refreshed_prompts_are_not_looked_up(cached):
+    llm_endpoint, backend = cached
+    llm_endpoint.ask(file_prompt("/home/finance/q3_report.txt"))
+    llm_endpoint.ask({**file_prompt("/home/finance/q3_report.txt"), "refresh": True})
+    assert backend.calls == 2
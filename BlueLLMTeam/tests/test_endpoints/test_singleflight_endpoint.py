@@ -0,0 +1,74 @@
+import asyncio
+import threading
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("ollama")
+
+from BlueLLMTeam.LLMEndpoint import SingleFlightEndpoint, AsyncSingleFlightEndpoint, AsyncLLMEndpointBase
+from tests.test_endpoints.fakes import ScriptedEndpoint, make_prompt
+
+def ask_concurrently(llm_endpoint, prompts):
+    results = [None] * len(prompts)
+
+    def ask(i):
+        try:
+            results[i] = llm_endpoint.ask(prompts[i])
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=ask, args=(i,)) for i in range(len(prompts))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+def test_identical_prompts_in_flight_are_sent_once():
+    backend = ScriptedEndpoint(response=lambda prompt_dict: f"response to {prompt_dict['message']}", delay=0.1)
+    llm_endpoint = SingleFlightEndpoint(backend)
+    results = ask_concurrently(llm_endpoint, [make_prompt("ls")] * 4 + [make_prompt("pwd")])
+    assert results == ["response to ls"] * 4 + ["response to pwd"]
+    assert backend.calls == 2
+    assert llm_endpoint.coalesced == 3
+
+def test_prompts_with_another_max_tokens_are_sent_separately():
+    backend = ScriptedEndpoint(delay=0.1)
+    llm_endpoint = SingleFlightEndpoint(backend)
+    ask_concurrently(llm_endpoint, [make_prompt("ls", max_tokens=32), make_prompt("ls", max_tokens=512)])
+    assert backend.calls == 2
+    assert llm_endpoint.coalesced == 0
+
+def test_errors_reach_every_waiting_caller():
+    backend = ScriptedEndpoint(delay=0.1, error=RuntimeError("down"))
+    results = ask_concurrently(SingleFlightEndpoint(backend), [make_prompt("ls")] * 3)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert backend.calls == 1
+
+def test_sequential_prompts_are_sent_each_time():
+    backend = ScriptedEndpoint()
+    llm_endpoint = SingleFlightEndpoint(backend)
+    llm_endpoint.ask(make_prompt("ls"))
+    llm_endpoint.ask(make_prompt("ls"))
+    assert backend.calls == 2
+
+class AsyncScriptedEndpoint(AsyncLLMEndpointBase):
+
+    def __init__(self) -> None:
+        self.calls = 0
+
+    async def ask(self, prompt_dict):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        return f"response to {prompt_dict['message']}"
+
+def test_async_identical_prompts_in_flight_are_sent_once():
+    backend = AsyncScriptedEndpoint()
+    llm_endpoint = AsyncSingleFlightEndpoint(backend)
+
+    async def run():
+        return await asyncio.gather(*(llm_endpoint.ask(make_prompt(message)) for message in ["ls", "ls", "ls", "pwd"]))
+
+    assert asyncio.run(run()) == ["response to ls"] * 3 + ["response to pwd"]
+    assert backend.calls == 2
+    assert llm_endpoint.coalesced == 2
@@ -0,0 +1,48 @@
+import os
+import time
+from BlueLLMTeam.utils.cache import ResponseCache, prompt_key
+
+PROMPT = {
+    "systemRole": "You are a Linux expert",
+    "user": "",
+    "context": "",
+    "message": "/etc/passwd",
+    "model": "gpt-3.5-turbo-0125",
+}
+
+def test_prompt_key_ignores_metadata():
+    assert prompt_key(PROMPT) == prompt_key({**PROMPT, "kind": "linux_important_files_creator"})
+
+def test_prompt_key_depends_on_message():
+    assert prompt_key(PROMPT) != prompt_key({**PROMPT, "message": "/etc/shadow"})
+
+def test_prompt_key_depends_on_model():
+    assert prompt_key(PROMPT) != prompt_key({**PROMPT, "model": "gpt-4o"})
+
+def test_set_and_get(tmp_path):
+    cache = ResponseCache(tmp_path)
+    key = prompt_key(PROMPT)
+    assert cache.get(key) is None
+    cache.set(key, "root:x:0:0:root:/root:/bin/bash")
+    assert cache.get(key) == "root:x:0:0:root:/root:/bin/bash"
+    # A new cache instance reads the same entries from disk
+    assert ResponseCache(tmp_path).get(key) == "root:x:0:0:root:/root:/bin/bash"
+
+def test_expired_entries_are_dropped(tmp_path):
+    cache = ResponseCache(tmp_path, max_age=0.05)
+    cache.set("a" * 64, "old")
+    time.sleep(0.1)
+    assert cache.get("a" * 64) is None
+
+def test_size_eviction_removes_least_recently_used(tmp_path):
+    cache = ResponseCache(tmp_path, max_bytes=10_000)
+    cache.set("a" * 64, "x" * 4000)
+    cache.set("b" * 64, "x" * 4000)
+    # Make the first entry look older than the second
+    old = time.time() - 100
+    os.utime(cache._path("a" * 64), (old, old))
+    cache.set("c" * 64, "x" * 4000)
+    assert cache.get("a" * 64) is None
+    assert cache.get("b" * 64) is not None
+    assert cache.get("c" * 64) is not None
+    assert cache.size <= 10_000
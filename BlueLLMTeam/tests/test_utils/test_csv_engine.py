@@ -0,0 +1,58 @@
+import io
+import csv
+import json
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("pandas")
+
+from BlueLLMTeam.utils.csv_engine import parse_schema, synthesize_csv
+
+SCHEMA = {
+    "rows": 300,
+    "columns": [
+        {"name": "Employee ID", "type": "id", "prefix": "EMP-"},
+        {"name": "Full Name", "type": "full_name"},
+        {"name": "Email", "type": "email", "values": ["acme.io"]},
+        {"name": "SSN", "type": "ssn"},
+        {"name": "Office", "type": "city", "values": ["Lyon", "Osaka"]},
+        {"name": "Start Date", "type": "date", "min": "2015-03-01", "max": "2024-05-31"},
+        {"name": "Salary", "type": "amount", "min": 41000, "max": 168000},
+        {"name": "Notes", "type": "unknown"},
+    ],
+    "examples": [
+        ["EMP-00417", "Ingrid Solberg", "i.solberg@acme.io", "231-58-0946", "Lyon", "2019-08-12", "73418.27", "on leave"],
+        ["too", "short"],
+    ],
+}
+
+def read_rows(text):
+    return list(csv.reader(io.StringIO(text)))
+
+def test_parse_schema():
+    schema = parse_schema("```json\n" + json.dumps(SCHEMA) + "\n```")
+    assert [column.type for column in schema.columns][-1] == "text"
+    assert len(schema.examples) == 1
+    assert schema.rows == 300
+
+def test_parse_schema_without_columns():
+    with pytest.raises(ValueError):
+        parse_schema('{"rows": 10}')
+
+def test_synthesized_rows():
+    rows = read_rows(synthesize_csv(parse_schema(json.dumps(SCHEMA)), seed=1))
+    header, first, *rest = rows
+    assert header == [column["name"] for column in SCHEMA["columns"]]
+    assert first == SCHEMA["examples"][0]
+    assert len(rest) == 299
+    for row in rest:
+        employee_id, name, email, ssn, office, start, salary, notes = row
+        assert employee_id.startswith("EMP-")
+        assert email == (name.split()[0][0] + "." + name.split()[1]).lower() + "@acme.io"
+        area, group, serial = ssn.split("-")
+        assert len(area) == 3 and len(group) == 2 and len(serial) == 4 and area not in ("000", "666")
+        assert office in ("Lyon", "Osaka")
+        assert "2015-03-01" <= start <= "2024-05-31"
+        assert 41000 <= float(salary) <= 168000
+    # Amounts are not round numbers
+    assert sum(float(row[6]).is_integer() for row in rest) < 10
@@ -0,0 +1,119 @@
+import io
+import time
+import json
+import asyncio
+import zlib
+import struct
+import zipfile
+import xml.etree.ElementTree as ET
+
+from BlueLLMTeam.utils import documents
+from BlueLLMTeam.utils.documents import is_rendered_file, parse_document, render_document, render_async
+
+DOCUMENT = {
+    "title": "Q3 Travel Expenses",
+    "author": "Ingrid Solberg",
+    "paragraphs": ["Expenses of the Lyon office – July to September.", "Approved by Kenji Takahashi"],
+    "tables": [
+        {"name": "Expenses", "header": ["Date", "Vendor", "Amount"], "rows": [["2023-07-14", "Air France", 412.37], ["2023-08-02", "Hôtel & Spa <Lyon>", 1289.5]]},
+        {"name": "Expenses", "header": ["Total"], "rows": [[1701.87]]},
+    ],
+    "caption": "Expenses by month",
+    "files": {"receipts/air_france.txt": "Ticket 057-2231984410", "notes.md": "# Notes"},
+}
+
+def parse(document, file="finance/q3_travel_expenses.xlsx"):
+    return parse_document(json.dumps(document), file)
+
+def test_is_rendered_file():
+    assert is_rendered_file("HR/payroll.XLSX")
+    assert is_rendered_file("/srv/share/logo.png")
+    assert not is_rendered_file("notes.txt")
+    assert not is_rendered_file("Makefile")
+
+def test_parse_document_defaults():
+    document = parse_document("not json at all\n\nsecond paragraph", "HR/annual_review-2023.docx")
+    assert document["title"] == "annual review 2023"
+    assert document["paragraphs"] == ["not json at all", "second paragraph"]
+    assert document["tables"] == [] and document["files"] == {}
+
+def test_parse_document_drops_malformed_tables():
+    document = parse({"tables": [{"name": "ok", "rows": [["a"], "b"]}, {"rows": "x"}, "y"]})
+    assert document["tables"] == [{"name": "ok", "header": [], "rows": [["a"]]}]
+
+def test_render_xlsx():
+    data = render_document(".xlsx", parse(DOCUMENT))
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.testzip() is None
+        for name in archive.namelist():
+            if name.endswith(".xml") or name.endswith(".rels"):
+                ET.fromstring(archive.read(name))
+        workbook = archive.read("xl/workbook.xml").decode()
+        sheet = archive.read("xl/worksheets/sheet1.xml").decode()
+    # Sheet names are unique
+    assert workbook.count('name="Expenses') == 2
+    assert "Hôtel &amp; Spa &lt;Lyon&gt;" in sheet
+    assert "<v>412.37</v>" in sheet
+
+def test_render_docx():
+    data = render_document(".docx", parse(DOCUMENT, "finance/q3.docx"))
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        body = archive.read("word/document.xml").decode()
+        ET.fromstring(body)
+        ET.fromstring(archive.read("[Content_Types].xml"))
+    assert "Q3 Travel Expenses" in body and "Air France" in body
+
+def test_render_pdf():
+    data = render_document(".pdf", parse(DOCUMENT, "finance/q3.pdf"))
+    assert data.startswith(b"%PDF-1.")
+    assert data.rstrip().endswith(b"%%EOF")
+    offset = int(data[data.rindex(b"startxref") + 9:].split()[0])
+    assert data[offset:offset + 4] == b"xref"
+    # A4
+    assert b"/MediaBox [0 0 595 842]" in data
+
+def test_render_png():
+    data = render_document(".png", parse(DOCUMENT, "finance/expenses_chart.png"))
+    assert data.startswith(b"\x89PNG\r\n\x1a\n")
+    position, kinds = 8, []
+    while position < len(data):
+        length, = struct.unpack(">I", data[position:position + 4])
+        kind = data[position + 4:position + 8]
+        body = data[position + 8:position + 8 + length]
+        crc, = struct.unpack(">I", data[position + 8 + length:position + 12 + length])
+        assert zlib.crc32(kind + body) == crc
+        kinds.append(kind)
+        position += 12 + length
+    assert kinds[0] == b"IHDR" and kinds[-1] == b"IEND" and b"IDAT" in kinds
+
+def test_render_zip():
+    data = render_document(".zip", parse(DOCUMENT, "backups/receipts.zip"))
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert sorted(archive.namelist()) == ["notes.md", "receipts/air_france.txt"]
+        assert archive.read("notes.md") == b"# Notes"
+
+def test_render_async_does_not_block_the_event_loop(monkeypatch):
+    def slow_render(extension, document):
+        time.sleep(0.2)
+        return render_document(extension, document)
+
+    monkeypatch.setattr(documents, "RENDER_WORKERS", 0)
+    monkeypatch.setattr(documents, "render_document", slow_render)
+    ticks = []
+
+    async def tick():
+        for _ in range(10):
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def render():
+        data = await render_async(".zip", parse(DOCUMENT, "backups/receipts.zip"))
+        return data, time.monotonic()
+
+    async def run():
+        return await asyncio.gather(render(), tick())
+
+    (data, rendered), _ = asyncio.run(run())
+    assert data.startswith(b"PK")
+    # The loop kept running while the document was rendered
+    assert len(ticks) == 10 and ticks[-1] < rendered
@@ -0,0 +1,63 @@
+import time
+import asyncio
+from BlueLLMTeam.utils.file_priority import file_value
+from BlueLLMTeam.utils.threading import PriorityPool, run_prioritized, run_prioritized_async
+
+def test_valuable_files_score_higher():
+    assert file_value("/home/admin/.env") > file_value("/home/admin/notes.txt")
+    assert file_value("/home/hr/employee_records.csv") > file_value("/home/marketing/logo.png")
+    assert file_value("/srv/backup.sh") > file_value("/srv/readme.md")
+    assert file_value("/home/it/passwords.txt") > file_value("/home/it/todo.txt")
+
+def test_tasks_run_in_priority_order():
+    order = []
+    tasks = [(priority, lambda p=priority: order.append(p)) for priority in [1, 5, 3, 4, 2]]
+    assert run_prioritized(tasks, max_workers=1) == []
+    assert order == [5, 4, 3, 2, 1]
+
+def test_deadline_skips_tasks_that_have_not_started():
+    done = []
+    def slow(name):
+        time.sleep(0.1)
+        done.append(name)
+    tasks = [(10 - i, lambda i=i: slow(i)) for i in range(10)]
+    skipped = run_prioritized(tasks, max_workers=2, deadline=0.15)
+    # The most important tasks ran, the rest were skipped
+    assert sorted(done) == list(range(len(done)))
+    assert len(done) + len(skipped) == 10
+    assert 2 <= len(done) < 10
+
+def test_failing_tasks_do_not_stop_the_pool():
+    done = []
+    def fail():
+        raise ValueError("failed")
+    run_prioritized([(2, fail), (1, lambda: done.append(1))], max_workers=1)
+    assert done == [1]
+
+def test_pool_accepts_tasks_while_running():
+    done = []
+    pool = PriorityPool(max_workers=2)
+    for i in range(3):
+        pool.submit(i, lambda i=i: done.append(i))
+        time.sleep(0.01)
+    assert pool.close() == []
+    assert sorted(done) == [0, 1, 2]
+
+def test_async_tasks_run_in_priority_order_with_a_deadline():
+    done = []
+    active = []
+    peak = []
+
+    async def slow(name):
+        active.append(name)
+        peak.append(len(active))
+        await asyncio.sleep(0.1)
+        active.remove(name)
+        done.append(name)
+
+    tasks = [(10 - i, lambda i=i: slow(i)) for i in range(10)]
+    skipped = asyncio.run(run_prioritized_async(tasks, max_workers=2, deadline=0.15))
+    assert max(peak) == 2
+    assert sorted(done) == list(range(len(done)))
+    assert len(done) + len(skipped) == 10
+    assert 2 <= len(done) < 10
@@ -0,0 +1,68 @@
+import asyncio
+import threading
+from BlueLLMTeam.utils.fs_budget import FileSystemBudget, breadth_first, breadth_first_async
+
+def binary_tree(folder):
+    return [f"{folder}/file.txt"], [f"{folder}/a", f"{folder}/b"]
+
+def test_depth_limit():
+    files = breadth_first("/home", binary_tree, FileSystemBudget(max_folders=1000, max_files=1000, max_calls=1000), max_depth=2)
+    # 1 + 2 + 4 folders
+    assert len(files) == 7
+
+def test_folders_are_expanded_breadth_first():
+    order = []
+    def expand(folder):
+        order.append(folder)
+        return binary_tree(folder)
+    budget = FileSystemBudget(max_folders=1000, max_files=1000, max_calls=7, max_concurrency=1)
+    breadth_first("/h", expand, budget, max_depth=10)
+    assert order == ["/h", "/h/a", "/h/b", "/h/a/a", "/h/a/b", "/h/b/a", "/h/b/b"]
+
+def test_budgets_are_enforced():
+    budget = FileSystemBudget(max_folders=5, max_files=3, max_calls=100)
+    files = breadth_first("/home", binary_tree, budget, max_depth=10)
+    assert len(files) == 3
+    assert budget.folders == 5
+    assert budget.calls == 5
+
+    budget = FileSystemBudget(max_folders=100, max_files=100, max_calls=4)
+    breadth_first("/home", binary_tree, budget, max_depth=10)
+    assert budget.calls == 4
+
+def test_concurrency_is_limited():
+    active = []
+    peak = []
+    lock = threading.Lock()
+    def expand(folder):
+        with lock:
+            active.append(1)
+            peak.append(len(active))
+        result = binary_tree(folder)
+        with lock:
+            active.pop()
+        return result
+    breadth_first("/home", expand, FileSystemBudget(max_folders=50, max_files=1000, max_calls=50, max_concurrency=3), max_depth=10)
+    assert max(peak) <= 3
+
+def test_failed_folders_are_skipped():
+    def expand(folder):
+        if folder.endswith("a"):
+            raise ValueError("bad response")
+        return binary_tree(folder)
+    files = breadth_first("/h", expand, FileSystemBudget(max_folders=100, max_files=100, max_calls=100), max_depth=1)
+    assert sorted(files) == ["/h/b/file.txt", "/h/file.txt"]
+
+def test_async_version():
+    async def expand(folder):
+        return binary_tree(folder)
+    budget = FileSystemBudget(max_folders=1000, max_files=1000, max_calls=1000)
+    files = asyncio.run(breadth_first_async("/home", expand, budget, max_depth=2))
+    assert len(files) == 7
+
+def test_files_are_streamed_per_folder():
+    batches = []
+    budget = FileSystemBudget(max_folders=1000, max_files=1000, max_calls=1000)
+    files = breadth_first("/home", binary_tree, budget, max_depth=2, on_files=batches.append)
+    assert batches[0] == ["/home/file.txt"]
+    assert sorted(file for batch in batches for file in batch) == sorted(files)
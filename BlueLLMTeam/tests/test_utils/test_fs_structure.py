@@ -0,0 +1,62 @@
+from BlueLLMTeam.utils.fs_structure import structure_entries, structure_growth, split_subtrees, merge_subtrees
+from BlueLLMTeam.utils.fs_structure import relevant_structure, structure_overview
+
+OUTLINE = """Here is the file structure:
+- Acme
+  - HR
+    - payroll.xlsx
+  - Finance
+    - budget_2023.csv
+"""
+
+TREE = """Acme/
+├── HR/
+│   └── payroll.xlsx
+└── Finance/
+    └── q3.csv"""
+
+def test_entries_follow_the_indentation():
+    assert structure_entries(OUTLINE) == {"acme", "acme/hr", "acme/hr/payroll.xlsx", "acme/finance", "acme/finance/budget_2023.csv"}
+    assert "acme/hr/payroll.xlsx" in structure_entries(TREE)
+
+def test_growth_counts_new_entries():
+    previous = structure_entries(OUTLINE)
+    current = structure_entries(OUTLINE + "  - Legal\n    - nda.docx\n")
+    assert structure_growth(previous, current) == 2 / 5
+    assert structure_growth(current, current) == 0
+
+def test_subtrees_are_the_children_of_the_root():
+    header, subtrees, indent = split_subtrees(OUTLINE)
+    assert "Acme" in header
+    assert [subtree.split()[1] for subtree in subtrees] == ["HR", "Finance"]
+    assert len(split_subtrees(TREE)[1]) == 2
+
+def test_merged_subtrees_stay_under_the_root():
+    header, subtrees, indent = split_subtrees(OUTLINE)
+    enhanced = ["Sure, here it is:\n- HR\n  - payroll.xlsx\n  - onboarding", "- Finance\n  - budget_2023.csv"]
+    merged = merge_subtrees(header, enhanced, indent)
+    assert "Sure" not in merged
+    assert structure_entries(merged) >= structure_entries(OUTLINE) | {"acme/hr/onboarding"}
+
+def large_structure():
+    hr = {f"employee_{i}.xlsx": "" for i in range(40)}
+    web = {f"component_{i}.js": "" for i in range(200)}
+    return {"": {"home": {"acme": {"hr": {"records": hr, "policy.pdf": ""}, "web": {"src": web}, "notes.txt": ""}}}}
+
+def test_relevant_structure_keeps_ancestors_and_siblings():
+    compact = relevant_structure(large_structure(), "/home/acme/hr/records/employee_3.xlsx", max_tokens=100)
+    assert "employee_3.xlsx" in compact
+    assert "policy.pdf" in compact
+    assert "web/ (200 files)" in compact
+    assert "component_0.js" not in compact
+    assert len(compact) // 4 <= 100
+
+def test_relevant_structure_is_complete_within_a_large_budget():
+    compact = relevant_structure(large_structure(), "/home/acme/hr/records/employee_3.xlsx", max_tokens=10000)
+    assert all(f"employee_{i}.xlsx" in compact for i in range(40))
+
+def test_overview_is_the_same_for_all_files_and_bounded():
+    overview = structure_overview(large_structure(), max_tokens=60)
+    assert "hr/ (41 files)" in overview
+    assert "employee_0.xlsx" not in overview
+    assert len(overview) // 4 <= 60
@@ -1,5 +1,5 @@
 import pytest
-from BlueLLMTeam.utils.text import extract_json_from_text
+from BlueLLMTeam.utils.text import extract_json_from_text, repair_json
 
 def test_valid_json_square_brackets():
     text = "Some text before [ { \"key1\": \"value1\" }, { \"key2\": \"value2\" } ] some text after"
@@ -35,3 +35,20 @@ def test_empty_curly_brackets():
     text = "Some text before {} some text after"
     expected = {}
     assert extract_json_from_text(text) == expected
+
+def test_repair_valid_json():
+    assert repair_json('{"a": {"b.txt": ""}}') == {"a": {"b.txt": ""}}
+
+def test_repair_markdown_and_trailing_commas():
+    text = '```json\n{"a": {"b.txt": "", "c": ["d", "e",],},}\n```'
+    assert repair_json(text) == {"a": {"b.txt": "", "c": ["d", "e"]}}
+
+def test_repair_truncated_json():
+    assert repair_json('{"a": {"b.txt": "", "c": {"d.csv": "", "e') == {"a": {"b.txt": "", "c": {"d.csv": ""}}}
+    assert repair_json('{"a": {"b": ""}, "c":') == {"a": {"b": ""}}
+    assert repair_json('{"a": "x\\') == {"a": "x"}
+    assert repair_json('[1, 2, 3') == [1, 2, 3]
+
+def test_repair_no_json():
+    with pytest.raises(ValueError, match="No opening bracket found"):
+        repair_json("No JSON here")
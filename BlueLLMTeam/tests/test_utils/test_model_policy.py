@@ -0,0 +1,55 @@
+import pytest
+from BlueLLMTeam.utils.model_policy import ModelPolicy, MODEL_POLICY_FILE
+
+POLICY = {
+    "tiers": {"fast": {"model": "small"}, "strong": {"model": "large"}},
+    "default": {"tier": "fast"},
+    "agents": {"Analyst": {"tier": "strong"}},
+    "kinds": {"python_advisor": {"tier": "fast", "max_tokens": 100}, "python_reviewer": {"model": "custom"}},
+}
+
+def test_default_tier():
+    prompt = ModelPolicy(POLICY).apply({"model": "gpt-3.5-turbo-0125", "kind": "unknown"})
+    assert prompt["model"] == "small"
+    assert prompt["tier"] == "fast"
+
+def test_kind_overrides_agent():
+    policy = ModelPolicy(POLICY)
+    assert policy.apply({"agent": "Analyst"})["model"] == "large"
+    assert policy.apply({"agent": "Analyst", "kind": "python_advisor"})["model"] == "small"
+    assert policy.apply({"kind": "python_reviewer"})["model"] == "custom"
+
+def test_max_tokens_is_capped():
+    policy = ModelPolicy(POLICY)
+    assert policy.apply({"kind": "python_advisor", "max_tokens": 4096})["max_tokens"] == 100
+    assert policy.apply({"kind": "python_advisor", "max_tokens": 50})["max_tokens"] == 50
+    assert policy.apply({"kind": "python_advisor"})["max_tokens"] == 100
+
+def test_prompt_is_not_modified():
+    prompt = {"model": "gpt-4o"}
+    ModelPolicy(POLICY).apply(prompt)
+    assert prompt == {"model": "gpt-4o"}
+
+def test_unknown_tier():
+    with pytest.raises(ValueError):
+        ModelPolicy({"tiers": {}, "default": {"tier": "missing"}})
+
+def test_shipped_policy_is_valid():
+    ModelPolicy.from_file(MODEL_POLICY_FILE)
+
+def test_shipped_policy_keeps_the_strong_tier_for_final_contents():
+    policy = ModelPolicy.from_file(MODEL_POLICY_FILE)
+    for agent in ["TeamLeader", "Analyst", "Honeypot Designer", "Command Designer"]:
+        assert policy.apply({"agent": agent}).get("tier") != "strong"
+    strong = {kind for kind in policy.kinds if policy.apply({"kind": kind}).get("tier") == "strong"}
+    assert strong == {
+        "honeypot_design",
+        "file_contents_employee",
+        "multi_file_contents_employee",
+        "text_file_writer",
+        "csv_writer",
+        "cowrie_configuration_creator",
+    }
+    # The advisors only plan the contents
+    for kind in ["python_advisor", "text_file_advisor", "csv_advisor"]:
+        assert policy.apply({"kind": kind})["tier"] == "fast"
@@ -0,0 +1,36 @@
+import json
+from BlueLLMTeam.utils.multifile import group_small_files, parse_file_map
+
+def test_small_siblings_are_grouped():
+    files = {"/etc/a.conf", "/etc/b.conf", "/etc/c.conf", "/home/x.txt", "/home/run.py", "/home/data.csv"}
+    groups = group_small_files(files, group_size=2)
+    assert sorted(map(sorted, groups)) == [
+        ["/etc/a.conf", "/etc/b.conf"],
+        ["/etc/c.conf"],
+        ["/home/data.csv"],
+        ["/home/run.py"],
+        ["/home/x.txt"],
+    ]
+
+def test_no_groups_with_group_size_one():
+    files = {"/etc/a.conf", "/etc/b.conf"}
+    assert sorted(group_small_files(files, group_size=1)) == [["/etc/a.conf"], ["/etc/b.conf"]]
+
+def test_parse_file_map():
+    files = ["/etc/a.conf", "/etc/b.conf", "/etc/c.json", "/etc/d.txt"]
+    response = "Here you go:\n" + json.dumps({
+        "etc/a.conf": "a = 1",
+        "b.conf": "",
+        "/etc/c.json": {"key": "value"},
+        "unknown.txt": "ignored",
+    })
+    contents = parse_file_map(response, files)
+    assert contents["/etc/a.conf"] == "a = 1"
+    assert json.loads(contents["/etc/c.json"]) == {"key": "value"}
+    # Empty and missing entries are left out
+    assert "/etc/b.conf" not in contents
+    assert "/etc/d.txt" not in contents
+
+def test_parse_malformed_file_map():
+    assert parse_file_map("not json", ["/a.txt"]) == {}
+    assert parse_file_map('["a"]', ["/a.txt"]) == {}
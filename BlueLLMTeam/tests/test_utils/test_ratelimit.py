@@ -0,0 +1,124 @@
+import time
+import asyncio
+import threading
+from BlueLLMTeam.utils.ratelimit import RateLimiter, Priority, estimate_tokens, parse_duration, prompt_priority
+
+def test_parse_duration():
+    assert parse_duration("1s") == 1.0
+    assert parse_duration("6m0s") == 360.0
+    assert parse_duration("20ms") == 0.02
+    assert parse_duration("1.5") == 1.5
+
+def test_estimate_tokens_includes_max_tokens():
+    prompt_dict = {"systemRole": "a" * 40, "user": "", "context": "", "message": "b" * 40}
+    assert estimate_tokens(prompt_dict) == 20
+    assert estimate_tokens(prompt_dict, 100) == 120
+
+def test_concurrency_is_limited():
+    limiter = RateLimiter(requests_per_minute=1000, tokens_per_minute=10**6, max_concurrency=2)
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def worker():
+        with limiter.limit(10):
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            time.sleep(0.02)
+            with lock:
+                active.pop()
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert max(peak) <= 2
+
+def test_rate_limit_halves_concurrency():
+    limiter = RateLimiter(requests_per_minute=1000, tokens_per_minute=10**6, max_concurrency=8)
+    limiter.on_rate_limited(retry_after=0)
+    assert int(limiter.concurrency) == 4
+    limiter.on_success()
+    assert 4 < limiter.concurrency <= 8
+
+def test_rate_limit_pauses_requests():
+    limiter = RateLimiter(requests_per_minute=1000, tokens_per_minute=10**6, max_concurrency=8)
+    limiter.on_rate_limited(retry_after=0.1)
+    start = time.monotonic()
+    with limiter.limit(10):
+        pass
+    assert time.monotonic() - start >= 0.09
+
+def test_exhausted_headers_pause_requests():
+    limiter = RateLimiter(requests_per_minute=1000, tokens_per_minute=10**6, max_concurrency=8)
+    limiter.update_from_headers({
+        "x-ratelimit-limit-requests": "500",
+        "x-ratelimit-remaining-requests": "0",
+        "x-ratelimit-reset-requests": "100ms",
+    })
+    assert limiter.requests_per_minute == 500
+    start = time.monotonic()
+    with limiter.limit(10):
+        pass
+    assert time.monotonic() - start >= 0.09
+
+def test_prompt_priority():
+    assert prompt_priority({"agent": "Analyst", "kind": "analyse_logs"}) == Priority.INTERACTIVE
+    assert prompt_priority({"kind": "linux_important_files_creator"}) == Priority.SYSTEM
+    assert prompt_priority({"kind": "python_coder"}) == Priority.BULK
+    assert prompt_priority({"kind": "python_coder", "priority": 0}) == Priority.INTERACTIVE
+
+def test_interactive_requests_skip_the_queue():
+    limiter = RateLimiter(requests_per_minute=1000, tokens_per_minute=10**6, max_concurrency=1)
+    order = []
+    blocker = limiter.acquire(10, Priority.BULK)
+
+    def worker(name, priority):
+        with limiter.limit(10, priority):
+            order.append(name)
+
+    threads = []
+    for name, priority in [("bulk1", Priority.BULK), ("bulk2", Priority.BULK), ("analyst", Priority.INTERACTIVE)]:
+        t = threading.Thread(target=worker, args=(name, priority))
+        t.start()
+        threads.append(t)
+        time.sleep(0.02)
+    limiter.release(blocker)
+    for t in threads:
+        t.join()
+    assert order == ["analyst", "bulk1", "bulk2"]
+
+def test_concurrency_is_reserved_for_interactive_requests():
+    limiter = RateLimiter(requests_per_minute=1000, tokens_per_minute=10**6, max_concurrency=3)
+    slots = [limiter.acquire(10, Priority.BULK) for _ in range(2)]
+    assert limiter.in_flight == limiter.concurrency_limit(Priority.BULK)
+    start = time.monotonic()
+    with limiter.limit(10, Priority.INTERACTIVE):
+        pass
+    assert time.monotonic() - start < 0.5
+    for slot in slots:
+        limiter.release(slot)
+
+def test_async_requests_are_limited_and_prioritized():
+    limiter = RateLimiter(requests_per_minute=1000, tokens_per_minute=10**6, max_concurrency=1)
+    order = []
+
+    async def worker(name, priority):
+        async with limiter.limit_async(10, priority):
+            order.append(name)
+            await asyncio.sleep(0.02)
+
+    async def run():
+        blocker = limiter.acquire(10, Priority.BULK)
+        tasks = []
+        for name, priority in [("bulk1", Priority.BULK), ("bulk2", Priority.BULK), ("analyst", Priority.INTERACTIVE)]:
+            tasks.append(asyncio.create_task(worker(name, priority)))
+            await asyncio.sleep(0.02)
+        limiter.release(blocker)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert order == ["analyst", "bulk1", "bulk2"]
+    assert limiter.in_flight == 0
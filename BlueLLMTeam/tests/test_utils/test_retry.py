@@ -0,0 +1,70 @@
+import time
+import pytest
+from BlueLLMTeam.utils.retry import RetryPolicy, CircuitBreaker, CircuitOpenError
+
+def test_delay_is_capped():
+    policy = RetryPolicy(base_delay=1.0, max_delay=4.0)
+    for attempt in range(10):
+        assert 0.0 <= policy.delay(attempt) <= min(4.0, 2 ** attempt)
+
+def test_delay_respects_retry_after():
+    policy = RetryPolicy(base_delay=0.01, max_delay=0.01)
+    assert policy.delay(0, retry_after=2.0) == 2.0
+
+def test_circuit_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.on_failure()
+    breaker.on_success()
+    for _ in range(3):
+        breaker.before_call()
+        breaker.on_failure()
+    assert breaker.is_open
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+def test_half_open_probe():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    breaker.on_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    time.sleep(0.06)
+    # Only one probe is let through
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.on_success()
+    breaker.before_call()
+    assert not breaker.is_open
+
+def test_failed_probe_reopens():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    breaker.trip()
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.on_failure()
+    assert breaker.is_open
+
+def test_released_probe_lets_the_next_call_probe():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.05)
+    breaker.trip()
+    time.sleep(0.06)
+    assert breaker.before_call()
+    # Fails fast while the probe is in flight
+    assert breaker.is_open
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.release_probe()
+    assert not breaker.is_open
+    assert breaker.before_call()
+    breaker.on_success()
+    assert not breaker.before_call()
+
+def test_release_probe_does_not_close_an_open_circuit():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60)
+    breaker.trip()
+    breaker.release_probe()
+    assert breaker.is_open
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
@@ -0,0 +1,34 @@
+from BlueLLMTeam.utils.similarity import SimilarityIndex, ngrams, cosine_similarity, canonical_command, subject_name, SEMANTIC_CACHE_THRESHOLD
+
+def test_cosine_similarity():
+    assert cosine_similarity(ngrams("/home/a.txt"), ngrams("/home/a.txt")) == 1.0
+    similar = cosine_similarity(ngrams("/home/finance/2023/report.txt"), ngrams("/home/finance/2024/report.txt"))
+    different = cosine_similarity(ngrams("/home/hr/employees.csv"), ngrams("/home/finance/q4_report.txt"))
+    assert similar >= SEMANTIC_CACHE_THRESHOLD > different
+
+def test_subject_name():
+    assert subject_name("/home/alice/.ssh/id_rsa") == subject_name("/home/bob/.ssh/id_rsa") == "id_rsa"
+    assert subject_name("cat /home/alice/notes.txt") == subject_name("cat /home/bob/notes.txt")
+    assert subject_name("/home/admin/passwords.txt") != subject_name("/home/admin/password.txt")
+    assert subject_name("wget a.sh") != subject_name("wget b.sh")
+
+def test_canonical_command():
+    assert canonical_command("ls -la") == canonical_command("ls  -al")
+    assert canonical_command("ls --all") == "ls --all"
+
+def test_search_finds_most_similar():
+    index = SimilarityIndex()
+    index.add("scope", "/home/finance/q3_report.txt", "q3")
+    index.add("scope", "/home/hr/employees.csv", "employees")
+    match = index.search("scope", "/home/finance/q4_report.txt")
+    assert match.value == "q3"
+    assert SEMANTIC_CACHE_THRESHOLD <= match.similarity < 1.0
+    assert index.search("other", "/home/finance/q4_report.txt") is None
+
+def test_oldest_entries_are_dropped():
+    index = SimilarityIndex(max_entries=2)
+    for subject in ["aaa", "bbb", "ccc"]:
+        index.add("scope", subject, subject)
+    assert len(index) == 2
+    assert index.search("scope", "aaa") is None
+    assert index.search("scope", "ccc").similarity == 1.0
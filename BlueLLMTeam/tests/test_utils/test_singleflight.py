@@ -0,0 +1,97 @@
+import time
+import asyncio
+import threading
+import pytest
+from BlueLLMTeam.utils.singleflight import SingleFlight, AsyncSingleFlight
+
+def test_concurrent_calls_are_coalesced():
+    group = SingleFlight()
+    calls = []
+
+    def slow(value):
+        calls.append(value)
+        time.sleep(0.1)
+        return value * 2
+
+    results = []
+    def worker():
+        results.append(group.do("key", slow, 21))
+
+    threads = [threading.Thread(target=worker) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert [result for result, _ in results] == [42] * 5
+    assert sum(shared for _, shared in results) == 4
+    assert group.in_flight() == 0
+
+def test_sequential_calls_are_not_coalesced():
+    group = SingleFlight()
+    assert group.do("key", lambda: 1) == (1, False)
+    assert group.do("key", lambda: 2) == (2, False)
+
+def test_errors_are_shared_and_forgotten():
+    group = SingleFlight()
+    started = threading.Event()
+
+    def fail():
+        started.set()
+        time.sleep(0.1)
+        raise ValueError("backend down")
+
+    errors = []
+    def follower():
+        started.wait()
+        try:
+            group.do("key", fail)
+        except ValueError as e:
+            errors.append(e)
+
+    t = threading.Thread(target=follower)
+    t.start()
+    with pytest.raises(ValueError):
+        group.do("key", fail)
+    t.join()
+    assert len(errors) == 1
+    assert group.do("key", lambda: "ok") == ("ok", False)
+
+def test_async_concurrent_calls_are_coalesced():
+    group = AsyncSingleFlight()
+    calls = []
+
+    async def slow(value):
+        calls.append(value)
+        await asyncio.sleep(0.05)
+        return value * 2
+
+    async def run():
+        return await asyncio.gather(*(group.do("key", slow, 21) for _ in range(5)))
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert [result for result, _ in results] == [42] * 5
+    assert sum(shared for _, shared in results) == 4
+    assert group.in_flight() == 0
+
+def test_async_waiters_survive_a_cancelled_caller():
+    group = AsyncSingleFlight()
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return 1
+
+    async def run():
+        leader = asyncio.create_task(group.do("key", slow))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(group.do("key", slow))
+        await asyncio.sleep(0)
+        follower.cancel()
+        assert await leader == (1, False)
+        with pytest.raises(asyncio.CancelledError):
+            await follower
+
+    asyncio.run(run())
+    assert group.in_flight() == 0
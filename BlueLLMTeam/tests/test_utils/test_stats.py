@@ -0,0 +1,32 @@
+import time
+from BlueLLMTeam.utils.stats import RollingStats
+
+def test_empty_stats():
+    stats = RollingStats()
+    assert len(stats) == 0
+    assert stats.error_rate == 0.0
+    assert stats.mean_latency is None
+    assert stats.percentile(95) is None
+
+def test_latency_and_error_rate():
+    stats = RollingStats()
+    for latency in [1.0, 2.0, 3.0]:
+        stats.add(latency)
+    stats.add(10.0, ok=False)
+    assert stats.mean_latency == 2.0
+    assert stats.error_rate == 0.25
+    assert stats.percentile(0) == 1.0
+    assert stats.percentile(100) == 3.0
+
+def test_window_size():
+    stats = RollingStats(size=2)
+    for latency in [5.0, 1.0, 1.0]:
+        stats.add(latency)
+    assert stats.mean_latency == 1.0
+
+def test_old_samples_expire():
+    stats = RollingStats(max_age=0.05)
+    stats.add(1.0, ok=False)
+    time.sleep(0.06)
+    assert len(stats) == 0
+    assert stats.error_rate == 0.0
@@ -0,0 +1,28 @@
+from BlueLLMTeam.utils.token_budget import TokenBudget
+
+def test_no_budget_without_history():
+    budget = TokenBudget(min_samples=3)
+    assert budget.max_tokens({"kind": "python_advisor"}, 4096) == 4096
+    assert budget.max_tokens({}, 4096) == 4096
+
+def test_budget_follows_history():
+    budget = TokenBudget(min_samples=3, percentile=100, headroom=1.5, min_tokens=1)
+    for n in [100, 200, 150]:
+        budget.record({"kind": "python_advisor"}, n)
+    assert budget.max_tokens({"kind": "python_advisor"}, 4096) == 300
+    assert budget.max_tokens({"kind": "python_advisor"}, 250) == 250
+    assert budget.max_tokens({"kind": "python_coder"}, 4096) == 4096
+
+def test_budget_per_file_extension():
+    budget = TokenBudget(min_samples=1, percentile=100, headroom=1.0, min_tokens=1)
+    budget.record({"kind": "file_contents_employee", "target": "/a/b.csv"}, 1000)
+    budget.record({"kind": "file_contents_employee", "target": "/a/b.txt"}, 100)
+    assert budget.max_tokens({"kind": "file_contents_employee", "target": "/c.csv"}, 4096) == 1000
+    assert budget.max_tokens({"kind": "file_contents_employee", "target": "/c.txt"}, 4096) == 100
+
+def test_history_is_saved(tmp_path):
+    path = tmp_path / "history.json"
+    budget = TokenBudget(path, min_samples=1, percentile=100, headroom=1.0, min_tokens=1)
+    budget.record({"kind": "linux_command_response"}, 40)
+    budget.save()
+    assert TokenBudget(path, min_samples=1, percentile=100, headroom=1.0, min_tokens=1).max_tokens({"kind": "linux_command_response"}, 1024) == 40